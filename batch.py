@@ -0,0 +1,273 @@
+import os
+import json
+import time
+import uuid
+import hashlib
+import urllib.error
+import urllib.request
+import openai
+from llm_client import DEFAULT_MODEL, get_cache, chat_completion
+from llm_cache import make_key
+from checkpoint import atomic_write_json
+from summarization import (
+    REDUCE_FANOUT, SUMMARY_MAX_TOKENS, COMBINE_MAX_TOKENS, summary_messages, combine_messages, reduce_groups
+)
+from retrieval import DEFAULT_THEME
+
+# Where batch input files and the resume manifest are kept, relative to the project root.
+DEFAULT_BATCH_DIR = ".batch_runs"
+MANIFEST_FILE = "manifest.json"
+
+# Endpoint the batched requests are sent to, and how long the API may take to run a batch.
+BATCH_ENDPOINT = "/v1/chat/completions"
+COMPLETION_WINDOW = "24h"
+
+# Seconds between two status checks of a running batch.
+DEFAULT_POLL_SECONDS = 30
+
+# Batch statuses after which nothing more will happen.
+FINISHED_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+class BatchError(Exception):
+    """Raised when the Batch API rejects a request or a batch ends without output."""
+
+class BatchAPI:
+    """
+    Minimal client for the OpenAI Files and Batches endpoints, over plain HTTP.
+
+    Parameters:
+      - base_url (str): API base (defaults to OPENAI_API_BASE, then https://api.openai.com/v1).
+      - api_key (str): API key (defaults to the key loaded by llm_client).
+      - timeout (float): Seconds to wait for each HTTP response.
+    """
+
+    def __init__(self, base_url=None, api_key=None, timeout=60):
+        self.base_url = (base_url or os.getenv("OPENAI_API_BASE") or "https://api.openai.com/v1").rstrip("/")
+        self.api_key = api_key or openai.api_key
+        self.timeout = timeout
+
+    def _request(self, method, path, body=None, content_type="application/json"):
+        """Sends one request and returns the raw response body."""
+        headers = {"Authorization": f"Bearer {self.api_key}"}
+        if body is not None:
+            headers["Content-Type"] = content_type
+        request = urllib.request.Request(self.base_url + path, data=body, headers=headers, method=method)
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return response.read()
+        except urllib.error.HTTPError as e:
+            raise BatchError(f"{method} {path} failed with HTTP {e.code}: {e.read()[:500]!r}") from e
+
+    def _json(self, method, path, payload=None):
+        body = json.dumps(payload).encode("utf-8") if payload is not None else None
+        return json.loads(self._request(method, path, body))
+
+    def upload_file(self, path):
+        """
+        Uploads a JSONL input file with purpose 'batch'.
+
+        Returns:
+          - str: The file ID.
+        """
+        boundary = uuid.uuid4().hex
+        with open(path, "rb") as f:
+            content = f.read()
+        body = (
+            f"--{boundary}\r\nContent-Disposition: form-data; name=\"purpose\"\r\n\r\nbatch\r\n"
+            f"--{boundary}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"{os.path.basename(path)}\"\r\n"
+            "Content-Type: application/jsonl\r\n\r\n"
+        ).encode("utf-8") + content + f"\r\n--{boundary}--\r\n".encode("utf-8")
+        response = json.loads(self._request("POST", "/files", body, f"multipart/form-data; boundary={boundary}"))
+        return response["id"]
+
+    def create_batch(self, input_file_id):
+        """Starts a batch over an uploaded input file and returns the batch object."""
+        return self._json("POST", "/batches", {
+            "input_file_id": input_file_id,
+            "endpoint": BATCH_ENDPOINT,
+            "completion_window": COMPLETION_WINDOW,
+        })
+
+    def get_batch(self, batch_id):
+        """Returns the current batch object (status, request counts, output and error file IDs)."""
+        return self._json("GET", f"/batches/{batch_id}")
+
+    def file_content(self, file_id):
+        """Downloads a file (e.g. a batch's output) and returns its bytes."""
+        return self._request("GET", f"/files/{file_id}/content")
+
+def batch_line(custom_id, messages, max_tokens, model=DEFAULT_MODEL, temperature=0.7):
+    """Returns one line of a Batch API input file (a chat completion request) as a dict."""
+    return {
+        "custom_id": custom_id,
+        "method": "POST",
+        "url": BATCH_ENDPOINT,
+        "body": {"model": model, "messages": messages, "temperature": temperature, "max_tokens": max_tokens},
+    }
+
+class BatchRunner:
+    """
+    Answers sets of chat completion requests through the Batch API, via the shared response cache.
+
+    Each request's custom ID is its llm_client cache key, so results map straight back into the
+    cache; requests that are already cached are never submitted. Every submitted batch is recorded
+    in a manifest under `directory` (keyed by the set of custom IDs it contains), so an interrupted
+    run resumes polling the same batch instead of submitting it again.
+
+    Parameters:
+      - api (BatchAPI): The API client (a default one is created if omitted).
+      - directory (str): Where input files and the manifest are kept.
+      - poll_seconds (float): Seconds between status checks.
+      - model (str): The model of every request.
+    """
+
+    def __init__(self, api=None, directory=DEFAULT_BATCH_DIR, poll_seconds=DEFAULT_POLL_SECONDS, model=DEFAULT_MODEL):
+        self.api = api or BatchAPI()
+        self.directory = directory
+        self.poll_seconds = poll_seconds
+        self.model = model
+        self.stats = {"requests": 0, "cached": 0, "submitted": 0, "failed": 0, "batches": 0}
+        os.makedirs(directory, exist_ok=True)
+
+    def _manifest_path(self):
+        return os.path.join(self.directory, MANIFEST_FILE)
+
+    def _load_manifest(self):
+        if not os.path.exists(self._manifest_path()):
+            return {"batches": {}}
+        with open(self._manifest_path(), "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _save_manifest(self, manifest):
+        """Writes the manifest atomically and durably (see checkpoint.atomic_write_json)."""
+        atomic_write_json(self._manifest_path(), manifest, indent=2)
+
+    def complete(self, requests):
+        """
+        Returns the completion of every request, submitting the uncached ones as one batch.
+
+        Parameters:
+          - requests (list): (messages, max_tokens) tuples.
+
+        Returns:
+          - list of str: The stripped completions, in the order of `requests`.
+
+        Requests the batch could not answer are sent through the interactive path instead.
+        """
+        cache = get_cache()
+        keys = [make_key(self.model, messages, 0.7, max_tokens) for messages, max_tokens in requests]
+        pending = {}
+        for key, (messages, max_tokens) in zip(keys, requests):
+            if key not in pending and not cache.contains(key):
+                pending[key] = (messages, max_tokens)
+        self.stats["requests"] += len(requests)
+        self.stats["cached"] += len(requests) - len(pending)
+        if pending:
+            self._run_batch(pending)
+        results = []
+        for key, (messages, max_tokens) in zip(keys, requests):
+            content = cache.get(key)
+            if content is None:
+                # Failed or missing in the batch output: fall back to a regular request.
+                self.stats["failed"] += 1
+                content = chat_completion(messages, model=self.model, temperature=0.7, max_tokens=max_tokens)
+            results.append(content)
+        return results
+
+    def _run_batch(self, pending):
+        """Submits (or resumes) the batch for `pending` requests and stores its results in the cache."""
+        batch_key = hashlib.sha256("\n".join(sorted(pending)).encode("utf-8")).hexdigest()[:16]
+        manifest = self._load_manifest()
+        entry = manifest["batches"].get(batch_key)
+        if entry is not None and entry["status"] in {"failed", "expired", "cancelled"}:
+            entry = None  # Submit again.
+        if entry is None:
+            input_path = os.path.join(self.directory, f"{batch_key}.jsonl")
+            with open(input_path, "w", encoding="utf-8") as f:
+                for key, (messages, max_tokens) in pending.items():
+                    f.write(json.dumps(batch_line(key, messages, max_tokens, self.model), ensure_ascii=False) + "\n")
+            file_id = self.api.upload_file(input_path)
+            batch = self.api.create_batch(file_id)
+            entry = {"batch_id": batch["id"], "input_file_id": file_id, "status": batch["status"],
+                     "requests": len(pending), "collected": False}
+            manifest["batches"][batch_key] = entry
+            self._save_manifest(manifest)
+            self.stats["submitted"] += len(pending)
+            self.stats["batches"] += 1
+            print(f"Submitted batch {batch['id']} with {len(pending)} requests.")
+        else:
+            print(f"Resuming batch {entry['batch_id']} ({entry['status']}).")
+        if entry["collected"]:
+            return
+        batch = self._wait(entry["batch_id"])
+        entry["status"] = batch["status"]
+        if batch["status"] == "completed":
+            self._collect(batch)
+            entry["collected"] = True
+        else:
+            print(f"Batch {batch['id']} ended with status {batch['status']}.")
+        self._save_manifest(manifest)
+
+    def _wait(self, batch_id):
+        """Polls a batch until it reaches a final status."""
+        while True:
+            batch = self.api.get_batch(batch_id)
+            if batch["status"] in FINISHED_STATUSES:
+                return batch
+            counts = batch.get("request_counts") or {}
+            print(f"Batch {batch_id} is {batch['status']} ({counts.get('completed', 0)}/{counts.get('total', '?')} done)...")
+            time.sleep(self.poll_seconds)
+
+    def _collect(self, batch):
+        """Downloads a completed batch's output and stores every successful completion in the cache."""
+        cache = get_cache()
+        stored = 0
+        if batch.get("output_file_id"):
+            for line in self.api.file_content(batch["output_file_id"]).decode("utf-8").splitlines():
+                if not line.strip():
+                    continue
+                result = json.loads(line)
+                response = result.get("response") or {}
+                if result.get("error") or response.get("status_code") != 200:
+                    continue
+                cache.put(result["custom_id"], response["body"]["choices"][0]["message"]["content"].strip())
+                stored += 1
+        print(f"Batch {batch['id']} completed: {stored} results stored.")
+
+def summarize_books_batch(books_chunks, runner=None, fanout=REDUCE_FANOUT, theme=DEFAULT_THEME):
+    """
+    Summarizes several books with the same map-reduce as summarization.summarize_book, one batch per level.
+
+    The chunk summaries of every book go into one batch; then each reduce level of every book
+    goes into the next batch, until each book has a single summary. The results end up in the
+    response cache, so summarize_book on the same chunks afterwards makes no requests.
+
+    Parameters:
+      - books_chunks (list): For each book, the list of its chunks.
+      - runner (BatchRunner): Runs the batches (a default one is created if omitted).
+      - fanout (int): Number of summaries merged together at each reduce step.
+      - theme (str): The theme the summaries focus on.
+
+    Returns:
+      - list of str: One summary per book ("" for a book without chunks).
+    """
+    runner = runner or BatchRunner()
+    levels = [list(chunks) for chunks in books_chunks]
+    requests = [[(summary_messages(chunk, theme), SUMMARY_MAX_TOKENS) for chunk in chunks] for chunks in levels]
+    level = 0
+    while any(requests):
+        print(f"Batch level {level}: {sum(len(r) for r in requests)} requests for {len(requests)} books...")
+        flat = runner.complete([request for book_requests in requests for request in book_requests])
+        position = 0
+        for book, book_requests in enumerate(requests):
+            if book_requests:
+                levels[book] = flat[position:position + len(book_requests)]
+                position += len(book_requests)
+        # Books with more than one summary left are reduced in the next batch.
+        requests = [
+            [(combine_messages(group, theme), COMBINE_MAX_TOKENS) for group in reduce_groups(summaries, fanout)]
+            if len(summaries) > 1 else []
+            for summaries in levels
+        ]
+        level += 1
+    return [summaries[0] if summaries else "" for summaries in levels]
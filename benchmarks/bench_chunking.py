@@ -0,0 +1,83 @@
+"""
+Benchmarks the token-budgeted chunker (text_processing.chunk_spans) against chunk_text.
+
+Usage (from the project root):
+    python -m benchmarks.bench_chunking [--paragraphs 2000] [--tokens 1000] [--overlap 0,100] [--repeat 3]
+
+The chunkers run on the normalized, cleaned text of each book in Readings and on a synthetic text of
+--paragraphs paragraphs (benchmarks.synthetic) in which every tenth paragraph is one run-on
+"sentence" far longer than a chunk. chunk_text gets the character budget that matches --tokens
+(four characters per token). For each run the best wall-clock time, the peak Python memory, the
+number of chunks, the largest chunk in tokens (text_processing.count_tokens) and the number of
+chunks over the token budget are reported.
+"""
+import time
+import argparse
+import contextlib
+import tracemalloc
+
+import main
+from ingestion import iter_book
+from text_processing import clean_text, chunk_text, chunk_spans, count_tokens
+from benchmarks.synthetic import make_paragraphs
+
+def measure(func, repeat):
+    """Returns the best wall-clock time of `repeat` calls, the peak traced memory of one more call and its result."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    tracemalloc.start()
+    try:
+        result = func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return best, peak, result
+
+def synthetic_text(paragraphs):
+    """Cleaned synthetic prose where every tenth paragraph is a single sentence without a full stop."""
+    texts = make_paragraphs(paragraphs)
+    for i in range(0, len(texts), 10):
+        texts[i] = " ".join(texts[i:i + 10]).replace(".", ",").replace("?", ",").replace("!", ",")
+    return clean_text(" ".join(texts))
+
+def texts(paragraphs):
+    """Yields (label, cleaned text) for the books in Readings and the synthetic text."""
+    for name, path, file_type in main.BOOKS:
+        try:
+            with contextlib.redirect_stdout(None):
+                text = clean_text("".join(iter_book(path, file_type, normalize=True)))
+        except (OSError, ValueError) as e:
+            print(f"Skipping {name}: {e}")
+            continue
+        yield name, text
+    yield f"synthetic {paragraphs}", synthetic_text(paragraphs)
+
+def report(label, chunker, seconds, peak, chunks, max_tokens):
+    """Prints one result row."""
+    sizes = [count_tokens(chunk) for chunk in chunks]
+    over = sum(size > max_tokens for size in sizes)
+    print(f"{label:<20} {chunker:<24} {seconds:>9.3f} {peak / 1e6:>9.1f} {len(chunks):>7} {max(sizes, default=0):>8} {over:>6}")
+
+def main_benchmark():
+    parser = argparse.ArgumentParser(description="Benchmark token-budgeted chunking against chunk_text.")
+    parser.add_argument("--paragraphs", type=int, default=2000, help="Paragraphs of the synthetic text.")
+    parser.add_argument("--tokens", type=int, default=1000, help="Token budget of a chunk.")
+    parser.add_argument("--overlap", default="0,100", help="Comma-separated overlap budgets (tokens) for chunk_spans.")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per measurement (best time is kept).")
+    args = parser.parse_args()
+
+    print(f"{'text':<20} {'chunker':<24} {'seconds':>9} {'peak MB':>9} {'chunks':>7} {'max tok':>8} {'over':>6}")
+    for label, text in texts(args.paragraphs):
+        seconds, peak, chunks = measure(lambda: chunk_text(text, 4 * args.tokens), args.repeat)
+        report(label, "chunk_text", seconds, peak, chunks, args.tokens)
+        for overlap in sorted({int(o) for o in args.overlap.split(",")}):
+            seconds, peak, spans = measure(lambda: chunk_spans(text, args.tokens, overlap), args.repeat)
+            report("", f"chunk_spans, overlap {overlap}", seconds, peak,
+                   [text[start:end] for start, end in spans], args.tokens)
+
+if __name__ == "__main__":
+    main_benchmark()
@@ -0,0 +1,75 @@
+"""
+Benchmarks the EPUB reader against the previous ebooklib/BeautifulSoup implementation.
+
+Usage (from the project root):
+    python -m benchmarks.bench_epub [--sizes 20x50,200x50] [--workers 1,4] [--repeat 3]
+
+The real book (Readings/franz-kafka_metamorphosis.epub) is always measured; each entry of
+--sizes adds a synthetic EPUB with CHAPTERSxPARAGRAPHS documents. For every book the best
+wall-clock time of the legacy reader and of ingestion.read_epub per worker count is reported.
+"""
+import os
+import time
+import argparse
+import tempfile
+import warnings
+
+import ingestion
+from benchmarks.synthetic import make_epub
+
+def legacy_read_epub(file_path):
+    """
+    The reader replaced by ingestion.read_epub: manifest order, BeautifulSoup's pure-Python
+    html.parser and string concatenation (without the SIGALRM timeout).
+    """
+    from ebooklib import epub
+    from bs4 import BeautifulSoup
+    warnings.filterwarnings("ignore", category=UserWarning, module="ebooklib.epub")
+    warnings.filterwarnings("ignore", category=FutureWarning, module="ebooklib.epub")
+    book = epub.read_epub(file_path)
+    text = ""
+    for item in book.get_items():
+        if item.get_type() == 'application/xhtml+xml' or isinstance(item, epub.EpubHtml):
+            soup = BeautifulSoup(item.get_content(), "html.parser")
+            text += soup.get_text(separator="\n") + "\n"
+    return text
+
+def read_epub_with_workers(path, workers):
+    """Same output as ingestion.read_epub, with a fixed number of parsing processes."""
+    return "".join(item + "\n" for item in ingestion.iter_epub_items(path, max_workers=workers))
+
+def best_time(func, repeat):
+    """Returns the best wall-clock time (seconds) of `repeat` calls and the last result."""
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark EPUB text extraction.")
+    parser.add_argument("--sizes", default="20x50,200x50", help="Synthetic books as CHAPTERSxPARAGRAPHS, comma-separated.")
+    parser.add_argument("--workers", default=f"1,{os.cpu_count() or 1}", help="Comma-separated worker counts.")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per measurement (best time is kept).")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        books = [("metamorphosis", "Readings/franz-kafka_metamorphosis.epub")]
+        for size in filter(None, args.sizes.split(",")):
+            chapters, paragraphs = (int(n) for n in size.split("x"))
+            books.append((f"synthetic {size}", make_epub(os.path.join(tmp_dir, f"{size}.epub"), chapters, paragraphs)))
+
+        print(f"{'book':<20} {'reader':<16} {'seconds':>9} {'MB/s':>8} {'speedup':>8}")
+        for label, path in books:
+            legacy_time, legacy_text = best_time(lambda: legacy_read_epub(path), args.repeat)
+            megabytes = len(legacy_text.encode("utf-8")) / 1e6
+            print(f"{label:<20} {'legacy':<16} {legacy_time:>9.3f} {megabytes / legacy_time:>8.2f} {1:>7.2f}x")
+            for workers in sorted({int(w) for w in args.workers.split(",")}):
+                elapsed, _ = best_time(lambda: read_epub_with_workers(path, workers), args.repeat)
+                print(f"{'':<20} {f'lxml, {workers} worker(s)':<16} {elapsed:>9.3f} {megabytes / elapsed:>8.2f} {legacy_time / elapsed:>7.2f}x")
+
+if __name__ == "__main__":
+    main()
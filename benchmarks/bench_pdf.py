@@ -0,0 +1,48 @@
+"""
+Benchmarks ingestion.extract_pdf_pages against the number of worker processes.
+
+Usage (from the project root):
+    python -m benchmarks.bench_pdf [--pdf PATH] [--workers 1,2,4] [--repeat 3]
+
+For each worker count the best wall-clock time over `--repeat` runs is reported,
+together with pages per second and the speedup relative to a single worker.
+"""
+import argparse
+import os
+import time
+
+from ingestion import extract_pdf_pages
+
+def time_extraction(pdf_path, workers, repeat):
+    """
+    Returns the best wall-clock time (seconds) and page count for one worker count.
+    """
+    best = None
+    pages = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        pages = len(extract_pdf_pages(pdf_path, max_workers=workers))
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, pages
+
+def main():
+    cpu_count = os.cpu_count() or 1
+    default_workers = sorted({1, 2, 4, 8, cpu_count} & set(range(1, cpu_count + 1)))
+    parser = argparse.ArgumentParser(description="Benchmark page-parallel PDF extraction.")
+    parser.add_argument("--pdf", default="Readings/the_stranger.pdf", help="PDF file to extract.")
+    parser.add_argument("--workers", default=",".join(str(w) for w in default_workers),
+                        help="Comma-separated worker counts to measure.")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per worker count (best time is kept).")
+    args = parser.parse_args()
+
+    print(f"PDF: {args.pdf} ({cpu_count} CPUs available)")
+    print(f"{'workers':>8} {'seconds':>9} {'pages/s':>9} {'speedup':>8}")
+    baseline = None
+    for workers in (int(w) for w in args.workers.split(",")):
+        elapsed, pages = time_extraction(args.pdf, workers, args.repeat)
+        baseline = baseline or elapsed
+        print(f"{workers:>8} {elapsed:>9.2f} {pages / elapsed:>9.1f} {baseline / elapsed:>7.2f}x")
+
+if __name__ == "__main__":
+    main()
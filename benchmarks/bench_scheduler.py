@@ -0,0 +1,79 @@
+"""
+Runs the shared OpenAI client layer against the throttling mock server (benchmarks.mock_openai).
+
+Usage (from the project root):
+    python -m benchmarks.bench_scheduler [--requests 200] [--server-rpm 600] [--throttle-rate 0.05]
+
+A burst of bulk (chunk summary) requests is sent through llm_client.achat_completion, and a few
+report requests are queued behind them shortly after. The run is repeated with the scheduler's
+limits set to the server's and with effectively no limits, and for each it reports the wall-clock
+time, the 429s seen by the server, the client's retries and failures, and how long report
+requests waited compared to bulk requests.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+
+import openai
+import llm_client
+from llm_cache import LLMCache
+from llm_scheduler import RequestScheduler, PRIORITY_BULK, PRIORITY_REPORT
+from benchmarks.mock_openai import start_server
+
+async def timed_request(index, priority, delay=0.0):
+    """Sends one request after `delay` seconds and returns (priority, seconds until it completed)."""
+    await asyncio.sleep(delay)
+    start = time.perf_counter()
+    try:
+        await llm_client.achat_completion(
+            messages=[{"role": "user", "content": f"Summarize section {index} of the benchmark book."}],
+            max_tokens=150,
+            priority=priority
+        )
+    except Exception as e:
+        print(f"Request {index} failed: {type(e).__name__}")
+    return priority, time.perf_counter() - start
+
+async def burst(requests, report_requests):
+    tasks = [timed_request(i, PRIORITY_BULK) for i in range(requests)]
+    tasks += [timed_request(requests + i, PRIORITY_REPORT, delay=1.0) for i in range(report_requests)]
+    return await asyncio.gather(*tasks)
+
+def run(label, scheduler, args):
+    """Runs one burst against a fresh mock server and prints a result line."""
+    server = start_server(rpm=args.server_rpm, max_concurrency=args.server_concurrency,
+                          throttle_rate=args.throttle_rate, latency=args.latency, seed=1)
+    openai.api_base = server.url
+    llm_client.set_scheduler(scheduler)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # A fresh cache so that every request reaches the server.
+        llm_client.set_cache(LLMCache(os.path.join(tmp_dir, "cache.sqlite3")))
+        start = time.perf_counter()
+        results = asyncio.run(burst(args.requests, args.report_requests))
+        elapsed = time.perf_counter() - start
+    server.shutdown()
+    bulk = [seconds for priority, seconds in results if priority == PRIORITY_BULK]
+    report = [seconds for priority, seconds in results if priority == PRIORITY_REPORT]
+    client = scheduler.summary()
+    print(f"{label:<12} {elapsed:>8.1f} {server.stats['throttled']:>6} {client['retries']:>8} {client['failures']:>9} "
+          f"{statistics.median(bulk):>12.2f} {statistics.median(report) if report else 0:>14.2f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the OpenAI rate limiter and retry scheduler against a mock server.")
+    parser.add_argument("--requests", type=int, default=200, help="Number of bulk requests in the burst.")
+    parser.add_argument("--report-requests", type=int, default=6, help="Report requests queued after the burst starts.")
+    parser.add_argument("--server-rpm", type=int, default=600, help="Requests per minute the mock server accepts.")
+    parser.add_argument("--server-concurrency", type=int, default=8, help="Concurrent requests the mock server accepts.")
+    parser.add_argument("--throttle-rate", type=float, default=0.05, help="Fraction of requests the server throttles at random.")
+    parser.add_argument("--latency", type=float, default=0.2, help="Seconds each mock completion takes.")
+    args = parser.parse_args()
+
+    print(f"{'scheduler':<12} {'seconds':>8} {'429s':>6} {'retries':>8} {'failures':>9} {'bulk median':>12} {'report median':>14}")
+    run("limited", RequestScheduler(rpm=args.server_rpm, max_concurrency=args.server_concurrency), args)
+    run("unlimited", RequestScheduler(rpm=10 ** 9, tpm=10 ** 12, max_concurrency=10 ** 6, initial_concurrency=10 ** 6), args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+"""
+Benchmark suite: ingestion, cleaning and chunking on synthetic corpora, plus an end-to-end run.
+
+Usage (from the project root):
+    python -m benchmarks.bench_suite [--scales 1,4] [--repeat 3] [--latency 0.05]
+                                     [--skip-e2e] [--output PATH] [--compare OLD.json]
+
+For every scale, a synthetic XML (RSS with content:encoded, like the Bell Jar file), PDF and EPUB
+book is generated (deterministically, see benchmarks.synthetic) and the following are measured:
+
+- read_xml / read_pdf / read_epub, normalize_units, clean_text, chunk_text and chunk_spans: best wall-clock time over --repeat
+  runs, throughput in input bytes and output characters per second, and peak Python memory
+  (tracemalloc, measured in a separate run; memory of worker processes is not included).
+- main.main end to end on the three synthetic books, against the mock chat completion server
+  (benchmarks.mock_openai) with --latency seconds per request: a cold run (empty caches) and a
+  warm run (everything cached), with the number of requests the server received, peak RSS and
+  the time-to-first-paragraph of the streamed report (None when the report stage was cached).
+
+Results are written as JSON to --output (default: benchmarks/results/<commit>.json). With
+--compare, each measurement is compared with the same one in an earlier results file.
+"""
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import openai
+import ingestion
+import llm_client
+from llm_cache import LLMCache
+from llm_scheduler import RequestScheduler
+from text_processing import clean_text, chunk_text, chunk_spans
+from normalization import normalize_units
+from benchmarks.synthetic import make_xml, make_pdf, make_epub
+from report_stream import read_sidecar, sidecar_paths
+from benchmarks.mock_openai import start_server
+
+# Size of each synthetic book at scale 1 (multiplied by the scale).
+XML_ITEMS = 20
+PDF_PAGES = 20
+EPUB_CHAPTERS = 10
+
+def git_commit():
+    """Returns the current commit hash, or None outside a git checkout."""
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def measure(func, repeat):
+    """
+    Runs func `repeat` times for timing and once more under tracemalloc.
+
+    Returns:
+      - (best seconds, peak traced bytes, result of the last call)
+    """
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return best, peak, result
+
+def record(results, benchmark, scale, seconds, peak, input_bytes, output_chars, **extra):
+    """Appends one result row and prints it."""
+    row = {
+        "benchmark": benchmark,
+        "scale": scale,
+        "seconds": seconds,
+        "peak_memory_bytes": peak,
+        "input_bytes": input_bytes,
+        "output_chars": output_chars,
+        "input_bytes_per_second": input_bytes / seconds if seconds else None,
+        "output_chars_per_second": output_chars / seconds if seconds else None,
+    }
+    row.update(extra)
+    results.append(row)
+    print(f"{benchmark:<14} {scale:>5} {seconds:>9.3f} {input_bytes / 1e6:>9.2f} "
+          f"{(input_bytes / seconds / 1e6) if seconds else 0:>8.2f} {peak / 1e6:>9.1f}")
+
+def make_books(directory, scale, seed=0):
+    """Generates the three synthetic books for a scale; returns (name, path, file_type, reader) tuples."""
+    xml_path = make_xml(os.path.join(directory, f"book-{scale}.xml"), items=XML_ITEMS * scale, seed=seed)
+    pdf_path = make_pdf(os.path.join(directory, f"book-{scale}.pdf"), pages=PDF_PAGES * scale, seed=seed + 1)
+    epub_path = make_epub(os.path.join(directory, f"book-{scale}.epub"), chapters=EPUB_CHAPTERS * scale, seed=seed + 2)
+    return [
+        ("xml", xml_path, "xml", ingestion.read_xml),
+        ("pdf", pdf_path, "pdf", ingestion.read_pdf),
+        ("epub", epub_path, "epub", ingestion.read_epub),
+    ]
+
+def bench_text(results, directory, scale, repeat):
+    """Measures the readers, normalization, clean_text and chunk_text on the synthetic books of one scale."""
+    for name, path, file_type, reader in make_books(directory, scale):
+        with contextlib.redirect_stdout(None):
+            seconds, peak, text = measure(lambda: reader(path), repeat)
+            units = list(ingestion.iter_book_units(path, file_type))
+        record(results, f"read_{name}", scale, seconds, peak, os.path.getsize(path), len(text))
+        seconds, peak, normalized = measure(lambda: list(normalize_units(units, file_type)), repeat)
+        record(results, f"normalize_{name}", scale, seconds, peak, sum(len(unit.encode("utf-8")) for _, unit in units),
+               sum(len(unit) for _, unit in normalized))
+        raw_bytes = len(text.encode("utf-8"))
+        seconds, peak, cleaned = measure(lambda: clean_text(text), repeat)
+        record(results, f"clean_{name}", scale, seconds, peak, raw_bytes, len(cleaned))
+        seconds, peak, chunks = measure(lambda: chunk_text(cleaned), repeat)
+        record(results, f"chunk_{name}", scale, seconds, peak, len(cleaned.encode("utf-8")),
+               sum(len(chunk) for chunk in chunks), chunks=len(chunks))
+        seconds, peak, spans = measure(lambda: chunk_spans(cleaned), repeat)
+        record(results, f"chunk_spans_{name}", scale, seconds, peak, len(cleaned.encode("utf-8")),
+               sum(end - start for start, end in spans), chunks=len(spans))
+
+def bench_end_to_end(results, latency):
+    """Runs main.main on the synthetic books against the mock server, cold and then warm."""
+    import main
+    server = start_server(rpm=100000, max_concurrency=64, latency=latency, seed=0)
+    previous_base = openai.api_base
+    previous_dir = os.getcwd()
+    openai.api_base = server.url
+    try:
+        with tempfile.TemporaryDirectory() as work_dir:
+            # Work in a scratch directory so the corpus store, pipeline cache and report stay isolated.
+            books = make_books(work_dir, 1)
+            os.chdir(work_dir)
+            llm_client.set_cache(LLMCache(os.path.join(work_dir, "llm_cache.sqlite3")))
+            llm_client.set_scheduler(RequestScheduler(rpm=100000, tpm=10 ** 9, max_concurrency=64))
+            argv = ["--output", "report.docx"] + [f"--book={name}={path}" for name, path, _, _ in books]
+            input_bytes = sum(os.path.getsize(path) for _, path, _, _ in books)
+            for label in ("cold", "warm"):
+                for path in sidecar_paths("report.docx"):
+                    if os.path.exists(path):
+                        os.remove(path)
+                requests_before = server.stats["completions"]
+                start = time.perf_counter()
+                with contextlib.redirect_stdout(None):
+                    main.main(argv)
+                seconds = time.perf_counter() - start
+                peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+                # Time-to-first-paragraph, as written by the report stage to the JSONL sidecar.
+                jsonl_path = sidecar_paths("report.docx")[1]
+                _, sidecar = read_sidecar(jsonl_path) if os.path.exists(jsonl_path) else ({}, None)
+                record(results, f"e2e_{label}", 1, seconds, peak_rss, input_bytes, 0,
+                       llm_requests=server.stats["completions"] - requests_before, latency=latency,
+                       first_paragraph_seconds=sidecar["first_paragraph_seconds"] if sidecar else None)
+    finally:
+        os.chdir(previous_dir)
+        openai.api_base = previous_base
+        server.shutdown()
+
+def compare(results, old_path):
+    """Prints the time and memory ratios of each measurement against an earlier results file."""
+    with open(old_path, "r", encoding="utf-8") as f:
+        old = json.load(f)
+    previous = {(row["benchmark"], row["scale"]): row for row in old["results"]}
+    print(f"\nCompared with {old_path} (commit {old.get('commit')}); ratios above 1 are slower / larger:")
+    print(f"{'benchmark':<14} {'scale':>5} {'time':>7} {'memory':>7}")
+    for row in results:
+        before = previous.get((row["benchmark"], row["scale"]))
+        if before is None:
+            continue
+        time_ratio = row["seconds"] / before["seconds"] if before["seconds"] else float("nan")
+        memory_ratio = row["peak_memory_bytes"] / before["peak_memory_bytes"] if before["peak_memory_bytes"] else float("nan")
+        print(f"{row['benchmark']:<14} {row['scale']:>5} {time_ratio:>6.2f}x {memory_ratio:>6.2f}x")
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the benchmark suite on synthetic corpora.")
+    parser.add_argument("--scales", default="1,4", help="Comma-separated corpus scales.")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per measurement (best time is kept).")
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds per mock chat completion in the end-to-end run.")
+    parser.add_argument("--skip-e2e", action="store_true", help="Skip the end-to-end run of main.main.")
+    parser.add_argument("--output", help="Results file (default: benchmarks/results/<commit>.json).")
+    parser.add_argument("--compare", metavar="OLD_JSON", help="Earlier results file to compare with.")
+    args = parser.parse_args()
+
+    commit = git_commit()
+    results = []
+    print(f"{'benchmark':<14} {'scale':>5} {'seconds':>9} {'input MB':>9} {'MB/s':>8} {'peak MB':>9}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for scale in (int(s) for s in args.scales.split(",")):
+            bench_text(results, tmp_dir, scale, args.repeat)
+    if not args.skip_e2e:
+        bench_end_to_end(results, args.latency)
+
+    output = args.output or os.path.join("benchmarks", "results", f"{(commit or 'unknown')[:12]}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump({
+            "commit": commit,
+            "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "repeat": args.repeat,
+            "results": results,
+        }, f, indent=2)
+    print(f"Results written to {output}")
+    if args.compare:
+        compare(results, args.compare)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,307 @@
+"""
+A local fake of the OpenAI chat completions endpoint that injects throttling.
+
+Usage (from the project root):
+    python -m benchmarks.mock_openai [--port 8089] [--rpm 120] [--throttle-rate 0.05] [--latency 0.2]
+
+Point the client at it with OPENAI_API_BASE=http://127.0.0.1:8089/v1 (and any OPENAI_API_KEY).
+
+- POST /v1/chat/completions answers with a short canned completion after `--latency` seconds
+  and reports token usage like the real API. With "stream": true the completion is sent as
+  server-sent events, one word per chunk, with the latency spread over the chunks.
+- Requests beyond `--rpm` requests per minute, or more than `--max-concurrency` at once, get a
+  429 with a Retry-After header; `--throttle-rate` additionally throttles that fraction of
+  requests at random.
+- A stand-in for the Batch API: POST /v1/files (multipart upload), GET /v1/files/<id>/content,
+  POST /v1/batches and GET /v1/batches/<id>. A batch stays 'validating' and then 'in_progress'
+  for `--batch-delay` seconds before it completes; `--batch-error-rate` makes that fraction of
+  its requests fail.
+- GET /stats returns the counters (requests, completions, throttled, peak concurrency) as JSON.
+"""
+import argparse
+import itertools
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from llm_scheduler import TokenBucket
+from text_processing import estimate_tokens
+
+class MockOpenAIServer(ThreadingHTTPServer):
+    """HTTP server holding the throttling settings and counters shared by its handler threads."""
+
+    daemon_threads = True
+    request_queue_size = 256
+
+    def __init__(self, address, rpm=120, max_concurrency=8, throttle_rate=0.0, latency=0.2, seed=None,
+                 batch_delay=1.0, batch_error_rate=0.0):
+        super().__init__(address, MockOpenAIHandler)
+        self.batch_delay = batch_delay
+        self.batch_error_rate = batch_error_rate
+        self.files = {}
+        self.batches = {}
+        self.ids = itertools.count(1)
+        self.bucket = TokenBucket(rpm)
+        self.max_concurrency = max_concurrency
+        self.throttle_rate = throttle_rate
+        self.latency = latency
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.stats = {"requests": 0, "completions": 0, "throttled": 0, "peak_concurrency": 0, "batches": 0}
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def admit(self):
+        """Returns None if the request may proceed, otherwise the reason it is throttled."""
+        with self.lock:
+            self.stats["requests"] += 1
+            reason = None
+            if self.random.random() < self.throttle_rate:
+                reason = "injected"
+            elif self.in_flight >= self.max_concurrency:
+                reason = "concurrency"
+            elif self.bucket.wait_time(1, time.monotonic()) > 0:
+                reason = "rpm"
+            if reason:
+                self.stats["throttled"] += 1
+                return reason
+            self.bucket.take(1)
+            self.in_flight += 1
+            self.stats["peak_concurrency"] = max(self.stats["peak_concurrency"], self.in_flight)
+            return None
+
+    def finish(self):
+        with self.lock:
+            self.in_flight -= 1
+            self.stats["completions"] += 1
+
+    def new_id(self, prefix):
+        with self.lock:
+            return f"{prefix}-mock-{next(self.ids)}"
+
+    def add_file(self, content, filename, purpose):
+        """Stores an uploaded or generated file and returns its file object."""
+        file_id = self.new_id("file")
+        with self.lock:
+            self.files[file_id] = content
+        return {"id": file_id, "object": "file", "bytes": len(content), "filename": filename,
+                "purpose": purpose, "created_at": int(time.time())}
+
+    def create_batch(self, input_file_id, endpoint, completion_window):
+        """Registers a batch and processes it in a background thread."""
+        batch = {
+            "id": self.new_id("batch"), "object": "batch", "endpoint": endpoint, "input_file_id": input_file_id,
+            "completion_window": completion_window, "status": "validating", "created_at": int(time.time()),
+            "output_file_id": None, "error_file_id": None,
+            "request_counts": {"total": 0, "completed": 0, "failed": 0},
+        }
+        with self.lock:
+            self.batches[batch["id"]] = batch
+            self.stats["batches"] += 1
+        threading.Thread(target=self._run_batch, args=(batch,), daemon=True).start()
+        return dict(batch)
+
+    def _run_batch(self, batch):
+        lines = [json.loads(line) for line in self.files[batch["input_file_id"]].decode("utf-8").splitlines() if line.strip()]
+        with self.lock:
+            batch["status"] = "in_progress"
+            batch["request_counts"]["total"] = len(lines)
+        time.sleep(self.batch_delay)
+        outputs = []
+        errors = []
+        for line in lines:
+            if self.random.random() < self.batch_error_rate:
+                errors.append({"id": self.new_id("batch_req"), "custom_id": line["custom_id"], "response": None,
+                               "error": {"code": "server_error", "message": "Injected failure."}})
+            else:
+                outputs.append({"id": self.new_id("batch_req"), "custom_id": line["custom_id"], "error": None,
+                                "response": {"status_code": 200, "request_id": self.new_id("req"),
+                                             "body": completion_body(line["body"], self.new_id("chatcmpl"))}})
+        output_file = self.add_file("".join(json.dumps(o) + "\n" for o in outputs).encode("utf-8"), "output.jsonl", "batch_output")
+        error_file = self.add_file("".join(json.dumps(e) + "\n" for e in errors).encode("utf-8"), "errors.jsonl", "batch_output") if errors else None
+        with self.lock:
+            batch["request_counts"].update(completed=len(outputs), failed=len(errors))
+            batch["output_file_id"] = output_file["id"]
+            batch["error_file_id"] = error_file["id"] if error_file else None
+            batch["status"] = "completed"
+            batch["completed_at"] = int(time.time())
+
+def completion_body(request, completion_id):
+    """Builds the chat completion response to a request body, with a canned answer and token usage."""
+    prompt = " ".join(message.get("content", "") for message in request.get("messages", []))
+    content = f'Mock completion quoting "{prompt[-60:].strip()}"'
+    prompt_tokens = estimate_tokens(prompt)
+    completion_tokens = estimate_tokens(content)
+    return {
+        "id": completion_id,
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": request.get("model", "mock"),
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        },
+    }
+
+def completion_chunks(request, completion_id):
+    """
+    Splits the answer of completion_body into the chunks of a streamed response (stream=True):
+    a role delta, one content delta per word, then an empty delta with the finish reason.
+    """
+    content = completion_body(request, completion_id)["choices"][0]["message"]["content"]
+    words = content.split(" ")
+    deltas = [{"role": "assistant"}] + [{"content": word if i == 0 else " " + word} for i, word in enumerate(words)] + [{}]
+    return [
+        {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": request.get("model", "mock"),
+            "choices": [{"index": 0, "delta": delta, "finish_reason": "stop" if i == len(deltas) - 1 else None}],
+        }
+        for i, delta in enumerate(deltas)
+    ]
+
+def parse_multipart(body, content_type):
+    """Splits a multipart/form-data body into {field name: (filename, content bytes)}."""
+    boundary = content_type.split("boundary=", 1)[1].strip('"').encode("utf-8")
+    fields = {}
+    for part in body.split(b"--" + boundary):
+        if b"\r\n\r\n" not in part:
+            continue
+        header, content = part.split(b"\r\n\r\n", 1)
+        disposition = header.decode("utf-8", "replace")
+        name = disposition.split('name="', 1)[1].split('"', 1)[0]
+        filename = disposition.split('filename="', 1)[1].split('"', 1)[0] if 'filename="' in disposition else None
+        fields[name] = (filename, content[:-2] if content.endswith(b"\r\n") else content)
+    return fields
+
+class MockOpenAIHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass  # Keep benchmark output readable.
+
+    def _send_json(self, status, body, headers=None):
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _send_stream(self, chunks, latency):
+        """Sends chunks as server-sent events, spreading the latency over them like a model generating tokens."""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        for chunk in chunks:
+            time.sleep(latency / len(chunks))
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+    def _send_bytes(self, content):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_GET(self):
+        parts = self.path.strip("/").split("/")
+        if parts[-1] == "stats":
+            with self.server.lock:
+                self._send_json(200, dict(self.server.stats))
+        elif len(parts) >= 3 and parts[-3] == "files" and parts[-1] == "content" and parts[-2] in self.server.files:
+            self._send_bytes(self.server.files[parts[-2]])
+        elif len(parts) >= 2 and parts[-2] == "batches" and parts[-1] in self.server.batches:
+            with self.server.lock:
+                self._send_json(200, json.loads(json.dumps(self.server.batches[parts[-1]])))
+        else:
+            self._send_json(404, {"error": {"message": "Not found", "type": "invalid_request_error"}})
+
+    def do_POST(self):
+        path = self.path.rstrip("/")
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if path.endswith("/files"):
+            fields = parse_multipart(body, self.headers.get("Content-Type", ""))
+            filename, content = fields["file"]
+            self._send_json(200, self.server.add_file(content, filename, fields["purpose"][1].decode("utf-8")))
+            return
+        if path.endswith("/batches"):
+            request = json.loads(body)
+            if request.get("input_file_id") not in self.server.files:
+                self._send_json(400, {"error": {"message": "Unknown input file.", "type": "invalid_request_error"}})
+                return
+            self._send_json(200, self.server.create_batch(request["input_file_id"], request.get("endpoint"),
+                                                          request.get("completion_window")))
+            return
+        if not path.endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": "Not found", "type": "invalid_request_error"}})
+            return
+        request = json.loads(body or b"{}")
+        reason = self.server.admit()
+        if reason:
+            self._send_json(
+                429,
+                {"error": {"message": f"Rate limit reached ({reason}).", "type": "rate_limit_error"}},
+                {"Retry-After": "1"}
+            )
+            return
+        try:
+            if request.get("stream"):
+                self._send_stream(completion_chunks(request, self.server.new_id("chatcmpl")), self.server.latency)
+                return
+            time.sleep(self.server.latency)
+            self._send_json(200, completion_body(request, self.server.new_id("chatcmpl")))
+        finally:
+            self.server.finish()
+
+def start_server(port=0, **settings):
+    """
+    Starts the mock server in a background thread.
+
+    Parameters:
+      - port (int): Port to listen on (0 picks a free port).
+      - settings: rpm, max_concurrency, throttle_rate, latency, seed, batch_delay and batch_error_rate
+        (see MockOpenAIServer).
+
+    Returns:
+      - MockOpenAIServer: The running server; its `url` is the API base. Call shutdown() to stop it.
+    """
+    server = MockOpenAIServer(("127.0.0.1", port), **settings)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a fake OpenAI chat completions server that injects throttling.")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--rpm", type=int, default=120, help="Requests per minute before 429s are returned.")
+    parser.add_argument("--max-concurrency", type=int, default=8, help="Concurrent requests before 429s are returned.")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Fraction of requests throttled at random.")
+    parser.add_argument("--latency", type=float, default=0.2, help="Seconds each completion takes.")
+    parser.add_argument("--batch-delay", type=float, default=1.0, help="Seconds a batch takes to complete.")
+    parser.add_argument("--batch-error-rate", type=float, default=0.0, help="Fraction of batched requests that fail.")
+    args = parser.parse_args()
+
+    server = MockOpenAIServer(("127.0.0.1", args.port), rpm=args.rpm, max_concurrency=args.max_concurrency,
+                              throttle_rate=args.throttle_rate, latency=args.latency,
+                              batch_delay=args.batch_delay, batch_error_rate=args.batch_error_rate)
+    print(f"Mock OpenAI API listening on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
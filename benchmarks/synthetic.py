@@ -0,0 +1,114 @@
+"""
+Generators for synthetic books used by the benchmarks.
+
+All generators are deterministic for a given seed, so results are comparable between commits.
+"""
+import random
+from xml.sax.saxutils import escape
+
+# Vocabulary used to build sentences; common words keep the sentence tokenizer realistic.
+WORDS = (
+    "the a he she they room door window family father mother sister work train morning night "
+    "alone silence voice looked walked thought felt could would never always again only "
+    "quietly slowly strange small large cold warm empty crowded city street house office letter "
+    "waited listened remembered forgot wanted feared understood between without inside behind"
+).split()
+
+def make_sentence(rng):
+    """Returns one random sentence of 8-24 words."""
+    words = [rng.choice(WORDS) for _ in range(rng.randint(8, 24))]
+    return " ".join(words).capitalize() + rng.choice([".", ".", ".", "?", "!"])
+
+def make_paragraphs(count, seed=0, sentences_per_paragraph=6):
+    """
+    Returns `count` paragraphs of random sentences.
+
+    Parameters:
+      - count (int): Number of paragraphs.
+      - seed (int): Random seed.
+      - sentences_per_paragraph (int): Sentences in each paragraph.
+    """
+    rng = random.Random(seed)
+    return [" ".join(make_sentence(rng) for _ in range(sentences_per_paragraph)) for _ in range(count)]
+
+def make_epub(path, chapters=20, paragraphs_per_chapter=50, seed=0):
+    """
+    Writes a synthetic EPUB with ebooklib.
+
+    Parameters:
+      - path (str): Output file.
+      - chapters (int): Number of XHTML content documents.
+      - paragraphs_per_chapter (int): Paragraphs in each document.
+      - seed (int): Random seed.
+
+    Returns:
+      - str: The output path.
+    """
+    from ebooklib import epub
+    book = epub.EpubBook()
+    book.set_identifier(f"synthetic-{chapters}-{paragraphs_per_chapter}-{seed}")
+    book.set_title("Synthetic Book")
+    book.set_language("en")
+    items = []
+    for number in range(1, chapters + 1):
+        paragraphs = make_paragraphs(paragraphs_per_chapter, seed=seed * 100003 + number)
+        chapter = epub.EpubHtml(title=f"Chapter {number}", file_name=f"chapter_{number:04d}.xhtml", lang="en")
+        chapter.content = f"<h1>Chapter {number}</h1>" + "".join(f"<p>{p}</p>" for p in paragraphs)
+        book.add_item(chapter)
+        items.append(chapter)
+    book.toc = items
+    book.add_item(epub.EpubNcx())
+    book.add_item(epub.EpubNav())
+    book.spine = ["nav"] + items
+    epub.write_epub(path, book)
+    return path
+
+def make_xml(path, items=20, paragraphs_per_item=20, seed=0):
+    """
+    Writes a synthetic WordPress-style RSS export like the Bell Jar file: one <item> per chapter,
+    its HTML body in a namespaced <content:encoded> element.
+
+    Parameters:
+      - path (str): Output file.
+      - items (int): Number of <item> elements.
+      - paragraphs_per_item (int): Paragraphs in each item's body.
+      - seed (int): Random seed.
+
+    Returns:
+      - str: The output path.
+    """
+    with open(path, "w", encoding="utf-8") as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        f.write('<rss xmlns:content="http://purl.org/rss/1.0/modules/content/" '
+                'xmlns:wp="http://wordpress.org/export/1.2/" version="2.0"><channel><title>Synthetic Book</title>')
+        for number in range(1, items + 1):
+            paragraphs = make_paragraphs(paragraphs_per_item, seed=seed * 100003 + number)
+            body = "".join(f"<p>{p}</p>" for p in paragraphs)
+            f.write(f"<item><title>Chapter {number}</title><wp:post_id>{number}</wp:post_id>"
+                    f"<content:encoded>{escape(body)}</content:encoded></item>")
+        f.write("</channel></rss>\n")
+    return path
+
+def make_pdf(path, pages=20, paragraphs_per_page=4, seed=0):
+    """
+    Writes a synthetic PDF with fpdf2, starting a new page for every group of paragraphs.
+
+    Parameters:
+      - path (str): Output file.
+      - pages (int): Number of page groups (long groups may spill over to another page).
+      - paragraphs_per_page (int): Paragraphs in each group.
+      - seed (int): Random seed.
+
+    Returns:
+      - str: The output path.
+    """
+    from fpdf import FPDF
+    pdf = FPDF()
+    pdf.set_font("Helvetica", size=11)
+    for number in range(1, pages + 1):
+        pdf.add_page()
+        for paragraph in make_paragraphs(paragraphs_per_page, seed=seed * 100003 + number):
+            pdf.multi_cell(0, 5, paragraph)
+            pdf.ln(3)
+    pdf.output(path)
+    return path
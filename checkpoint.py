@@ -0,0 +1,244 @@
+import os
+import json
+import time
+import uuid
+import fcntl
+import tempfile
+import threading
+import contextlib
+
+# Default location of run directories, relative to the project root.
+DEFAULT_RUNS_DIR = ".runs"
+
+# File names inside a run directory.
+RUN_FILE = "run.json"
+JOURNAL_FILE = "journal.jsonl"
+LOCK_FILE = ".lock"
+
+def fsync_directory(directory):
+    """Makes a rename or a new file in directory durable (a no-op where directories cannot be opened)."""
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def atomic_write_json(path, value, **dump_options):
+    """
+    Writes a JSON file atomically and durably: the value goes to a temporary file in the same
+    directory, which is flushed to disk and then renamed over path. A reader (or a crash) sees
+    either the old file or the new one, never a partial write.
+    """
+    directory = os.path.dirname(path) or "."
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(value, f, ensure_ascii=False, **dump_options)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(tmp_path)
+        raise
+    fsync_directory(directory)
+
+@contextlib.contextmanager
+def file_lock(path, blocking=True):
+    """
+    Holds an exclusive fcntl lock on path (created if missing) for the duration of the block.
+
+    The lock is released when the process dies, so a crash never leaves it held. With
+    blocking=False, BlockingIOError is raised at once if another process holds the lock.
+    """
+    with open(path, "a") as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+class Journal:
+    """
+    Append-only write-ahead log of JSON records, one per line.
+
+    Every record is flushed and fsynced before append returns, so a record that was appended
+    survives a crash. A crash in the middle of a write can only leave a torn last line: it is
+    ignored by records() and cut off when the journal is opened for writing again.
+    Only one process may append at a time (see file_lock); threads of that process may share it.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+        self._lock = threading.Lock()
+
+    def records(self):
+        """Yields the complete records of the journal, in order (nothing if it does not exist)."""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    return
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    return
+
+    def _valid_length(self):
+        """Byte length of the journal's complete records."""
+        length = 0
+        with open(self.path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    json.loads(line)
+                except ValueError:
+                    break
+                length += len(line)
+        return length
+
+    def __enter__(self):
+        if os.path.exists(self.path):
+            length = self._valid_length()
+            if length != os.path.getsize(self.path):
+                os.truncate(self.path, length)
+        self._file = open(self.path, "a", encoding="utf-8")
+        return self
+
+    def __exit__(self, *exc_info):
+        self._file.close()
+        self._file = None
+        return False
+
+    def append(self, record):
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+def journaled_units(journal_path, open_units):
+    """
+    Streams the units of a book (pages, items or elements) through a write-ahead journal, so an
+    interrupted extraction resumes after the last unit it finished instead of from the start.
+
+    Parameters:
+      - journal_path (str): The journal of this book's extraction. The caller holds its lock
+        (see file_lock) and removes it once the book is stored.
+      - open_units (callable): open_units(start) yields (index, location, text) for the units
+        of the book from extraction index `start` on, in reading order.
+
+    Yields:
+      - (location, text) tuples: first the units recorded by an earlier attempt, then the
+        units extracted now, each appended to the journal before it is passed on.
+    """
+    journal = Journal(journal_path)
+    start = 0
+    replayed = 0
+    for record in journal.records():
+        yield record["location"], record["text"]
+        start = record["index"] + 1
+        replayed += 1
+    if replayed:
+        print(f"Resuming extraction after {replayed} checkpointed units ({journal_path}).")
+    with journal:
+        for index, location, text in open_units(start):
+            journal.append({"index": index, "location": location, "text": text})
+            yield location, text
+
+class Run:
+    """
+    The directory of one pipeline run, so an interrupted run can be resumed with --resume <run-id>.
+
+    It holds:
+      - run.json: the run's command-line arguments, status and times (written atomically).
+      - journal.jsonl: a write-ahead journal of every completed stage (name, output key and
+        whether it was loaded from the store), appended as each one finishes.
+      - .lock: held by the process running the run, so a run cannot be resumed twice at once.
+
+    Stage outputs, extracted books and model responses are checkpointed in their own stores
+    (.pipeline_cache, .corpus_store, the response cache), keyed by content, so a resumed run
+    reloads every finished unit from there instead of repeating it.
+    """
+
+    def __init__(self, run_id, root=DEFAULT_RUNS_DIR):
+        self.id = run_id
+        self.directory = os.path.join(root, run_id)
+        self.journal = Journal(os.path.join(self.directory, JOURNAL_FILE))
+        self.info = None
+        self._lock = None
+
+    @classmethod
+    def create(cls, argv, root=DEFAULT_RUNS_DIR):
+        """Starts a new run with the given command-line arguments."""
+        run = cls(f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}", root)
+        os.makedirs(run.directory)
+        run.info = {"id": run.id, "argv": list(argv), "status": "created", "created": time.time()}
+        run._save()
+        return run
+
+    @classmethod
+    def load(cls, run_id, root=DEFAULT_RUNS_DIR):
+        """
+        Opens an existing run.
+
+        Raises:
+          - ValueError: If there is no such run.
+        """
+        run = cls(run_id, root)
+        path = os.path.join(run.directory, RUN_FILE)
+        if not os.path.exists(path):
+            raise ValueError(f"No run {run_id!r} in {root}.")
+        with open(path, "r", encoding="utf-8") as f:
+            run.info = json.load(f)
+        return run
+
+    def _save(self):
+        atomic_write_json(os.path.join(self.directory, RUN_FILE), self.info, indent=2)
+
+    def completed_stages(self):
+        """Returns the names of the stages the journal records as completed."""
+        return [record["stage"] for record in self.journal.records()]
+
+    def __enter__(self):
+        """
+        Takes the run's lock and marks it running.
+
+        Raises:
+          - RuntimeError: If another process is running this run.
+        """
+        self._lock = file_lock(os.path.join(self.directory, LOCK_FILE), blocking=False)
+        try:
+            self._lock.__enter__()
+        except BlockingIOError:
+            self._lock = None
+            raise RuntimeError(f"Run {self.id} is being run by another process.")
+        self.journal.__enter__()
+        self.info.update(status="running", attempts=self.info.get("attempts", 0) + 1, started=time.time())
+        self._save()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is None:
+            self.info.update(status="completed", error=None)
+        else:
+            status = "interrupted" if issubclass(exc_type, KeyboardInterrupt) else "failed"
+            self.info.update(status=status, error=f"{exc_type.__name__}: {exc}")
+        self.info["finished"] = time.time()
+        try:
+            self._save()
+        finally:
+            self.journal.__exit__(exc_type, exc, traceback)
+            self._lock.__exit__(exc_type, exc, traceback)
+            self._lock = None
+        return False
+
+    def stage_completed(self, name, key, cached):
+        """Journal callback of Pipeline: records a finished stage."""
+        self.journal.append({"stage": name, "key": key, "cached": cached, "time": time.time()})
@@ -0,0 +1,275 @@
+import os
+import re
+import threading
+import unicodedata
+from collections import namedtuple
+import numpy as np
+
+# Length (in normalized characters) of the n-grams the quote index is keyed on.
+NGRAM_CHARS = 16
+
+# Only every NGRAM_STRIDE-th n-gram of a book is indexed; a lookup probes that many offsets of the quote.
+NGRAM_STRIDE = 4
+
+# Multiplier of the polynomial n-gram hash (arithmetic wraps around modulo 2**64).
+HASH_BASE = np.uint64(1099511628211)
+
+# Quoted spans with fewer words than this are titles or terms rather than quotations.
+MIN_QUOTE_WORDS = 4
+
+# Matches text between straight or curly double quotes.
+QUOTE_PATTERN = re.compile(r'["“]([^"“”]+)["”]')
+
+# Splits a quotation at ellipses, which mark text the writer left out.
+ELLIPSIS_PATTERN = re.compile(r"\.\s*\.\s*\.|…")
+
+# Result of checking one quotation.
+QuoteCheck = namedtuple("QuoteCheck", ["quote", "found", "book", "location"])
+
+# Normalized form of every character seen so far (see _fold).
+_folded = {}
+
+def _fold(char):
+    """
+    Returns the normalized form of a single character: lowercase letters and digits with
+    accents removed and compatibility forms (ligatures, full-width letters) expanded;
+    whitespace and punctuation normalize to the empty string.
+    """
+    folded = _folded.get(char)
+    if folded is None:
+        folded = "".join(c for c in unicodedata.normalize("NFKD", char.lower()) if c.isalnum())
+        _folded[char] = folded
+    return folded
+
+def normalize_text(text, with_offsets=False):
+    """
+    Reduces text to the sequence of its letters and digits, so that matching ignores case,
+    whitespace, punctuation, quote styles and accents.
+
+    Parameters:
+      text (str): The input text.
+      with_offsets (bool): Also return where each normalized character comes from.
+
+    Returns:
+      numpy.ndarray: The normalized text as code points (uint32), and with with_offsets=True
+      a second array holding the offset in `text` of each normalized character.
+    """
+    codes = []
+    offsets = []
+    for i, char in enumerate(text):
+        folded = _fold(char)
+        if folded:
+            codes.extend(map(ord, folded))
+            if with_offsets:
+                offsets.extend([i] * len(folded))
+    codes = np.asarray(codes, dtype=np.uint32)
+    if with_offsets:
+        return codes, np.asarray(offsets, dtype=np.int64)
+    return codes
+
+def ngram_hashes(codes, n=NGRAM_CHARS):
+    """
+    Hashes every window of n normalized characters.
+
+    Returns:
+      numpy.ndarray: len(codes) - n + 1 hashes (uint64); entry i hashes codes[i:i + n].
+    """
+    count = len(codes) - n + 1
+    if count <= 0:
+        return np.zeros(0, dtype=np.uint64)
+    codes = codes.astype(np.uint64)
+    hashes = np.zeros(count, dtype=np.uint64)
+    for j in range(n):
+        hashes = hashes * HASH_BASE + codes[j:j + count]
+    return hashes
+
+class QuoteIndex:
+    """
+    N-gram hash index over the normalized text of one book.
+
+    The hashes of every NGRAM_STRIDE-th n-gram are kept sorted next to their positions, so a
+    lookup is a handful of binary searches. A quotation of at least NGRAM_CHARS + NGRAM_STRIDE - 1
+    normalized characters always contains an indexed n-gram: probing the first NGRAM_STRIDE
+    n-grams of the quotation finds every candidate position, and each candidate is confirmed by
+    comparing the full quotation.
+    """
+
+    def __init__(self, codes, offsets, hashes, positions):
+        self.codes = codes
+        self.offsets = offsets
+        self.hashes = hashes
+        self.positions = positions
+
+    @classmethod
+    def build(cls, text):
+        """
+        Builds the index of a text.
+
+        Parameters:
+          text (str): The cleaned text of the book.
+
+        Returns:
+          QuoteIndex
+        """
+        codes, offsets = normalize_text(text, with_offsets=True)
+        hashes = ngram_hashes(codes)[::NGRAM_STRIDE]
+        positions = np.arange(0, len(hashes) * NGRAM_STRIDE, NGRAM_STRIDE, dtype=np.int64)
+        order = np.argsort(hashes, kind="stable")
+        return cls(codes, offsets, hashes[order], positions[order])
+
+    def _matches_at(self, start, quote_codes):
+        end = start + len(quote_codes)
+        return start >= 0 and end <= len(self.codes) and np.array_equal(self.codes[start:end], quote_codes)
+
+    def find_normalized(self, quote_codes):
+        """
+        Finds a normalized quotation in the book.
+
+        Returns:
+          int: The position of the first match in the normalized text, or None.
+        """
+        length = len(quote_codes)
+        if length == 0:
+            return None
+        if length < NGRAM_CHARS:
+            # Too short to contain an n-gram: fall back to scanning the text.
+            haystack = self.codes.tobytes()
+            needle = quote_codes.tobytes()
+            position = haystack.find(needle)
+            while position != -1 and position % 4:
+                position = haystack.find(needle, position + 1)
+            return None if position == -1 else position // 4
+        probes = ngram_hashes(quote_codes)[:NGRAM_STRIDE]
+        found = None
+        for shift, probe in enumerate(probes):
+            lo = np.searchsorted(self.hashes, probe, side="left")
+            hi = np.searchsorted(self.hashes, probe, side="right")
+            for position in self.positions[lo:hi]:
+                start = int(position) - shift
+                if (found is None or start < found) and self._matches_at(start, quote_codes):
+                    found = start
+        if found is None and length < NGRAM_CHARS + NGRAM_STRIDE - 1:
+            # Short quotations may fall between indexed n-grams; check with a scan.
+            return self.find_normalized_scan(quote_codes)
+        return found
+
+    def find_normalized_scan(self, quote_codes):
+        """Finds a normalized quotation (of at least NGRAM_CHARS characters) by hashing every n-gram of the book."""
+        first = ngram_hashes(quote_codes)[0]
+        for start in np.flatnonzero(ngram_hashes(self.codes) == first):
+            if self._matches_at(int(start), quote_codes):
+                return int(start)
+        return None
+
+    def find(self, quote):
+        """
+        Finds a quotation in the book, ignoring case, whitespace and punctuation.
+
+        Parameters:
+          quote (str): The quoted text.
+
+        Returns:
+          (start, end): Character offsets of the match in the cleaned text, or None if it does not occur.
+        """
+        quote_codes = normalize_text(quote)
+        start = self.find_normalized(quote_codes)
+        if start is None:
+            return None
+        return int(self.offsets[start]), int(self.offsets[start + len(quote_codes) - 1]) + 1
+
+    def save(self, path):
+        """Writes the index to a .npz file (written to a temporary file of this thread and renamed)."""
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp.npz"
+        np.savez(tmp_path, codes=self.codes, offsets=self.offsets, hashes=self.hashes, positions=self.positions)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """Reads an index written by save."""
+        with np.load(path) as data:
+            return cls(data["codes"], data["offsets"], data["hashes"], data["positions"])
+
+# Quote indexes already loaded in this process, by file path.
+_loaded_indexes = {}
+
+def corpus_quote_index(corpus):
+    """
+    Returns the quote index of a stored book, building and persisting it next to the corpus on first use.
+    Loaded indexes are kept in memory, so a long-running process reads each one only once.
+
+    Parameters:
+      corpus (MappedCorpus): The book, opened from the corpus store.
+
+    Returns:
+      QuoteIndex
+    """
+    path = os.path.join(corpus.entry_dir, f"quotes-{NGRAM_CHARS}-{NGRAM_STRIDE}.npz")
+    if path in _loaded_indexes:
+        return _loaded_indexes[path]
+    if os.path.exists(path):
+        index = QuoteIndex.load(path)
+    else:
+        index = QuoteIndex.build(corpus.text())
+        index.save(path)
+    _loaded_indexes[path] = index
+    return index
+
+def unload_indexes(corpus):
+    """Drops the loaded quote indexes of a book from memory (e.g. when a long-running process closes it)."""
+    for path in [path for path in _loaded_indexes if os.path.dirname(path) == corpus.entry_dir]:
+        del _loaded_indexes[path]
+
+def extract_quotes(text, min_words=MIN_QUOTE_WORDS):
+    """
+    Collects the quotations of a text.
+
+    Parameters:
+      text (str): The text to scan (e.g. the generated report).
+      min_words (int): Shorter quoted spans (titles, single terms) are ignored.
+
+    Returns:
+      list of str: The quoted spans, without the quote marks, in order of appearance.
+    """
+    return [quote.strip() for quote in QUOTE_PATTERN.findall(text) if len(quote.split()) >= min_words]
+
+def locate_quote(quote, index, corpus):
+    """
+    Looks a quotation up in one book. Text elided with an ellipsis is allowed: every part of the
+    quotation must occur in the book, and the location is that of the first part.
+
+    Returns:
+      str: The source location of the quotation (see MappedCorpus.location), or None if it was not found.
+    """
+    parts = [part for part in ELLIPSIS_PATTERN.split(quote) if len(normalize_text(part))]
+    location = None
+    for part in parts:
+        span = index.find(part)
+        if span is None:
+            return None
+        if location is None:
+            location = corpus.location(span[0])
+    return location
+
+def verify_quotes(quotes, corpora):
+    """
+    Checks quotations against the books they may come from.
+
+    Parameters:
+      quotes (list of str): The quotations to check.
+      corpora (dict): Book name -> MappedCorpus. Books are tried in order.
+
+    Returns:
+      list of QuoteCheck: One result per quotation; `book` and `location` are None when the
+      quotation was not found in any book.
+    """
+    indexes = {name: corpus_quote_index(corpus) for name, corpus in corpora.items()}
+    checks = []
+    for quote in quotes:
+        check = QuoteCheck(quote, False, None, None)
+        for name, corpus in corpora.items():
+            location = locate_quote(quote, indexes[name], corpus)
+            if location is not None:
+                check = QuoteCheck(quote, True, name, location)
+                break
+        checks.append(check)
+    return checks
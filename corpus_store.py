@@ -0,0 +1,331 @@
+import os
+import json
+import mmap
+import array
+import bisect
+import shutil
+import hashlib
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+import profiling
+from ingestion import iter_book, worker_context
+from checkpoint import file_lock
+from normalization import new_stats, removed_summary
+from text_processing import CHUNK_TOKENS, CHUNK_OVERLAP_TOKENS, iter_clean, iter_sentences, token_pieces, pack_spans
+
+# Bump this whenever ingestion or cleaning changes so that stale entries are rebuilt.
+EXTRACTOR_VERSION = "5"
+
+# Default location of the store, relative to the project root.
+DEFAULT_STORE_DIR = ".corpus_store"
+
+# File names inside a store entry.
+TEXT_FILE = "text.txt"
+SENTENCES_FILE = "sentences.bin"
+UNITS_FILE = "units.json"
+META_FILE = "meta.json"
+
+# Per-entry files kept in the store root while an entry is being built: the lock held by its
+# builder and the write-ahead journal of the units extracted so far (see checkpoint.journaled_units).
+BUILD_LOCK_SUFFIX = ".lock"
+UNITS_JOURNAL_SUFFIX = ".units.jsonl"
+
+def file_digest(file_path, block_size=1 << 20):
+    """
+    Computes the SHA-256 digest of a file without loading it into memory at once.
+
+    Parameters:
+      - file_path: The path to the file.
+      - block_size: Number of bytes read per iteration.
+
+    Returns:
+      - The hexadecimal digest as a string.
+    """
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _load_offsets(path):
+    """Reads an offset array written by array.tofile."""
+    offsets = array.array("Q")
+    with open(path, "rb") as f:
+        offsets.frombytes(f.read())
+    return offsets
+
+class MappedCorpus:
+    """
+    A cleaned book opened from the store.
+
+    The text stays on disk and is memory-mapped; the sentence boundaries are a compact
+    array of byte offsets, so chunks are produced by slicing the mapped buffer instead of
+    re-running the sentence tokenizer.
+    """
+
+    def __init__(self, entry_dir):
+        self.entry_dir = entry_dir
+        with open(os.path.join(entry_dir, META_FILE), "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self._file = open(os.path.join(entry_dir, TEXT_FILE), "rb")
+        size = os.fstat(self._file.fileno()).st_size
+        # mmap cannot map an empty file.
+        self.buffer = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        self.offsets = _load_offsets(os.path.join(entry_dir, SENTENCES_FILE))
+        with open(os.path.join(entry_dir, UNITS_FILE), "r", encoding="utf-8") as f:
+            units = json.load(f)
+        self.unit_starts = units["starts"]
+        self.unit_locations = units["locations"]
+        # Token chunk spans by (max_tokens, overlap_tokens), so the sentences are measured once per budget.
+        self._token_spans = {}
+
+    def __len__(self):
+        """Size of the cleaned text in bytes."""
+        return len(self.buffer)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def sentence_count(self):
+        return len(self.offsets) // 2
+
+    def text(self):
+        """Returns the whole cleaned text as a string."""
+        return self.buffer[:].decode("utf-8")
+
+    def sentence(self, index):
+        """Returns a single sentence by its index."""
+        return self.buffer[self.offsets[2 * index]:self.offsets[2 * index + 1]].decode("utf-8")
+
+    def location(self, char_offset):
+        """
+        Maps a character offset in the cleaned text back to the source unit it came from.
+
+        Returns:
+          str: 'page N' (PDF), 'item <name>' (EPUB) or 'element N' (XML), or None for an empty book.
+        """
+        index = bisect.bisect_right(self.unit_starts, char_offset) - 1
+        return self.unit_locations[max(index, 0)] if self.unit_locations else None
+
+    def token_chunk_spans(self, max_tokens=CHUNK_TOKENS, overlap_tokens=CHUNK_OVERLAP_TOKENS):
+        """
+        Groups consecutive sentences into chunks of up to max_tokens model tokens.
+
+        Follows text_processing.chunk_spans: every stored sentence is measured with the local
+        tokenizer, sentences longer than the budget are cut at word boundaries, and up to
+        overlap_tokens of trailing sentences are repeated at the start of the next chunk.
+        The result is kept, so later calls with the same budget do not measure again.
+
+        Returns:
+          list of tuple: (start, end) byte offsets of each chunk in the mapped text.
+        """
+        key = (max_tokens, overlap_tokens)
+        if key not in self._token_spans:
+            offsets = self.offsets
+            sentences = ((self.buffer[offsets[i]:offsets[i + 1]].decode("utf-8"), offsets[i])
+                         for i in range(0, len(offsets), 2))
+            pieces = token_pieces(sentences, max_tokens, byte_offsets=True)
+            self._token_spans[key] = pack_spans(pieces, max_tokens, overlap_tokens)
+        return self._token_spans[key]
+
+    def iter_token_chunks(self, max_tokens=CHUNK_TOKENS, overlap_tokens=CHUNK_OVERLAP_TOKENS):
+        """
+        Yields the chunks described by token_chunk_spans one at a time, decoding each only when needed.
+        """
+        for start, end in self.token_chunk_spans(max_tokens, overlap_tokens):
+            yield self.buffer[start:end].decode("utf-8")
+
+    def close(self):
+        if isinstance(self.buffer, mmap.mmap):
+            self.buffer.close()
+        self._file.close()
+
+class CorpusStore:
+    """
+    On-disk store of cleaned books keyed by file hash plus extractor version.
+
+    Each entry is a directory containing:
+      - text.txt: the cleaned UTF-8 text, opened with mmap on later runs.
+      - sentences.bin: interleaved (start, end) byte offsets of every sentence (unsigned 64-bit).
+      - units.json: the location of every page, spine item or element and the character offset
+        where its text starts, used to map quotes back to the source.
+      - meta.json: the source path, file type, extractor version, sizes and what normalization removed.
+    """
+
+    def __init__(self, root=DEFAULT_STORE_DIR):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def key_for(self, file_path):
+        """Returns the store key of a source file."""
+        return f"{file_digest(file_path)}-v{EXTRACTOR_VERSION}"
+
+    def entry_dir(self, key):
+        return os.path.join(self.root, key)
+
+    def contains(self, key):
+        return os.path.exists(os.path.join(self.entry_dir(key), META_FILE))
+
+    def build(self, file_path, file_type, key=None):
+        """
+        Extracts, cleans and segments a book, then writes it to the store.
+
+        The book is streamed (ingestion.iter_book, normalized -> iter_clean -> iter_sentences) and
+        the cleaned text is written to disk as it goes, so the whole book is never held in memory.
+        The entry is written to a temporary directory first and renamed into place,
+        so concurrent builders and interrupted runs never leave a partial entry behind.
+
+        Every extracted page, item or element is first appended to a journal in the store root,
+        so a build that is interrupted resumes after the last extracted unit instead of
+        extracting the book again. Builders of the same entry take turns on a lock file; one
+        that gets the lock after the entry was stored returns at once.
+
+        Returns:
+          - The key of the new entry.
+        """
+        key = key or self.key_for(file_path)
+        base = os.path.join(self.root, f".{key}")
+        journal_path = base + UNITS_JOURNAL_SUFFIX
+        with file_lock(base + BUILD_LOCK_SUFFIX):
+            if not self.contains(key):
+                with profiling.span(file_path, "book", file_type=file_type) as book_span:
+                    meta = self._build(file_path, file_type, key, journal_path)
+                    book_span.set(chars=meta["chars"], sentences=meta["sentences"], units=meta["units"],
+                                  removed_chars=meta["normalization"]["chars_in"] - meta["normalization"]["chars_out"])
+            else:
+                meta = None
+            # The entry is stored: its journal is no longer needed.
+            if os.path.exists(journal_path):
+                os.remove(journal_path)
+        if meta is None:
+            return key
+        print(f"Normalization of {file_path} {removed_summary(meta['normalization'])}.")
+        return key
+
+    def _build(self, file_path, file_type, key, checkpoint=None):
+        """Does the work of build and returns the entry's metadata."""
+        tmp_dir = tempfile.mkdtemp(prefix=f".{key}-", dir=self.root)
+        try:
+            offsets = array.array("Q")
+            locations = []
+            unit_starts = []
+            normalization = new_stats()
+            size = 0
+            chars = 0
+            with open(os.path.join(tmp_dir, TEXT_FILE), "wb") as f:
+                def located(pieces):
+                    # The pipeline is pulled lazily, so when a new unit's text is requested all
+                    # cleaned text before it has been written: `chars` is where the unit starts.
+                    for piece in pieces:
+                        while len(unit_starts) < len(locations):
+                            unit_starts.append(chars)
+                        yield piece
+
+                def written(pieces):
+                    # Writes each cleaned piece to disk as it passes on to the segmenter.
+                    nonlocal size, chars
+                    for piece in pieces:
+                        encoded = piece.encode("utf-8")
+                        f.write(encoded)
+                        size += len(encoded)
+                        chars += len(piece)
+                        yield piece
+                raw = located(iter_book(file_path, file_type, units=locations, normalize=True, stats=normalization,
+                                        checkpoint=checkpoint))
+                for sentence in iter_sentences(written(iter_clean(raw))):
+                    offsets.extend((sentence.byte_start, sentence.byte_end))
+            with open(os.path.join(tmp_dir, SENTENCES_FILE), "wb") as f:
+                offsets.tofile(f)
+            with open(os.path.join(tmp_dir, UNITS_FILE), "w", encoding="utf-8") as f:
+                json.dump({"starts": unit_starts, "locations": locations}, f)
+            meta = {
+                "source": file_path,
+                "file_type": file_type,
+                "extractor_version": EXTRACTOR_VERSION,
+                "bytes": size,
+                "chars": chars,
+                "sentences": len(offsets) // 2,
+                "units": len(locations),
+                "normalization": normalization,
+            }
+            with open(os.path.join(tmp_dir, META_FILE), "w", encoding="utf-8") as f:
+                json.dump(meta, f, indent=2)
+            try:
+                os.rename(tmp_dir, self.entry_dir(key))
+            except OSError:
+                # Another process finished the same entry first; keep theirs.
+                if not self.contains(key):
+                    raise
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        return meta
+
+    def ingest(self, file_path, file_type, in_worker=False):
+        """
+        Returns the key of a book, building its entry only if it is not stored yet.
+
+        With in_worker=True the entry is built in a separate (spawned, see
+        ingestion.worker_context) process, so several books ingested from different threads
+        are extracted in parallel.
+        """
+        key = self.key_for(file_path)
+        if not self.contains(key):
+            print(f"Building corpus entry for {file_path}...")
+            if in_worker:
+                with ProcessPoolExecutor(max_workers=1, mp_context=worker_context()) as executor:
+                    _, spans = executor.submit(_build_entry, self.root, file_path, file_type, key, _trace_origin()).result()
+                profiling.merge(spans)
+            else:
+                self.build(file_path, file_type, key)
+        return key
+
+    def open(self, key):
+        """Opens a stored book as a MappedCorpus."""
+        return MappedCorpus(self.entry_dir(key))
+
+    def ingest_books(self, books, max_workers=None):
+        """
+        Makes sure every book is in the store and opens them all.
+
+        Parameters:
+          - books: A list of (file_path, file_type) tuples.
+          - max_workers: Number of worker processes used for books that must be built.
+
+        Returns:
+          - A list of MappedCorpus, in the same order as `books`.
+
+        On a warm run every book is already stored, so this only hashes the files and
+        opens the mapped text; missing books are built in parallel in a process pool.
+        """
+        keys = [self.key_for(file_path) for file_path, _ in books]
+        missing = [(book, key) for book, key in zip(books, keys) if not self.contains(key)]
+        if missing:
+            print(f"Building {len(missing)} corpus entries in parallel...")
+            with ProcessPoolExecutor(max_workers=max_workers or len(missing), mp_context=worker_context()) as executor:
+                futures = [executor.submit(_build_entry, self.root, file_path, file_type, key, _trace_origin())
+                           for (file_path, file_type), key in missing]
+                for future in futures:
+                    _, spans = future.result()
+                    profiling.merge(spans)
+        return [self.open(key) for key in keys]
+
+def _build_entry(root, file_path, file_type, key, trace_origin=None):
+    """
+    Process-pool entry point for CorpusStore.build.
+
+    Returns (key, spans): when the parent is profiling it passes its trace origin, and the spans
+    recorded in the worker are sent back to be merged into the parent's trace.
+    """
+    if trace_origin is not None:
+        profiling.enable(trace_origin)
+        profiling.drain()  # Forget spans inherited from a forked parent.
+    key = CorpusStore(root).build(file_path, file_type, key)
+    return key, profiling.drain()
+
+def _trace_origin():
+    """The trace origin handed to worker processes, or None when not profiling."""
+    return profiling.origin() if profiling.enabled() else None
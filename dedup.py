@@ -0,0 +1,174 @@
+import re
+import zlib
+from collections import defaultdict
+import numpy as np
+from llm_client import estimate_request_tokens
+from summarization import SUMMARY_MAX_TOKENS, summary_messages
+
+# Number of consecutive words in each shingle compared between chunks.
+SHINGLE_WORDS = 5
+
+# Number of hash functions in a MinHash signature.
+NUM_PERMUTATIONS = 128
+
+# The signature is split into this many LSH bands; chunks sharing any band are compared.
+# With 32 bands of 4 rows, pairs with a similarity of 0.8 become candidates with near certainty,
+# while unrelated passages of prose (similarity close to 0) practically never do.
+LSH_BANDS = 32
+
+# Chunks whose estimated Jaccard similarity (of their shingle sets) reaches this are near-duplicates.
+SIMILARITY_THRESHOLD = 0.8
+
+# Shingles are hashed to 32 bits and permuted with (a * h + b) mod HASH_PRIME (a prime above 2**32).
+HASH_PRIME = np.uint64(4294967311)
+
+# Seed of the permutations, fixed so that signatures (and so the dedup plans) are reproducible.
+PERMUTATION_SEED = 20240601
+
+# Words compared between chunks: case, punctuation and whitespace are ignored.
+WORD_PATTERN = re.compile(r"[a-z0-9]+")
+
+_random = np.random.RandomState(PERMUTATION_SEED)
+# a stays below 2**31 so that a * h (h < 2**32) does not overflow 64 bits.
+_PERMUTATION_A = _random.randint(1, 2 ** 31, size=NUM_PERMUTATIONS).astype(np.uint64)
+_PERMUTATION_B = _random.randint(0, 2 ** 32, size=NUM_PERMUTATIONS, dtype=np.int64).astype(np.uint64)
+
+def shingle_hashes(text):
+    """
+    Returns the distinct 32-bit hashes of the SHINGLE_WORDS-word shingles of a text (uint64 array).
+    Texts shorter than one shingle are hashed as a whole; a text without words has no shingles.
+    """
+    words = WORD_PATTERN.findall(text.lower())
+    if not words:
+        return np.zeros(0, dtype=np.uint64)
+    count = max(len(words) - SHINGLE_WORDS + 1, 1)
+    shingles = {zlib.crc32(" ".join(words[i:i + SHINGLE_WORDS]).encode("utf-8")) for i in range(count)}
+    return np.fromiter(shingles, dtype=np.uint64, count=len(shingles))
+
+def minhash_signature(text):
+    """
+    Computes the MinHash signature of a text.
+
+    Returns:
+      - numpy.ndarray: NUM_PERMUTATIONS minimum hash values (uint64), or None for a text without words.
+        The fraction of positions where two signatures agree estimates the Jaccard similarity of
+        the two texts' shingle sets.
+    """
+    hashes = shingle_hashes(text)
+    if not len(hashes):
+        return None
+    permuted = (_PERMUTATION_A[:, None] * hashes[None, :] + _PERMUTATION_B[:, None]) % HASH_PRIME
+    return permuted.min(axis=1)
+
+def estimated_similarity(signature, other):
+    """Estimated Jaccard similarity of the texts behind two signatures."""
+    return float(np.count_nonzero(signature == other)) / len(signature)
+
+class LSHIndex:
+    """
+    Locality-sensitive hashing over MinHash signatures: each signature is cut into `bands` bands,
+    and items sharing an identical band are returned as candidates of each other.
+    """
+
+    def __init__(self, bands=LSH_BANDS):
+        self.bands = bands
+        self.buckets = defaultdict(list)
+
+    def _band_keys(self, signature):
+        rows = len(signature) // self.bands
+        return [(band, signature[band * rows:(band + 1) * rows].tobytes()) for band in range(self.bands)]
+
+    def add(self, item, signature):
+        for key in self._band_keys(signature):
+            self.buckets[key].append(item)
+
+    def candidates(self, signature):
+        """Returns the items sharing at least one band with the signature, in the order they were added."""
+        found = {}
+        for key in self._band_keys(signature):
+            for item in self.buckets.get(key, ()):
+                found[item] = True
+        return list(found)
+
+def find_near_duplicates(books_chunks, threshold=SIMILARITY_THRESHOLD):
+    """
+    Finds the chunks that nearly repeat an earlier chunk, within a book or across books.
+
+    Parameters:
+      - books_chunks (list): For each book, the list of its chunks.
+      - threshold (float): Minimum estimated similarity of near-duplicates.
+
+    Returns:
+      - list: For each book, a list with, for each chunk, the (book, chunk) position of the earlier
+        chunk it duplicates, or None. Books and chunks are scanned in order, so the first
+        occurrence is always the one kept and the result does not depend on timing.
+    """
+    index = LSHIndex()
+    signatures = {}
+    result = []
+    for book, chunks in enumerate(books_chunks):
+        sources = []
+        for position, chunk in enumerate(chunks):
+            signature = minhash_signature(chunk)
+            source = None
+            if signature is not None:
+                for candidate in index.candidates(signature):
+                    if estimated_similarity(signature, signatures[candidate]) >= threshold:
+                        source = candidate
+                        break
+                if source is None:
+                    signatures[(book, position)] = signature
+                    index.add((book, position), signature)
+            sources.append(source)
+        result.append(sources)
+    return result
+
+def dedup_plans(books_chunks, threshold=SIMILARITY_THRESHOLD):
+    """
+    Decides how each book's chunks are collapsed before summarization.
+
+    A near-duplicate of an earlier chunk of the same book is dropped: its summary would repeat
+    one the book already has. A near-duplicate of a chunk of an earlier book (another edition,
+    a shared preface) is replaced by that chunk's text, so its summary is the one already
+    requested for the other book: the response cache (or the in-flight request) answers it.
+
+    Parameters:
+      - books_chunks (list): For each book, the list of its chunks.
+      - threshold (float): Minimum estimated similarity of near-duplicates.
+
+    Returns:
+      - (plans, stats): plans has one dict per book, {"drop": [chunk positions], "reuse":
+        [[chunk position, replacement text], ...]} (see apply_plan); stats counts the chunks,
+        the duplicates within and across books, and the summary calls and estimated tokens avoided.
+    """
+    sources = find_near_duplicates(books_chunks, threshold)
+    plans = []
+    stats = {"chunks": 0, "within_book": 0, "across_books": 0, "calls_avoided": 0, "tokens_avoided": 0}
+    for book, (chunks, book_sources) in enumerate(zip(books_chunks, sources)):
+        plan = {"drop": [], "reuse": []}
+        for position, (chunk, source) in enumerate(zip(chunks, book_sources)):
+            stats["chunks"] += 1
+            if source is None:
+                continue
+            if source[0] == book:
+                plan["drop"].append(position)
+                stats["within_book"] += 1
+            else:
+                plan["reuse"].append([position, books_chunks[source[0]][source[1]]])
+                stats["across_books"] += 1
+            stats["calls_avoided"] += 1
+            stats["tokens_avoided"] += estimate_request_tokens(summary_messages(chunk), SUMMARY_MAX_TOKENS)
+        plans.append(plan)
+    return plans, stats
+
+def apply_plan(chunks, plan):
+    """
+    Yields a book's chunks with its dedup plan applied: dropped chunks are skipped and reused
+    ones replaced by the text of the chunk they duplicate. Chunks are consumed lazily.
+    """
+    drop = set(plan["drop"])
+    reuse = dict((position, text) for position, text in plan["reuse"])
+    for position, chunk in enumerate(chunks):
+        if position in drop:
+            continue
+        yield reuse.get(position, chunk)
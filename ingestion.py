@@ -1,105 +1,431 @@
 import xml.etree.ElementTree as ET
 import PyPDF2
-from ebooklib import epub
-from bs4 import BeautifulSoup
+import lxml.etree
+import lxml.html
+import os
+import re
 import signal
-import warnings
+import zipfile
+import posixpath
+import multiprocessing
+from urllib.parse import unquote
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+import profiling
+from normalization import normalize_units
+from checkpoint import journaled_units
 
 # Define a custom exception for timeout situations.
 class TimeoutException(Exception):
     pass
 
-# This function acts as a signal handler to raise a TimeoutException
-def timeout_handler(signum, frame):
-    raise TimeoutException("Operation timed out.")
+# Maximum number of seconds a worker may spend opening a document before it is killed.
+OPEN_TIMEOUT_SECONDS = 120
 
-def extract_text_with_timeout(page, timeout_seconds=10):
+# A timeout alarm swallowed by the parser (PyPDF2 catches some exceptions itself) is raised again this often.
+ALARM_REPEAT_SECONDS = 0.5
+
+# Start method of every worker process. Extraction is started from pipeline threads and from the
+# service's event loop, and forking a multi-threaded process can deadlock the child on a lock
+# another thread held; spawned workers start from a fresh interpreter instead.
+WORKER_START_METHOD = "spawn"
+
+# Result of extracting a single PDF page: status is 'ok', 'error' or 'timeout'.
+PageResult = namedtuple("PageResult", ["index", "status", "text", "error"])
+
+# Media types of EPUB content documents.
+EPUB_DOCUMENT_TYPES = ("application/xhtml+xml", "text/html")
+
+# HTML elements that end a paragraph (or line) when converting a document to text.
+BLOCK_TAGS = (
+    "p", "div", "h1", "h2", "h3", "h4", "h5", "h6", "li", "blockquote", "pre",
+    "section", "article", "header", "footer", "aside", "tr", "table", "dt", "dd", "hr",
+)
+
+# Tags of RSS content:encoded elements: as written in the file, and as ElementTree reports them (namespace expanded).
+CONTENT_ENCODED_TAGS = ("content:encoded", "{http://purl.org/rss/1.0/modules/content/}encoded")
+
+# Matches the start of an HTML tag or comment, in content:encoded text that holds markup.
+MARKUP_PATTERN = re.compile(r"<[a-zA-Z!/]")
+
+# EPUBs with fewer document items than this are parsed in a single process.
+EPUB_PARALLEL_MIN_ITEMS = 16
+
+def worker_context():
+    """Returns the multiprocessing context every worker process and pool is started with (WORKER_START_METHOD)."""
+    return multiprocessing.get_context(WORKER_START_METHOD)
+
+def epub_document_names(file_path):
     """
-    Extracts text from a single PDF page with a specified timeout.
+    Lists the content documents of an EPUB in reading (spine) order.
     
     Parameters:
-      - page: A PDF page object from which to extract text.
-      - timeout_seconds: The maximum number of seconds to allow for text extraction.
+      - file_path: The path to the EPUB file.
     
     Returns:
-      - The extracted text as a string.
+      - A list of archive member names: the spine documents first, in spine order, followed by
+        any other XHTML documents of the manifest that the spine does not reference.
+    
+    Process:
+      - Reads META-INF/container.xml to locate the package (OPF) file.
+      - Parses the manifest and spine of the package with lxml.
+    """
+    with zipfile.ZipFile(file_path) as archive:
+        container = lxml.etree.fromstring(archive.read("META-INF/container.xml"))
+        opf_path = container.xpath("//*[local-name()='rootfile']/@full-path")[0]
+        package = lxml.etree.fromstring(archive.read(opf_path))
+    base = posixpath.dirname(opf_path)
+    manifest = {}
+    for item in package.xpath("//*[local-name()='manifest']/*[local-name()='item']"):
+        if item.get("media-type") in EPUB_DOCUMENT_TYPES:
+            manifest[item.get("id")] = posixpath.normpath(posixpath.join(base, unquote(item.get("href"))))
+    names = []
+    for idref in package.xpath("//*[local-name()='spine']/*[local-name()='itemref']/@idref"):
+        if idref in manifest and manifest[idref] not in names:
+            names.append(manifest[idref])
+    # Documents missing from the spine are still extracted, after the reading order.
+    names.extend(name for name in manifest.values() if name not in names)
+    return names
+
+def html_to_text(content):
+    """
+    Extracts the text of an (X)HTML document with lxml's C parser.
+    
+    Parameters:
+      - content: The raw document (bytes or str).
+    
+    Returns:
+      - The visible text of the body. Block elements (paragraphs, headings, list items, ...)
+        are separated by a blank line and <br> by a newline, so paragraph boundaries survive.
+    """
+    root = lxml.html.document_fromstring(content)
+    for element in root.xpath("//head|//script|//style"):
+        element.drop_tree()
+    for element in root.iter(BLOCK_TAGS):
+        element.tail = "\n\n" + (element.tail or "")
+    for element in root.iter("br"):
+        element.tail = "\n" + (element.tail or "")
+    return root.text_content()
+
+# Archives opened by the current process, reused across the EPUB items it parses.
+_open_archives = {}
+
+def _epub_item_text(file_path, name):
+    """
+    Reads one document from an EPUB archive and returns its text (see html_to_text).
+    
+    Each process keeps its own open ZipFile per archive, so pool workers read their
+    items directly instead of receiving the bytes from the parent.
+    """
+    archive = _open_archives.get(file_path)
+    if archive is None:
+        archive = _open_archives[file_path] = zipfile.ZipFile(file_path)
+    return html_to_text(archive.read(name))
+
+def _epub_item_task(args):
+    """Pool entry point for _epub_item_text."""
+    return _epub_item_text(*args)
+
+def iter_epub_item_results(file_path, max_workers=None, timeout_seconds=10, start=0):
+    """
+    Extracts the text of every content document of an EPUB, in spine order.
+    
+    Parameters:
+      - file_path: The path to the EPUB file.
+      - max_workers: Number of worker processes (defaults to the number of CPUs). Books with
+        fewer than EPUB_PARALLEL_MIN_ITEMS documents are parsed in a single process.
+      - timeout_seconds: The maximum number of seconds to wait for a single item.
+      - start: Index of the first document to extract (to resume an interrupted extraction).
+    
+    Yields:
+      - (index, status, value) tuples in reading order, like extract_units_with_watchdog.
     
     Mechanism:
-      - Sets an alarm signal to enforce a timeout.
-      - Attempts to extract text using the page's extract_text() method.
-      - Disables the alarm regardless of success or failure.
-    """
-    # Register our timeout handler for the SIGALRM signal.
-    signal.signal(signal.SIGALRM, timeout_handler)
-    # Set an alarm to go off after 'timeout_seconds'.
-    signal.alarm(timeout_seconds)
+      - Items are parsed by a multiprocessing pool, each worker reading its items from the archive.
+      - If an item does not finish within timeout_seconds, the pool is terminated (killing the
+        hung worker), the item is reported as timed out, and a new pool resumes after it.
+    """
+    names = epub_document_names(file_path)
+    max_workers = max_workers or os.cpu_count() or 1
+    if max_workers == 1 or len(names) < EPUB_PARALLEL_MIN_ITEMS:
+        yield from extract_units_with_watchdog(file_path, "epub", timeout_seconds, start)
+        return
+    while start < len(names):
+        with worker_context().Pool(min(max_workers, len(names) - start)) as pool:
+            results = pool.imap(_epub_item_task, [(file_path, name) for name in names[start:]])
+            next_start = len(names)
+            for index in range(start, len(names)):
+                try:
+                    yield index, "ok", results.next(timeout_seconds)
+                except multiprocessing.TimeoutError:
+                    yield index, "timeout", None
+                    next_start = index + 1
+                    break
+                except Exception as e:
+                    yield index, "error", str(e)
+        start = next_start
+
+def _open_units(file_path, file_type):
+    """
+    Opens a document and returns a list of callables, one per extractable unit.
+    
+    A unit is a PDF page or an EPUB document item. Calling a unit returns its text.
+    """
+    if file_type == "pdf":
+        reader = PyPDF2.PdfReader(file_path)
+        return [page.extract_text for page in reader.pages]
+    if file_type == "epub":
+        return [lambda name=name: _epub_item_text(file_path, name) for name in epub_document_names(file_path)]
+    raise ValueError("Unsupported file type")
+
+def _extraction_worker(file_path, file_type, start, stop, conn):
+    """
+    Entry point of the watchdog's child process.
+    
+    Opens the document, reports the number of units, then extracts units one by one
+    from `start` up to (but excluding) `stop` and sends each result back to the parent over `conn`.
+    """
     try:
-        # Attempt to extract text from the given PDF page.
-        text = page.extract_text()
-    finally:
-        # Disable the alarm so it does not affect subsequent operations.
-        signal.alarm(0)
-    return text
+        units = _open_units(file_path, file_type)
+    except Exception as e:
+        conn.send(("failed", str(e)))
+        return
+    conn.send(("opened", len(units)))
+    for i in range(start, min(stop, len(units)) if stop is not None else len(units)):
+        try:
+            conn.send(("ok", i, units[i]()))
+        except Exception as e:
+            conn.send(("error", i, str(e)))
+    conn.send(("done",))
 
-def read_pdf(file_path):
+def extract_units_with_watchdog(file_path, file_type, timeout_seconds=10, start=0, stop=None):
     """
-    Reads a PDF file and extracts text from each of its pages.
+    Extracts the text of every page (PDF) or document item (EPUB) with a per-unit timeout.
     
     Parameters:
-      - file_path: The path to the PDF file.
+      - file_path: The path to the PDF or EPUB file.
+      - file_type: Either 'pdf' or 'epub'.
+      - timeout_seconds: The maximum number of seconds to allow for a single unit.
+      - start: Index of the first unit to extract.
+      - stop: Index one past the last unit to extract (defaults to the end of the document).
     
-    Returns:
-      - A single string containing the concatenated text of all pages.
+    Yields:
+      - (index, status, value) tuples in reading order, where status is 'ok' (value is the text),
+        'error' (value is the error message) or 'timeout' (value is None).
     
-    Process:
-      - Opens the file in binary mode.
-      - Uses PyPDF2 to read the PDF.
-      - Iterates through each page and extracts text using extract_text_with_timeout.
-      - Handles timeouts and other errors gracefully, skipping problematic pages.
-    """
-    text = ""
-    with open(file_path, "rb") as f:
-        reader = PyPDF2.PdfReader(f)
-        total_pages = len(reader.pages)
-        for i, page in enumerate(reader.pages, start=1):
-            # For each page, attempt text extraction with a timeout.
+    Mechanism:
+      - Extraction runs in a child process that streams results back over a pipe.
+      - The parent acts as a watchdog: if no result arrives within timeout_seconds, the child
+        is killed, the unit is reported as timed out, and a new child resumes at the next unit.
+      - Unlike SIGALRM, this works from worker threads and from pool worker processes.
+    """
+    context = worker_context()
+    next_index = start
+    total = None
+    while total is None or next_index < total:
+        parent_conn, child_conn = context.Pipe(duplex=False)
+        process = context.Process(
+            target=_extraction_worker,
+            args=(file_path, file_type, next_index, stop, child_conn),
+            daemon=True
+        )
+        process.start()
+        # Only the child writes to the pipe; close our copy so EOF is detected if it dies.
+        child_conn.close()
+        try:
+            if not parent_conn.poll(OPEN_TIMEOUT_SECONDS):
+                raise TimeoutException(f"Timed out opening {file_path}.")
+            message = parent_conn.recv()
+            if message[0] == "failed":
+                raise ValueError(f"Could not open {file_path}: {message[1]}")
+            total = message[1] if stop is None else min(stop, message[1])
+            while next_index < total:
+                if not parent_conn.poll(timeout_seconds):
+                    # The current unit is hung: report it and restart after it.
+                    yield next_index, "timeout", None
+                    next_index += 1
+                    break
+                try:
+                    message = parent_conn.recv()
+                except EOFError:
+                    # The child died (e.g. crashed inside the parser) while on this unit.
+                    yield next_index, "error", "extraction process exited unexpectedly"
+                    next_index += 1
+                    break
+                if message[0] == "done":
+                    break
+                _, index, value = message
+                yield index, message[0], value
+                next_index = index + 1
+        finally:
+            if process.is_alive():
+                process.kill()
+            process.join()
+            parent_conn.close()
+
+def _raise_timeout(signum, frame):
+    raise TimeoutException("Timed out.")
+
+def _extract_pdf_shard(file_path, start, stop, timeout_seconds):
+    """
+    Extracts the pages in [start, stop) of a PDF in a pool worker, with a per-page timeout.
+    
+    The watchdog runs inside the worker instead of in a child process of its own: the task runs
+    in the worker's main thread, so a SIGALRM timer interrupts a page that takes longer than
+    timeout_seconds (PyPDF2 is pure Python) and the page is reported as timed out. Each worker
+    opens its own PdfReader, so shards never share parser state.
+    
+    Returns:
+      - A list of PageResult, one per page of the shard.
+    """
+    previous_handler = signal.signal(signal.SIGALRM, _raise_timeout)
+    try:
+        signal.setitimer(signal.ITIMER_REAL, OPEN_TIMEOUT_SECONDS, ALARM_REPEAT_SECONDS)
+        try:
+            pages = PyPDF2.PdfReader(file_path).pages
+        finally:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+        results = []
+        for index in range(start, min(stop, len(pages))):
+            status, text, error = "ok", "", None
+            signal.setitimer(signal.ITIMER_REAL, timeout_seconds, ALARM_REPEAT_SECONDS)
             try:
-                page_text = extract_text_with_timeout(page, timeout_seconds=10)
+                text = pages[index].extract_text() or ""
+                signal.setitimer(signal.ITIMER_REAL, 0)
             except TimeoutException:
-                print(f"Timeout processing page {i}, skipping this page.")
-                continue  # Skip this page if timeout occurs.
+                status, text = "timeout", ""
+            except Exception as e:
+                status, text, error = "error", "", str(e)
+            finally:
+                signal.setitimer(signal.ITIMER_REAL, 0)
+            results.append(PageResult(index, status, text, error))
+        return results
+    finally:
+        signal.signal(signal.SIGALRM, previous_handler)
+
+def iter_pdf_page_results(file_path, max_workers=None, pages_per_shard=None, timeout_seconds=10, start=0):
+    """
+    Extracts every page of a PDF by sharding page ranges across a process pool.
+    
+    Parameters:
+      - file_path: The path to the PDF file.
+      - max_workers: Number of worker processes (defaults to the number of CPUs).
+      - pages_per_shard: Number of consecutive pages handled by one task. By default the
+        document is split into about four shards per worker to balance uneven pages.
+      - timeout_seconds: The maximum number of seconds to allow for a single page.
+      - start: Index of the first page to extract (to resume an interrupted extraction).
+    
+    Yields:
+      - PageResult tuples in page order, as soon as the shard holding them is finished.
+        Failed or timed-out pages are included with status 'error' or 'timeout' and the
+        reason in `error`.
+    """
+    total_pages = len(PyPDF2.PdfReader(file_path).pages)
+    if total_pages <= start:
+        return
+    max_workers = max_workers or os.cpu_count() or 1
+    if pages_per_shard is None:
+        pages_per_shard = max(1, -(-(total_pages - start) // (max_workers * 4)))
+    shards = [(first, min(first + pages_per_shard, total_pages)) for first in range(start, total_pages, pages_per_shard)]
+    if max_workers == 1 or len(shards) == 1:
+        # No point paying for a pool: stream the whole document through a single watchdog.
+        for index, status, value in extract_units_with_watchdog(file_path, "pdf", timeout_seconds, start):
+            if status == "ok":
+                yield PageResult(index, status, value or "", None)
+            else:
+                yield PageResult(index, status, "", value)
+        return
+    with ProcessPoolExecutor(max_workers=min(max_workers, len(shards)), mp_context=worker_context()) as executor:
+        futures = [executor.submit(_extract_pdf_shard, file_path, first, stop, timeout_seconds) for first, stop in shards]
+        # Shards are consumed in submission order, so pages come back in reading order.
+        for (first, stop), future in zip(shards, futures):
+            try:
+                yield from future.result()
             except Exception as e:
-                print(f"Error processing page {i}: {e}")
-                continue  # Skip page if any other error occurs.
-            if page_text:
-                # Append the extracted text and add a newline for separation.
-                text += page_text + "\n"
+                # The worker died (e.g. the parser crashed) or could not open the file: the shard's pages failed.
+                yield from (PageResult(index, "error", "", f"extraction process failed: {e}") for index in range(first, stop))
+
+def extract_pdf_pages(file_path, max_workers=None, pages_per_shard=None, timeout_seconds=10):
+    """
+    Returns the list of PageResult produced by iter_pdf_page_results.
+    """
+    return list(iter_pdf_page_results(file_path, max_workers, pages_per_shard, timeout_seconds))
+
+def iter_pdf_page_units(file_path, max_workers=None, start=0):
+    """
+    Yields (page_number, text) for each non-empty PDF page, in order (page numbers start at 1),
+    from the page at index `start` on.
+    
+    Pages are extracted in parallel by iter_pdf_page_results; failed or timed-out pages are
+    skipped and reported in a single summary line at the end.
+    """
+    skipped = []
+    for page in iter_pdf_page_results(file_path, max_workers=max_workers, timeout_seconds=10, start=start):
+        if page.status != "ok":
+            skipped.append(page)
+        elif page.text:
+            yield page.index + 1, page.text
+    if skipped:
+        details = ", ".join(f"{page.index + 1} ({page.status})" for page in skipped)
+        print(f"Skipped {len(skipped)} PDF pages: {details}")
     print("Finished processing all PDF pages.")
-    return text
 
-def extract_epub_item_content(item, timeout_seconds=10):
+def iter_pdf_pages(file_path, max_workers=None):
+    """
+    Yields the text of each non-empty PDF page, in order (see iter_pdf_page_units).
+    """
+    for _, page_text in iter_pdf_page_units(file_path, max_workers):
+        yield page_text
+
+def read_pdf(file_path, max_workers=None):
     """
-    Extracts the content from an EPUB item with a timeout.
+    Reads a PDF file and extracts text from each of its pages.
     
     Parameters:
-      - item: An EPUB item object.
-      - timeout_seconds: Maximum allowed time for extraction.
+      - file_path: The path to the PDF file.
+      - max_workers: Number of worker processes used to extract pages in parallel.
     
     Returns:
-      - The content of the EPUB item as a byte string.
+      - A single string containing the concatenated text of all pages.
     
     Process:
-      - Sets an alarm for the timeout.
-      - Calls the get_content() method on the item.
-      - Disables the alarm afterward.
+      - Extracts the pages in parallel with iter_pdf_pages, which enforces a per-page timeout.
+      - Skips failed or timed-out pages and reports them in a single summary line.
     """
-    signal.signal(signal.SIGALRM, timeout_handler)
-    signal.alarm(timeout_seconds)
-    try:
-        content = item.get_content()
-    finally:
-        signal.alarm(0)
-    return content
+    # Join once at the end instead of growing a string page by page.
+    return "".join(page_text + "\n" for page_text in iter_pdf_pages(file_path, max_workers))
+
+def iter_epub_item_units(file_path, max_workers=None):
+    """
+    Yields (name, text) for each content document of an EPUB, in spine (reading) order,
+    where name is the document's path inside the archive.
+    
+    Items are parsed in parallel by iter_epub_item_results, which enforces a per-item timeout;
+    items that time out or fail are skipped.
+    """
+    for _, name, item_text in _iter_epub_indexed_units(file_path, max_workers):
+        yield name, item_text
+
+def _iter_epub_indexed_units(file_path, max_workers=None, start=0):
+    """Yields (index, name, text) for the items iter_epub_item_units yields, from spine index `start` on."""
+    names = epub_document_names(file_path)
+    for index, status, item_text in iter_epub_item_results(file_path, max_workers, timeout_seconds=10, start=start):
+        i = index + 1
+        if status == "timeout":
+            print(f"Timeout processing item {i}, skipping this item.")
+            continue  # Skip items that time out.
+        if status == "error":
+            print(f"Error processing item {i}: {item_text}")
+            continue  # Skip items with other errors.
+        yield index, names[index], item_text
+    print("Finished processing all EPUB items.")
+
+def iter_epub_items(file_path, max_workers=None):
+    """
+    Yields the text of each content document of an EPUB, in spine order (see iter_epub_item_units).
+    """
+    for _, item_text in iter_epub_item_units(file_path, max_workers):
+        yield item_text
 
 def read_epub(file_path):
     """
@@ -112,40 +438,58 @@ def read_epub(file_path):
       - A single string containing the concatenated text extracted from the EPUB.
     
     Process:
-      - Suppresses warnings from ebooklib for a cleaner output.
-      - Opens and reads the EPUB using ebooklib.
-      - Iterates over each item in the EPUB.
-      - Checks if the item is a document (i.e., XHTML content or an instance of epub.EpubHtml).
-      - Extracts the content, parses it with BeautifulSoup, and appends the text.
+      - Extracts every content document in spine order with iter_epub_items (lxml text, with a
+        blank line between paragraphs), parsing documents in parallel for larger books.
       - Handles timeouts and errors gracefully.
     """
-    # Suppress warnings related to EPUB processing.
-    warnings.filterwarnings("ignore", category=UserWarning, module="ebooklib.epub")
-    warnings.filterwarnings("ignore", category=FutureWarning, module="ebooklib.epub")
-    
-    # Read the EPUB book.
-    book = epub.read_epub(file_path)
-    text = ""
-    items = list(book.get_items())
-    total_items = len(items)
-    for i, item in enumerate(items, start=1):
-        # Check if the item is likely to be a document.
-        if item.get_type() == 'application/xhtml+xml' or isinstance(item, epub.EpubHtml):
-            try:
-                # Extract the raw content from the item.
-                content = extract_epub_item_content(item, timeout_seconds=10)
-                # Parse the content with BeautifulSoup to extract text while preserving some structure.
-                soup = BeautifulSoup(content, "html.parser")
-                # Get text with newline separators and append to overall text.
-                text += soup.get_text(separator="\n") + "\n"
-            except TimeoutException:
-                print(f"Timeout processing item {i}, skipping this item.")
-                continue  # Skip items that time out.
-            except Exception as e:
-                print(f"Error processing item {i}: {e}")
-                continue  # Skip items with other errors.
-    print("Finished processing all EPUB items.")
-    return text
+    return "".join(iter_book(file_path, "epub"))
+
+def _iter_xml_element_texts(file_path, encoded_only):
+    """
+    Yields the text of XML elements in document order (like root.iter()) without building the tree.
+    
+    Parameters:
+      - file_path: The path to the XML file.
+      - encoded_only: If True, only content:encoded elements are considered (see CONTENT_ENCODED_TAGS).
+    
+    An element's own text is complete once its first child starts or once it ends, so it is
+    yielded at that point. Finished elements are cleared and detached from their parent, which
+    keeps memory bounded by the depth of the document rather than its size.
+    """
+    # Stack of [element, text_already_handled] for the currently open elements.
+    open_elements = []
+    for event, elem in ET.iterparse(file_path, events=("start", "end")):
+        if event == "start":
+            if open_elements and not open_elements[-1][1]:
+                parent = open_elements[-1][0]
+                open_elements[-1][1] = True
+                if parent.text and (not encoded_only or parent.tag in CONTENT_ENCODED_TAGS):
+                    yield parent.text
+            open_elements.append([elem, False])
+        else:
+            _, handled = open_elements.pop()
+            if not handled and elem.text and (not encoded_only or elem.tag in CONTENT_ENCODED_TAGS):
+                yield elem.text
+            elem.clear()
+            if open_elements:
+                # A finished element is always the last child of its parent so far.
+                del open_elements[-1][0][-1]
+
+def iter_xml_texts(file_path):
+    """
+    Yields the text snippets that read_xml collects, one element at a time.
+    
+    The content:encoded elements (the posts of an RSS/WordPress export) are streamed first, with
+    any HTML markup they hold converted to text; if there are none, the file is streamed a second
+    time collecting text from every element.
+    """
+    found = False
+    for text in _iter_xml_element_texts(file_path, encoded_only=True):
+        found = True
+        yield html_to_text(f"<div>{text}</div>") if MARKUP_PATTERN.search(text) else text
+    if not found:
+        # Fallback: If no content:encoded elements, extract text from every element.
+        yield from _iter_xml_element_texts(file_path, encoded_only=False)
 
 def read_xml(file_path):
     """
@@ -158,21 +502,81 @@ def read_xml(file_path):
       - A string containing concatenated text extracted from the XML.
     
     Process:
-      - Parses the XML using ElementTree.
-      - Iterates through all elements to find those with tags containing 'content:encoded'.
+      - Streams the XML with ElementTree.iterparse (see iter_xml_texts).
+      - Collects the text of the content:encoded elements.
       - If no such elements are found, falls back to collecting text from all elements.
     """
-    tree = ET.parse(file_path)
-    root = tree.getroot()
-    texts = []
-    # Try to extract text from elements with 'content:encoded' in their tag.
-    for elem in root.iter():
-        if "content:encoded" in elem.tag and elem.text:
-            texts.append(elem.text)
-    if not texts:
-        # Fallback: If no 'content:encoded' elements, extract text from every element.
-        for elem in root.iter():
-            if elem.text:
-                texts.append(elem.text)
     # Join all collected text snippets into a single string separated by newlines.
-    return "\n".join(texts)
+    return "".join(iter_book(file_path, "xml"))
+
+def iter_book_units(file_path, file_type, checkpoint=None):
+    """
+    Streams a book as a sequence of source units, each labelled with its location.
+    
+    Parameters:
+      - file_path: The path to the book file.
+      - file_type: The type of the file ('xml', 'pdf', or 'epub').
+      - checkpoint: Optional path of a write-ahead journal of the extracted units (see
+        checkpoint.journaled_units): units it already holds are replayed instead of extracted
+        again, and every new unit is recorded in it before it is yielded.
+    
+    Yields:
+      - (location, text) tuples in reading order, where location is 'page N' for PDF pages,
+        'item <name>' for EPUB spine documents and 'element N' for XML elements.
+    
+    When profiling, the time spent waiting for each unit is recorded as a 'unit' span.
+    """
+    if checkpoint is None:
+        units = ((location, text) for _, location, text in _iter_indexed_units(file_path, file_type))
+    else:
+        units = journaled_units(checkpoint, lambda start: _iter_indexed_units(file_path, file_type, start))
+    return profiling.traced_iter(units, "unit", lambda unit: (unit[0], {"chars": len(unit[1])}))
+
+def _iter_indexed_units(file_path, file_type, start=0):
+    """
+    Yields (index, location, text) for the units of a book from extraction index `start` on,
+    where index is the position of the page, spine item or element in the source.
+    """
+    if file_type == "pdf":
+        for page_number, page_text in iter_pdf_page_units(file_path, start=start):
+            yield page_number - 1, f"page {page_number}", page_text
+    elif file_type == "epub":
+        for index, name, item_text in _iter_epub_indexed_units(file_path, start=start):
+            yield index, f"item {name}", item_text
+    elif file_type == "xml":
+        for i, text in enumerate(iter_xml_texts(file_path)):
+            if i >= start:
+                yield i, f"element {i + 1}", text
+    else:
+        raise ValueError("Unsupported file type")
+
+def iter_book(file_path, file_type, units=None, normalize=False, stats=None, checkpoint=None):
+    """
+    Streams a book as a sequence of text pieces (pages, items or elements plus separators).
+    
+    Parameters:
+      - file_path: The path to the book file.
+      - file_type: The type of the file ('xml', 'pdf', or 'epub').
+      - units: Optional list; the location of every unit is appended to it just before the
+        unit's text is yielded, so a consumer can tell where each unit starts.
+      - normalize: If True, the units go through normalization.normalize_units, which drops
+        running headers, page numbers, front/back matter and navigation and joins hyphenated words.
+      - stats: Optional dict (normalization.new_stats()) filled with what normalization removed.
+      - checkpoint: Optional path of the journal of extracted units (see iter_book_units).
+    
+    Yields:
+      - Strings whose concatenation equals read_xml, read_pdf or read_epub of the file (without normalization).
+        Only one page, item or element is held in memory at a time (a few pages when normalizing).
+    """
+    book_units = iter_book_units(file_path, file_type, checkpoint)
+    if normalize:
+        book_units = normalize_units(book_units, file_type, stats)
+    for i, (location, text) in enumerate(book_units):
+        # XML elements are separated by newlines; pages and items are each followed by one.
+        if i and file_type == "xml":
+            yield "\n"
+        if units is not None:
+            units.append(location)
+        yield text
+        if file_type != "xml":
+            yield "\n"
@@ -0,0 +1,176 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+# Default location of the cache database, relative to the project root.
+DEFAULT_CACHE_PATH = ".llm_cache.sqlite3"
+
+# Entries older than this are evicted (30 days).
+DEFAULT_MAX_AGE_SECONDS = 30 * 24 * 3600
+
+# Once the stored responses exceed this many bytes, the least recently used ones are evicted.
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+# Eviction runs after this many writes instead of after every write.
+EVICT_EVERY = 100
+
+def make_key(model, messages, temperature, max_tokens):
+    """
+    Builds the cache key of a chat completion request.
+
+    Parameters:
+      - model (str): The model name.
+      - messages (list): The chat messages sent to the model.
+      - temperature (float): The sampling temperature.
+      - max_tokens (int): The completion token limit.
+
+    Returns:
+      - str: A SHA-256 hex digest of the canonical JSON form of the request.
+    """
+    payload = json.dumps(
+        {"model": model, "messages": messages, "temperature": temperature, "max_tokens": max_tokens},
+        sort_keys=True,
+        ensure_ascii=False
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+class LLMCache:
+    """
+    Persistent cache of model responses stored in SQLite.
+
+    - Entries expire after max_age_seconds.
+    - When the total size of the stored responses exceeds max_bytes, the least recently
+      used entries are evicted first.
+    - The database runs in WAL mode with a busy timeout, so several threads and worker
+      processes can read and write it at the same time. Each thread gets its own connection.
+    - `hits` and `misses` count lookups made through this instance.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_age_seconds=DEFAULT_MAX_AGE_SECONDS, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = path
+        self.max_age_seconds = max_age_seconds
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                " key TEXT PRIMARY KEY,"
+                " response TEXT NOT NULL,"
+                " size INTEGER NOT NULL,"
+                " created REAL NOT NULL,"
+                " last_access REAL NOT NULL)"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+
+    def _connect(self):
+        """Returns the connection of the calling thread, opening it on first use."""
+        connection = getattr(self._local, "connection", None)
+        # A forked worker must not reuse the connection it inherited from its parent.
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def get(self, key):
+        """
+        Looks up a response and refreshes its last access time.
+
+        Returns:
+          - The cached response string, or None if it is missing or expired.
+        """
+        now = time.time()
+        connection = self._connect()
+        with connection:
+            row = connection.execute(
+                "SELECT response FROM responses WHERE key = ? AND created >= ?",
+                (key, now - self.max_age_seconds)
+            ).fetchone()
+            if row is not None:
+                connection.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+        with self._lock:
+            if row is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return None if row is None else row[0]
+
+    def contains(self, key):
+        """Checks for a live entry without touching the statistics or the access time."""
+        row = self._connect().execute(
+            "SELECT 1 FROM responses WHERE key = ? AND created >= ?",
+            (key, time.time() - self.max_age_seconds)
+        ).fetchone()
+        return row is not None
+
+    def peek(self, key):
+        """Returns a live response, or None, without touching the statistics or the access time."""
+        row = self._connect().execute(
+            "SELECT response FROM responses WHERE key = ? AND created >= ?",
+            (key, time.time() - self.max_age_seconds)
+        ).fetchone()
+        return None if row is None else row[0]
+
+    def put(self, key, response):
+        """Stores a response, evicting old entries every EVICT_EVERY writes."""
+        now = time.time()
+        connection = self._connect()
+        with connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO responses (key, response, size, created, last_access) VALUES (?, ?, ?, ?, ?)",
+                (key, response, len(response.encode("utf-8")), now, now)
+            )
+        with self._lock:
+            self._writes += 1
+            should_evict = self._writes % EVICT_EVERY == 0
+        if should_evict:
+            self.evict()
+
+    def evict(self):
+        """
+        Removes expired entries, then the least recently used ones until the cache fits in max_bytes.
+
+        Returns:
+          - int: The number of entries removed.
+        """
+        connection = self._connect()
+        with connection:
+            removed = connection.execute(
+                "DELETE FROM responses WHERE created < ?", (time.time() - self.max_age_seconds,)
+            ).rowcount
+            total = connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            if total > self.max_bytes:
+                excess = total - self.max_bytes
+                freed = 0
+                stale = []
+                for key, size in connection.execute("SELECT key, size FROM responses ORDER BY last_access"):
+                    if freed >= excess:
+                        break
+                    stale.append((key,))
+                    freed += size
+                connection.executemany("DELETE FROM responses WHERE key = ?", stale)
+                removed += len(stale)
+        return removed
+
+    def stats(self):
+        """
+        Returns:
+          - dict: hits, misses, number of entries and total stored bytes.
+        """
+        entries, size = self._connect().execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": entries, "bytes": size}
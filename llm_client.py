@@ -0,0 +1,287 @@
+import os
+import time
+import asyncio
+import threading
+import concurrent.futures
+from dotenv import load_dotenv
+import openai
+from llm_cache import LLMCache, make_key
+from llm_scheduler import (
+    RequestScheduler, PRIORITY_REPORT, PRIORITY_NORMAL, PRIORITY_BULK, MAX_RETRIES,
+    DEFAULT_RPM, DEFAULT_TPM, DEFAULT_MAX_CONCURRENCY, classify_error, backoff_delay
+)
+from text_processing import estimate_tokens
+import profiling
+
+# Load OpenAI API key from .env file
+load_dotenv()
+openai.api_key = os.getenv("OPENAI_API_KEY")
+
+# Model used by every stage of the pipeline.
+DEFAULT_MODEL = "gpt-4o-mini-2024-07-18"
+
+# Shared response cache, created on first use (see get_cache).
+_cache = None
+
+# Shared rate limiter and retry scheduler, created on first use (see get_scheduler).
+_scheduler = None
+
+# Requests being sent right now, by cache key: identical requests made meanwhile wait for the
+# first one instead of being sent again (see _join_in_flight).
+_in_flight = {}
+_in_flight_lock = threading.Lock()
+
+def get_cache():
+    """
+    Returns the response cache shared by every OpenAI call site, opening it on first use.
+
+    The database path can be overridden with the LLM_CACHE_PATH environment variable.
+    """
+    global _cache
+    if _cache is None:
+        _cache = LLMCache(os.getenv("LLM_CACHE_PATH", ".llm_cache.sqlite3"))
+    return _cache
+
+def set_cache(cache):
+    """Replaces the shared response cache (e.g. to point it at another database)."""
+    global _cache
+    _cache = cache
+
+def get_scheduler():
+    """
+    Returns the request scheduler shared by every OpenAI call site, creating it on first use.
+
+    The account limits can be set with the OPENAI_RPM, OPENAI_TPM and OPENAI_MAX_CONCURRENCY
+    environment variables.
+    """
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = RequestScheduler(
+            rpm=int(os.getenv("OPENAI_RPM", DEFAULT_RPM)),
+            tpm=int(os.getenv("OPENAI_TPM", DEFAULT_TPM)),
+            max_concurrency=int(os.getenv("OPENAI_MAX_CONCURRENCY", DEFAULT_MAX_CONCURRENCY))
+        )
+    return _scheduler
+
+def set_scheduler(scheduler):
+    """Replaces the shared request scheduler (e.g. with different limits)."""
+    global _scheduler
+    _scheduler = scheduler
+
+def estimate_request_tokens(messages, max_tokens):
+    """
+    Estimates the tokens a request counts against the TPM limit: its prompt plus the completion limit.
+    """
+    return sum(estimate_tokens(message["content"]) + 4 for message in messages) + max_tokens
+
+def _used_tokens(response):
+    """Returns the total tokens reported by a response, or None if it does not report usage."""
+    try:
+        return int(response["usage"]["total_tokens"])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+def _token_usage(response, messages, content):
+    """
+    Returns the prompt and completion tokens of a response, estimated from the text when the
+    response does not report usage.
+    """
+    try:
+        usage = response["usage"]
+        return {"prompt_tokens": int(usage["prompt_tokens"]), "completion_tokens": int(usage["completion_tokens"])}
+    except (KeyError, TypeError, ValueError):
+        return {
+            "prompt_tokens": sum(estimate_tokens(message["content"]) for message in messages),
+            "completion_tokens": estimate_tokens(content),
+            "estimated_tokens": True,
+        }
+
+def _join_in_flight(key):
+    """
+    Registers a request that missed the cache.
+
+    Returns:
+      - (future, owner): owner is True for the first caller, which sends the request and then calls
+        _finish_in_flight; the other callers (from any thread or event loop) wait on the future.
+    """
+    with _in_flight_lock:
+        future = _in_flight.get(key)
+        if future is not None:
+            return future, False
+        future = _in_flight[key] = concurrent.futures.Future()
+        return future, True
+
+def _finish_in_flight(key, future, content=None, error=None):
+    """Hands the owner's result (or error) to the callers waiting on the same request."""
+    with _in_flight_lock:
+        del _in_flight[key]
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(content)
+
+def _failed(scheduler, error, attempt, started):
+    """
+    Records a failed attempt and returns how long to wait before retrying it.
+    Raises the error again if it is not retryable or the attempts are exhausted.
+    """
+    outcome = classify_error(error)
+    scheduler.release(time.monotonic() - started, outcome or "error")
+    if outcome is None or attempt == MAX_RETRIES:
+        scheduler.record_failure()
+        raise error
+    scheduler.record_retry()
+    profiling.current_span().add("retries")
+    delay = backoff_delay(attempt, error)
+    print(f"OpenAI request failed ({type(error).__name__}), retrying in {delay:.1f}s...")
+    return delay
+
+def chat_completion(messages, model=DEFAULT_MODEL, temperature=0.7, max_tokens=150, priority=PRIORITY_NORMAL):
+    """
+    Sends a chat completion request, answering from the persistent cache when possible.
+
+    Requests that miss the cache go through the shared scheduler (see llm_scheduler): they wait
+    for the RPM/TPM limits and the adaptive concurrency limit, in priority order, and are retried
+    with jittered exponential backoff on 429s and transient errors. An identical request already
+    being sent (from any thread) is not sent again: the caller waits for its response.
+
+    Parameters:
+      - messages (list): The chat messages ({"role": ..., "content": ...}).
+      - model (str): The model name.
+      - temperature (float): The sampling temperature.
+      - max_tokens (int): The completion token limit.
+      - priority (int): PRIORITY_REPORT, PRIORITY_NORMAL or PRIORITY_BULK (lower goes first).
+
+    Returns:
+      - str: The stripped content of the first choice.
+    """
+    with profiling.span("chat_completion", "llm", priority=priority, max_tokens=max_tokens) as call_span:
+        return _chat_completion(messages, model, temperature, max_tokens, priority, call_span)
+
+def _chat_completion(messages, model, temperature, max_tokens, priority, call_span):
+    """Does the work of chat_completion, recording cache hits, tokens and retries on its span."""
+    cache = get_cache()
+    key = make_key(model, messages, temperature, max_tokens)
+    cached = cache.get(key)
+    if cached is not None:
+        call_span.set(cache_hits=1)
+        return cached
+    future, owner = _join_in_flight(key)
+    if not owner:
+        call_span.set(cache_hits=1, shared=1)
+        return future.result()
+    try:
+        content = _send(messages, model, temperature, max_tokens, priority, call_span)
+    except BaseException as e:
+        _finish_in_flight(key, future, error=e)
+        raise
+    cache.put(key, content)
+    _finish_in_flight(key, future, content)
+    return content
+
+def _send(messages, model, temperature, max_tokens, priority, call_span):
+    """Sends a request through the scheduler, retrying transient errors; returns the stripped content."""
+    scheduler = get_scheduler()
+    estimated = estimate_request_tokens(messages, max_tokens)
+    for attempt in range(MAX_RETRIES + 1):
+        scheduler.acquire(estimated, priority)
+        started = time.monotonic()
+        try:
+            response = openai.ChatCompletion.create(
+                 model=model,
+                 messages=messages,
+                 temperature=temperature,
+                 max_tokens=max_tokens
+            )
+        except Exception as e:
+            time.sleep(_failed(scheduler, e, attempt, started))
+            continue
+        scheduler.release(time.monotonic() - started, None, _used_tokens(response), estimated)
+        break
+    content = response.choices[0].message["content"].strip()
+    call_span.set(cache_hits=0, **_token_usage(response, messages, content))
+    return content
+
+async def achat_completion(messages, model=DEFAULT_MODEL, temperature=0.7, max_tokens=150, priority=PRIORITY_NORMAL,
+                           on_text=None):
+    """
+    Asynchronous counterpart of chat_completion (uses openai.ChatCompletion.acreate).
+
+    With on_text, a request that misses the cache is streamed (stream=True) and on_text(text) is
+    called with the text received so far after every delta; a retried request starts again from
+    an empty text. A response from the cache (or from an identical request in flight) is passed
+    to on_text once, whole. The returned content and the cached entry are the same as without
+    streaming.
+    """
+    with profiling.span("chat_completion", "llm", priority=priority, max_tokens=max_tokens) as call_span:
+        return await _achat_completion(messages, model, temperature, max_tokens, priority, call_span, on_text)
+
+async def _achat_completion(messages, model, temperature, max_tokens, priority, call_span, on_text=None):
+    """Does the work of achat_completion, recording cache hits, tokens and retries on its span."""
+    cache = get_cache()
+    key = make_key(model, messages, temperature, max_tokens)
+    content = cache.get(key)
+    if content is not None:
+        call_span.set(cache_hits=1)
+    else:
+        future, owner = _join_in_flight(key)
+        if not owner:
+            call_span.set(cache_hits=1, shared=1)
+            content = await asyncio.wrap_future(future)
+        else:
+            try:
+                content = await _asend(messages, model, temperature, max_tokens, priority, call_span, on_text)
+            except BaseException as e:
+                _finish_in_flight(key, future, error=e)
+                raise
+            cache.put(key, content)
+            _finish_in_flight(key, future, content)
+            return content
+    if on_text is not None:
+        on_text(content)
+    return content
+
+async def _read_stream(response, on_text):
+    """Collects the deltas of a streamed completion, passing the text received so far to on_text."""
+    parts = []
+    async for chunk in response:
+        delta = chunk["choices"][0].get("delta", {}).get("content")
+        if delta:
+            parts.append(delta)
+            on_text("".join(parts).lstrip())
+    return "".join(parts)
+
+async def _asend(messages, model, temperature, max_tokens, priority, call_span, on_text=None):
+    """Asynchronous counterpart of _send; streams the completion when on_text is given."""
+    scheduler = get_scheduler()
+    estimated = estimate_request_tokens(messages, max_tokens)
+    for attempt in range(MAX_RETRIES + 1):
+        await scheduler.acquire_async(estimated, priority)
+        started = time.monotonic()
+        try:
+            response = await openai.ChatCompletion.acreate(
+                 model=model,
+                 messages=messages,
+                 temperature=temperature,
+                 max_tokens=max_tokens,
+                 **({"stream": True} if on_text is not None else {})
+            )
+            if on_text is not None:
+                # A streamed response reports no usage; the scheduler keeps its estimate.
+                streamed = await _read_stream(response, on_text)
+        except asyncio.CancelledError:
+            scheduler.release()
+            raise
+        except Exception as e:
+            await asyncio.sleep(_failed(scheduler, e, attempt, started))
+            continue
+        if on_text is not None:
+            scheduler.release(time.monotonic() - started, None, None, estimated)
+            content = streamed.strip()
+            call_span.set(cache_hits=0, streamed=1, **_token_usage(None, messages, content))
+            return content
+        scheduler.release(time.monotonic() - started, None, _used_tokens(response), estimated)
+        break
+    content = response.choices[0].message["content"].strip()
+    call_span.set(cache_hits=0, **_token_usage(response, messages, content))
+    return content
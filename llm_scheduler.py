@@ -0,0 +1,252 @@
+import time
+import heapq
+import random
+import asyncio
+import itertools
+import threading
+
+# Request priorities: lower values are admitted first.
+PRIORITY_REPORT = 0   # Title, paragraphs: the user is waiting for these.
+PRIORITY_NORMAL = 1   # Comparative analysis, thesis.
+PRIORITY_BULK = 2     # Chunk and section summaries.
+
+# Default account limits (requests and tokens per minute) and concurrency bounds.
+DEFAULT_RPM = 500
+DEFAULT_TPM = 200000
+DEFAULT_MAX_CONCURRENCY = 16
+DEFAULT_MIN_CONCURRENCY = 1
+
+# Requests slower than this count as a sign of overload for the adaptive concurrency limit.
+DEFAULT_LATENCY_TARGET_SECONDS = 30.0
+
+# Retry policy: exponential backoff with full jitter, capped.
+MAX_RETRIES = 6
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_MAX_SECONDS = 60.0
+
+# How often waiting requests re-check whether they can be admitted.
+POLL_SECONDS = 0.05
+
+# Errors (by class name) that are worth retrying besides HTTP 429 and 5xx responses.
+RETRYABLE_ERROR_NAMES = {
+    "RateLimitError", "APIConnectionError", "Timeout", "APITimeoutError",
+    "ServiceUnavailableError", "TryAgain", "InternalServerError",
+}
+
+class TokenBucket:
+    """
+    Token bucket refilled continuously at `per_minute` units per minute, holding at most one minute's worth.
+
+    Used for both requests per minute (one unit per request) and tokens per minute (the estimated
+    prompt plus completion tokens of a request).
+    """
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount, now):
+        """Seconds until `amount` units are available (requests larger than the bucket wait for a full bucket)."""
+        self._refill(now)
+        missing = min(amount, self.capacity) - self.level
+        return max(missing, 0.0) / self.rate
+
+    def take(self, amount):
+        # The level may go negative for requests larger than the bucket; later requests then wait longer.
+        self.level -= amount
+
+    def adjust(self, amount):
+        """Corrects a previous take once the real usage is known (positive amount takes more)."""
+        self.level = min(self.capacity, self.level - amount)
+
+class AdaptiveLimit:
+    """
+    AIMD (additive increase, multiplicative decrease) concurrency limit.
+
+    Every successful, fast request raises the limit by 1/limit (about +1 per round of requests);
+    a throttled or slow request halves it, at most once per `cooldown_seconds` so that a burst of
+    429s from the same round only counts once.
+    """
+
+    def __init__(self, initial, minimum=DEFAULT_MIN_CONCURRENCY, maximum=DEFAULT_MAX_CONCURRENCY,
+                 latency_target=DEFAULT_LATENCY_TARGET_SECONDS, cooldown_seconds=1.0):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.latency_target = latency_target
+        self.cooldown_seconds = cooldown_seconds
+        self.last_decrease = 0.0
+
+    def on_success(self, latency):
+        if latency > self.latency_target:
+            self.on_overload()
+        else:
+            self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+
+    def on_overload(self):
+        now = time.monotonic()
+        if now - self.last_decrease >= self.cooldown_seconds:
+            self.limit = max(self.minimum, self.limit / 2.0)
+            self.last_decrease = now
+
+    @property
+    def value(self):
+        return max(self.minimum, int(self.limit))
+
+def classify_error(error):
+    """
+    Decides how to handle a failed request.
+
+    Returns:
+      - 'throttled' for rate-limit errors (HTTP 429), 'retry' for transient errors (timeouts,
+        connection errors, HTTP 5xx), or None if the error should be raised.
+    """
+    status = getattr(error, "http_status", None) or getattr(error, "status_code", None)
+    name = type(error).__name__
+    if status == 429 or name == "RateLimitError":
+        return "throttled"
+    if (status is not None and status >= 500) or name in RETRYABLE_ERROR_NAMES:
+        return "retry"
+    return None
+
+def retry_after(error):
+    """Returns the delay requested by the server's Retry-After header, if any."""
+    headers = getattr(error, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after") or headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+def backoff_delay(attempt, error=None):
+    """
+    Delay before retry number `attempt` (starting at 0): a random duration between 0 and
+    BACKOFF_BASE_SECONDS * 2**attempt (capped at BACKOFF_MAX_SECONDS), or the server's
+    Retry-After value if it is longer.
+    """
+    delay = random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt))
+    requested = retry_after(error) if error is not None else None
+    return max(delay, requested or 0.0)
+
+class RequestScheduler:
+    """
+    Admission control shared by every model call of the process.
+
+    - Requests and tokens per minute are limited by two token buckets.
+    - The number of requests in flight is limited by an AIMD limit driven by 429s and latency.
+    - Waiting requests are admitted in (priority, arrival) order, so report requests go ahead
+      of queued chunk summaries.
+
+    The state is protected by a lock and waiters poll it, so the same scheduler can be used from
+    threads and from several event loops (each pipeline stage runs its own loop).
+    """
+
+    def __init__(self, rpm=DEFAULT_RPM, tpm=DEFAULT_TPM, max_concurrency=DEFAULT_MAX_CONCURRENCY,
+                 initial_concurrency=None, latency_target=DEFAULT_LATENCY_TARGET_SECONDS):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.concurrency = AdaptiveLimit(initial_concurrency or max(1, max_concurrency // 2),
+                                         maximum=max_concurrency, latency_target=latency_target)
+        self.in_flight = 0
+        self._waiting = []
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        self.stats = {"requests": 0, "throttled": 0, "retries": 0, "failures": 0}
+
+    def enqueue(self, priority):
+        """Registers a waiting request and returns its ticket."""
+        ticket = (priority, next(self._counter))
+        with self._lock:
+            heapq.heappush(self._waiting, ticket)
+        return ticket
+
+    def try_admit(self, ticket, tokens):
+        """
+        Admits the request if it is first in line and the limits allow it.
+
+        Returns:
+          - 0 if it was admitted, otherwise a hint of how long to wait (seconds).
+        """
+        with self._lock:
+            if self._waiting[0] != ticket or self.in_flight >= self.concurrency.value:
+                return POLL_SECONDS
+            now = time.monotonic()
+            wait = max(self.requests.wait_time(1, now), self.tokens.wait_time(tokens, now))
+            if wait > 0:
+                return min(wait, 1.0)
+            heapq.heappop(self._waiting)
+            self.requests.take(1)
+            self.tokens.take(tokens)
+            self.in_flight += 1
+            self.stats["requests"] += 1
+            return 0
+
+    def acquire(self, tokens, priority=PRIORITY_NORMAL):
+        """Blocks the calling thread until the request may be sent."""
+        ticket = self.enqueue(priority)
+        try:
+            while True:
+                wait = self.try_admit(ticket, tokens)
+                if not wait:
+                    return
+                time.sleep(wait)
+        except BaseException:
+            # A ticket left at the head of the line would keep every later request waiting.
+            self._withdraw(ticket)
+            raise
+
+    async def acquire_async(self, tokens, priority=PRIORITY_NORMAL):
+        """Waits, without blocking the event loop, until the request may be sent."""
+        ticket = self.enqueue(priority)
+        try:
+            while True:
+                wait = self.try_admit(ticket, tokens)
+                if not wait:
+                    return
+                await asyncio.sleep(wait)
+        except BaseException:
+            self._withdraw(ticket)
+            raise
+
+    def _withdraw(self, ticket):
+        with self._lock:
+            if ticket in self._waiting:
+                self._waiting.remove(ticket)
+                heapq.heapify(self._waiting)
+
+    def release(self, latency=None, outcome=None, used_tokens=None, estimated_tokens=None):
+        """
+        Records the end of an admitted request.
+
+        Parameters:
+          - latency (float): Duration of the request in seconds.
+          - outcome (str): None on success, or the result of classify_error.
+          - used_tokens, estimated_tokens (int): Actual and estimated token usage, to correct the TPM bucket.
+        """
+        with self._lock:
+            self.in_flight -= 1
+            if outcome == "throttled":
+                self.stats["throttled"] += 1
+                self.concurrency.on_overload()
+            elif outcome is None and latency is not None:
+                self.concurrency.on_success(latency)
+            if used_tokens is not None and estimated_tokens is not None:
+                self.tokens.adjust(used_tokens - estimated_tokens)
+
+    def record_retry(self):
+        with self._lock:
+            self.stats["retries"] += 1
+
+    def record_failure(self):
+        with self._lock:
+            self.stats["failures"] += 1
+
+    def summary(self):
+        """Returns the counters plus the current concurrency limit."""
+        with self._lock:
+            return dict(self.stats, concurrency=self.concurrency.value)
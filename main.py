@@ -1,91 +1,163 @@
-from ingestion import read_xml, read_pdf, read_epub
-from text_processing import clean_text
-from summarization import summarize_text, analyze_comparative
+import io
+import os
+import re
+import sys
+import argparse
+import contextlib
+import corpus_store
+import ingestion
+import summarization
+import text_processing
+import report_generation
+import retrieval
+import citations
+import profiling
+import batch
+import dedup
+import planner
+import report_stream
+from corpus_store import CorpusStore
+from ingestion import iter_book
+from text_processing import iter_clean, iter_token_chunks
+from summarization import summarize_book, digest_book, summarize_digests, analyze_comparative
+from retrieval import DEFAULT_THEME, PASSAGE_TOKENS, select_passages, group_passages
+from citations import extract_quotes, verify_quotes
+from batch import BatchRunner, summarize_books_batch
+from dedup import dedup_plans, apply_plan
 from report_generation import generate_thesis, generate_report
+from report_stream import ReportSidecar
+from checkpoint import Run
+from llm_client import get_cache, get_scheduler
+from pipeline import Pipeline, Stage
 from docx import Document
 from docx.shared import Pt
 from docx.enum.text import WD_PARAGRAPH_ALIGNMENT
 
-def process_book(file_path, file_type):
+# The three novels, in the order they are discussed in the report
+# (assumes a "Readings" folder in the project root).
+BOOKS = [
+    ("belljar", "Readings/The-Bell-Jar-1645639705._vanilla.xml", "xml"),
+    ("stranger", "Readings/the_stranger.pdf", "pdf"),
+    ("metamorphosis", "Readings/franz-kafka_metamorphosis.epub", "epub"),
+]
+
+# Where the final report is saved.
+OUTPUT_PATH = "Final_Book_Report.docx"
+
+# File type of each supported book extension.
+FILE_TYPES = {".xml": "xml", ".pdf": "pdf", ".epub": "epub"}
+
+# Characters replaced by '-' when a theme is used in stage names and file names.
+SLUG_PATTERN = re.compile(r"[^a-z0-9]+")
+
+def parse_book(value):
+    """
+    Parses a --book argument of the form NAME=PATH; the file type comes from the extension.
+
+    Returns:
+      - (name, file_path, file_type)
+    """
+    name, separator, file_path = value.partition("=")
+    file_type = FILE_TYPES.get(os.path.splitext(file_path)[1].lower())
+    if not separator or not name or file_type is None:
+        raise argparse.ArgumentTypeError(f"expected NAME=PATH with a .xml, .pdf or .epub file, got {value!r}")
+    return name, file_path, file_type
+
+def theme_slug(theme):
+    """Returns the form of a theme used in stage and file names ('social isolation' -> 'social-isolation')."""
+    return SLUG_PATTERN.sub("-", theme.lower()).strip("-")
+
+def theme_output_path(output_path, theme):
+    """Returns the report path of one theme in a multi-theme run: the theme's slug before the extension."""
+    base, extension = os.path.splitext(output_path)
+    return f"{base}-{theme_slug(theme)}{extension}"
+
+def corpus_chunks(corpus, retrieval_budget=None, chunk_tokens=text_processing.CHUNK_TOKENS,
+                  chunk_overlap=text_processing.CHUNK_OVERLAP_TOKENS, themes=(DEFAULT_THEME,)):
+    """
+    Returns the chunks summarized for a stored book: every sentence-aligned chunk of up to
+    chunk_tokens tokens of the memory-mapped text (decoded lazily, each repeating up to
+    chunk_overlap tokens of the previous one), or with a retrieval budget only the passages
+    relevant to the themes packed into chunks of up to chunk_tokens tokens (passages are not
+    contiguous, so chunk_overlap does not apply to them).
+    """
+    if retrieval_budget:
+        passages = select_passages(corpus, retrieval_budget, list(themes),
+                                   passage_tokens=min(PASSAGE_TOKENS, chunk_tokens))
+        chunks = group_passages(passages, chunk_tokens)
+        print(f"Summarizing {len(passages)} theme-relevant passages in {len(chunks)} chunks...")
+        return chunks
+    # Split the cleaned text so that no single request exceeds the model's context window.
+    print(f"Summarizing {len(corpus.token_chunk_spans(chunk_tokens, chunk_overlap))} chunks...")
+    return corpus.iter_token_chunks(chunk_tokens, chunk_overlap)
+
+def summarize_corpus(corpus, retrieval_budget=None, dedup_plan=None, chunk_tokens=text_processing.CHUNK_TOKENS,
+                     chunk_overlap=text_processing.CHUNK_OVERLAP_TOKENS, theme=DEFAULT_THEME):
     """
-    Process a book by:
-      1. Reading the file content based on its file type (XML, PDF, or EPUB).
-      2. Cleaning the extracted text to remove extra whitespace.
-      3. Summarizing the cleaned text using the OpenAI API (with citations).
-    
+    Summarize a book opened from the corpus store by:
+      1. Slicing the memory-mapped cleaned text into sentence-aligned, token-budgeted chunks using the stored offsets.
+      2. Summarizing the chunks concurrently and reducing them into one summary (with citations).
+
+    With a retrieval budget, only the passages most relevant to the theme (BM25 over a local
+    index persisted next to the corpus) are summarized, up to that many model tokens.
+
+    Parameters:
+      - corpus (MappedCorpus): The cleaned book, as returned by CorpusStore.open.
+      - retrieval_budget (int): Maximum input tokens sent for the book (None sends the whole book).
+      - dedup_plan (dict): The book's plan from the dedup stage: near-duplicate chunks are dropped
+        or replaced by the chunk they repeat (see dedup.apply_plan).
+      - chunk_tokens (int): Token budget of each chunk.
+      - chunk_overlap (int): Tokens of trailing sentences repeated at the start of the next chunk.
+      - theme (str): The theme the summary focuses on (and passages are retrieved for).
+
+    Returns:
+      - str: A summary of the book focused on the theme.
+    """
+    chunks = corpus_chunks(corpus, retrieval_budget, chunk_tokens, chunk_overlap, [theme])
+    if dedup_plan:
+        chunks = apply_plan(chunks, dedup_plan)
+    # Generate a summary of the book with a map-reduce pass over its chunks.
+    summary = summarize_book(chunks, theme=theme)
+    return summary
+
+def process_book(file_path, file_type, store=None, stream=False):
+    """
+    Process a single book by:
+      1. Reading and cleaning the file content based on its file type (XML, PDF, or EPUB),
+         or reusing the cleaned text from the corpus store if the file was seen before.
+      2. Summarizing it with summarize_corpus.
+
+    With stream=True the corpus store is bypassed: pages/items/elements are streamed through
+    normalization, iter_clean and iter_token_chunks straight into summarization, so memory stays bounded by
+    the chunk size instead of the book size. Chunks get the same token budget as stored books (CHUNK_TOKENS).
+
     Parameters:
       - file_path (str): Path to the book file.
       - file_type (str): The type of the file ('xml', 'pdf', or 'epub').
+      - store (CorpusStore): The corpus store to use (defaults to the project store).
+      - stream (bool): Summarize directly from the streamed file.
 
     Returns:
       - str: A summary of the book focused on social isolation.
     """
-    # Read the book file according to its type.
-    if file_type == "xml":
-        raw_text = read_xml(file_path)
-    elif file_type == "pdf":
-        raw_text = read_pdf(file_path)
-    elif file_type == "epub":
-        raw_text = read_epub(file_path)
-    else:
-        raise ValueError("Unsupported file type")
-    
-    print("Finished reading file. Cleaning text...")
-    # Clean the extracted text.
-    cleaned = clean_text(raw_text)
-    
-    print("Summarizing entire text...")
-    # Generate a summary of the cleaned text using the OpenAI API.
-    summary = summarize_text(cleaned)
-    return summary
+    if stream:
+        return summarize_book(iter_token_chunks(iter_clean(iter_book(file_path, file_type, normalize=True))))
+    store = store or CorpusStore()
+    with store.open(store.ingest(file_path, file_type)) as corpus:
+        return summarize_corpus(corpus)
 
-def main():
+def export_docx(final_report, output_path=OUTPUT_PATH):
+    """
+    Exports the report as a DOCX file: the first block is the title, every following
+    block (separated by two newlines) is a justified paragraph with a first-line indent.
+
+    Returns:
+      - str: The path of the saved document.
     """
-    Main function to execute the entire workflow:
-      1. Define file paths for the three novels.
-      2. Process each book to produce summaries.
-      3. Analyze the summaries comparatively.
-      4. Generate a thesis statement based on the summaries and comparative analysis.
-      5. Generate a complete five-paragraph book report (with citations) using the thesis, summaries, and analysis.
-      6. Export the final report as a DOCX file.
-    """
-    # Define file paths (assumes a "Readings" folder in the project root).
-    xml_path = "Readings/The-Bell-Jar-1645639705._vanilla.xml"
-    pdf_path = "Readings/the_stranger.pdf"
-    epub_path = "Readings/franz-kafka_metamorphosis.epub"
-
-    # Process each book to obtain its summary.
-    print("Processing Metamorphosis (EPUB)...")
-    metamorphosis_summary = process_book(epub_path, "epub")
-    
-    print("Processing The Bell Jar (XML)...")
-    belljar_summary = process_book(xml_path, "xml")
-    
-    print("Processing The Stranger (PDF)...")
-    stranger_summary = process_book(pdf_path, "pdf")
-    
-    # Combine the individual book summaries into a list.
-    summaries = [belljar_summary, stranger_summary, metamorphosis_summary]
-    print("Analyzing comparative themes...")
-    # Analyze the summaries to extract thematic insights.
-    comparative_analysis = analyze_comparative(summaries)
-    
-    print("Generating thesis statement...")
-    # Generate a thesis statement based on the book summaries and their comparative analysis.
-    thesis_statement = generate_thesis(summaries, comparative_analysis)
-    print("Thesis generated:", thesis_statement)
-    
-    print("Generating final book report...")
-    # Generate the final five-paragraph book report.
-    book_summaries = [belljar_summary, stranger_summary, metamorphosis_summary]
-    final_report = generate_report(thesis_statement, book_summaries, comparative_analysis)
-    
-    # Export the final report as a DOCX file.
-    print("Exporting final report to DOCX...")
     document = Document()
     # Add a title to the document using a heading style.
     document.add_heading(final_report.split('\n\n')[0], 0)  # Assume title is the first line.
-    
+
     # Split the report into paragraphs (separated by two newlines).
     paragraphs = final_report.split("\n\n")
     # Skip the title if already used.
@@ -95,10 +167,480 @@ def main():
         p.paragraph_format.first_line_indent = Pt(36)
         # Optionally, align text to justify.
         p.alignment = WD_PARAGRAPH_ALIGNMENT.JUSTIFY
-    
+
     # Save the document.
-    document.save("Final_Book_Report.docx")
-    print("Book report generated and saved as Final_Book_Report.docx")
+    document.save(output_path)
+    return output_path
+
+def export_markdown(final_report, output_path):
+    """
+    Exports the report as a Markdown file: the title becomes a level-one heading and every
+    following block a paragraph.
+
+    Returns:
+      - str: The path of the saved file.
+    """
+    title, *paragraphs = final_report.split("\n\n")
+    with open(output_path, "w", encoding="utf-8") as f:
+        f.write(f"# {title.strip()}\n\n")
+        for para in paragraphs:
+            f.write(para.strip() + "\n\n")
+    return output_path
+
+# Stage functions. Each receives the outputs of the stages it depends on, in order.
+
+def ingest_stage(file_path, file_type):
+    """Extracts and cleans a book into the corpus store; returns its store key."""
+    return CorpusStore().ingest(file_path, file_type, in_worker=True)
+
+def dedup_stage(*keys, retrieval_budget=None, threshold=dedup.SIMILARITY_THRESHOLD,
+                chunk_tokens=text_processing.CHUNK_TOKENS, chunk_overlap=text_processing.CHUNK_OVERLAP_TOKENS,
+                themes=(DEFAULT_THEME,)):
+    """
+    Finds the near-duplicate chunks of the stored books, within and across books (see dedup.dedup_plans).
+
+    Returns the dedup plan of every book by store key, and the counts of duplicates and of the
+    summary calls and tokens they avoid. With threshold=None nothing is deduplicated.
+    """
+    if threshold is None:
+        return {"plans": {}, "stats": None}
+    store = CorpusStore()
+    books_chunks = []
+    for key in keys:
+        with store.open(key) as corpus:
+            books_chunks.append(list(corpus_chunks(corpus, retrieval_budget, chunk_tokens, chunk_overlap, themes)))
+    plans, stats = dedup_plans(books_chunks, threshold)
+    print(f"Near-duplicate chunks: {stats['within_book']} within books and {stats['across_books']} across books "
+          f"(of {stats['chunks']}); {stats['calls_avoided']} summary calls and ~{stats['tokens_avoided']:,} tokens avoided.")
+    return {"plans": dict(zip(keys, plans)), "stats": stats}
+
+def batch_stage(*inputs, retrieval_budget=None, poll_seconds=batch.DEFAULT_POLL_SECONDS,
+                chunk_tokens=text_processing.CHUNK_TOKENS, chunk_overlap=text_processing.CHUNK_OVERLAP_TOKENS,
+                theme=DEFAULT_THEME):
+    """
+    Runs every book's chunk and reduce summaries through the Batch API (see batch.summarize_books_batch),
+    filling the response cache so that the summarize stages afterwards make no requests.
+    Receives the store key of every book followed by the dedup stage's output; returns the request counts.
+    """
+    *keys, deduplicated = inputs
+    store = CorpusStore()
+    books_chunks = []
+    for key in keys:
+        with store.open(key) as corpus:
+            chunks = corpus_chunks(corpus, retrieval_budget, chunk_tokens, chunk_overlap, [theme])
+            if key in deduplicated["plans"]:
+                chunks = apply_plan(chunks, deduplicated["plans"][key])
+            books_chunks.append(list(chunks))
+    runner = BatchRunner(poll_seconds=poll_seconds)
+    summarize_books_batch(books_chunks, runner, theme=theme)
+    return runner.stats
+
+def summarize_stage(key, deduplicated, batch_stats=None, retrieval_budget=None,
+                    chunk_tokens=text_processing.CHUNK_TOKENS, chunk_overlap=text_processing.CHUNK_OVERLAP_TOKENS,
+                    theme=DEFAULT_THEME):
+    """Summarizes a stored book with its dedup plan (after the batch stage, if any, has cached the requests)."""
+    store = CorpusStore()
+    with store.open(key) as corpus:
+        return summarize_corpus(corpus, retrieval_budget, deduplicated["plans"].get(key), chunk_tokens, chunk_overlap, theme)
+
+def digest_stage(key, deduplicated, retrieval_budget=None, chunk_tokens=text_processing.CHUNK_TOKENS,
+                 chunk_overlap=text_processing.CHUNK_OVERLAP_TOKENS, themes=(DEFAULT_THEME,)):
+    """
+    Writes the theme-neutral digest of every chunk of a stored book (see summarization.digest_book),
+    with its dedup plan applied. Shared by the summaries of every theme of a multi-theme run.
+    """
+    store = CorpusStore()
+    with store.open(key) as corpus:
+        chunks = corpus_chunks(corpus, retrieval_budget, chunk_tokens, chunk_overlap, themes)
+        if key in deduplicated["plans"]:
+            chunks = apply_plan(chunks, deduplicated["plans"][key])
+        return digest_book(chunks)
+
+def theme_summary_stage(digests, theme=DEFAULT_THEME):
+    """Reduces a book's chunk digests into its summary for one theme (see summarization.summarize_digests)."""
+    return summarize_digests(digests, theme)
+
+def comparative_stage(*summaries, theme=DEFAULT_THEME):
+    """Analyzes the book summaries comparatively."""
+    return analyze_comparative(list(summaries), theme)
+
+def thesis_stage(*inputs, theme=DEFAULT_THEME):
+    """Generates the thesis from the book summaries followed by the comparative analysis."""
+    *summaries, comparative_analysis = inputs
+    thesis_statement = generate_thesis(summaries, comparative_analysis, theme)
+    print("Thesis generated:", thesis_statement)
+    return thesis_statement
+
+def report_stage(*inputs, theme=DEFAULT_THEME, output_path=None):
+    """
+    Generates the report from the book summaries, the comparative analysis and the thesis.
+
+    With an output_path, the title and paragraphs are streamed and each one is written to the
+    report's Markdown and JSONL sidecars as soon as it is finished (see report_stream.ReportSidecar),
+    long before the DOCX is exported.
+    """
+    *summaries, comparative_analysis, thesis_statement = inputs
+    if output_path is None:
+        return generate_report(thesis_statement, summaries, comparative_analysis, theme=theme)
+    with ReportSidecar(output_path) as sidecar:
+        report = generate_report(thesis_statement, summaries, comparative_analysis, theme=theme, on_progress=sidecar)
+    profiling.current_span().set(first_paragraph_seconds=sidecar.first_paragraph_seconds)
+    print(f"Report parts streamed to {sidecar.markdown_path} and {sidecar.jsonl_path}")
+    return report
+
+def citations_stage(*inputs, names=()):
+    """
+    Checks every quotation of the report against the stored books.
+
+    Receives the store key of every book (in the order of `names`) followed by the report.
+    Returns one dict per quotation: quote, found, book and location (page, spine item or element).
+    """
+    *keys, final_report = inputs
+    store = CorpusStore()
+    corpora = {name: store.open(key) for name, key in zip(names, keys)}
+    try:
+        checks = verify_quotes(extract_quotes(final_report), corpora)
+    finally:
+        for corpus in corpora.values():
+            corpus.close()
+    return [check._asdict() for check in checks]
+
+def print_citations(checks):
+    """Prints where each quotation was found, and flags the ones that occur in no book."""
+    invalid = [check for check in checks if not check["found"]]
+    print(f"Citations: {len(checks) - len(invalid)} of {len(checks)} quotations verified.")
+    for check in checks:
+        if check["found"]:
+            print(f"  ok       \"{check['quote']}\" ({check['book']}, {check['location']})")
+    for check in invalid:
+        print(f"  INVALID  \"{check['quote']}\" was not found in any book.")
+    return invalid
+
+def export_stage(final_report, checks, output_path=OUTPUT_PATH, strict_citations=False):
+    """
+    Flags invalid quotations, then writes the report to disk.
+
+    With strict_citations=True the report is not exported if any quotation is invalid.
+    """
+    invalid = print_citations(checks)
+    if invalid and strict_citations:
+        raise ValueError(f"{len(invalid)} quotations were not found in the books; the report was not exported.")
+    return export_docx(final_report, output_path)
+
+def build_pipeline(books=BOOKS, output_path=OUTPUT_PATH, max_workers=4, retrieval_budget=None,
+                   strict_citations=False, use_batch=False, batch_poll_seconds=batch.DEFAULT_POLL_SECONDS,
+                   dedup_threshold=dedup.SIMILARITY_THRESHOLD, chunk_tokens=text_processing.CHUNK_TOKENS,
+                   chunk_overlap=text_processing.CHUNK_OVERLAP_TOKENS, themes=None):
+    """
+    Describes the workflow as a DAG of stages:
+
+        ingest:<book> -> dedup -> summarize:<book> -> comparative -> thesis -> report -> citations -> export
+
+    Every book is ingested and summarized independently (and in parallel); the comparative
+    analysis, thesis and report depend on all summaries, and the report also on the thesis.
+    The dedup stage finds near-duplicate chunks across all books before any is summarized.
+    The citations stage checks the report's quotations against the stored books before export.
+    With use_batch=True a 'batch' stage between dedup and summarization sends all the
+    summarization requests through the Batch API first.
+
+    With several themes, the theme-agnostic work is done once and each theme gets its own report:
+
+        ingest:<book> -> dedup -> digest:<book> -> summarize:<book>:<theme> -> comparative:<theme>
+            -> thesis:<theme> -> report:<theme> -> citations:<theme> -> export:<theme>
+
+    The digest stages write a theme-neutral digest of every chunk (the map step, by far the
+    most requests); each theme's summaries only reduce those digests. The reports are written
+    next to output_path, with the theme's slug before the extension (see theme_output_path).
+
+    Parameters:
+      - books (list): (name, file_path, file_type) tuples, in report order.
+      - output_path (str): Where the DOCX file is written.
+      - max_workers (int): Maximum number of stages running at once.
+      - retrieval_budget (int): Token budget of theme-relevant passages summarized per book
+        (None summarizes whole books).
+      - strict_citations (bool): Refuse to export a report containing quotations not found in the books.
+      - use_batch (bool): Run the summarization requests through the Batch API (single theme only).
+      - batch_poll_seconds (float): Seconds between two status checks of a running batch.
+      - dedup_threshold (float): Similarity above which chunks are near-duplicates (None disables dedup).
+      - chunk_tokens (int): Token budget of each summarized chunk.
+      - chunk_overlap (int): Tokens of trailing sentences repeated at the start of the next chunk.
+      - themes (list): The themes to report on (defaults to social isolation only).
+
+    Returns:
+      - Pipeline: The configured pipeline.
+    """
+    themes = list(dict.fromkeys(themes or [DEFAULT_THEME]))
+    if use_batch and len(themes) > 1:
+        raise ValueError("The Batch API stage only supports a single theme.")
+    pipeline = Pipeline(max_workers=max_workers)
+    chunking = {"chunk_tokens": chunk_tokens, "chunk_overlap": chunk_overlap}
+    ingest_stages = [f"ingest:{name}" for name, _, _ in books]
+    for name, file_path, file_type in books:
+        pipeline.add(Stage(
+            f"ingest:{name}", ingest_stage,
+            params={"file_path": file_path, "file_type": file_type},
+            files=[file_path],
+            code=[ingest_stage, ingestion, text_processing, corpus_store],
+            # The stage's output is only a key: the book itself lives in the corpus store.
+            validate=CorpusStore().contains
+        ))
+    pipeline.add(Stage(
+        "dedup", dedup_stage,
+        inputs=ingest_stages,
+        params={"retrieval_budget": retrieval_budget, "threshold": dedup_threshold, "themes": themes, **chunking},
+        code=[dedup_stage, corpus_chunks, dedup, retrieval, text_processing, corpus_store.MappedCorpus]
+    ))
+    if len(themes) == 1:
+        if use_batch:
+            pipeline.add(Stage(
+                "batch", batch_stage,
+                inputs=ingest_stages + ["dedup"],
+                params={"retrieval_budget": retrieval_budget, "poll_seconds": batch_poll_seconds,
+                        "theme": themes[0], **chunking},
+                code=[batch_stage, corpus_chunks, apply_plan, batch, summarization, retrieval, text_processing]
+            ))
+        summary_stages = []
+        for name, _, _ in books:
+            pipeline.add(Stage(
+                f"summarize:{name}", summarize_stage,
+                inputs=[f"ingest:{name}", "dedup"] + (["batch"] if use_batch else []),
+                params={"retrieval_budget": retrieval_budget, "theme": themes[0], **chunking},
+                code=[summarize_stage, summarize_corpus, corpus_chunks, apply_plan, summarization, retrieval,
+                      text_processing, corpus_store.MappedCorpus]
+            ))
+            summary_stages.append(f"summarize:{name}")
+        add_report_stages(pipeline, books, summary_stages, themes[0], "", output_path, strict_citations)
+        return pipeline
+
+    for name, _, _ in books:
+        pipeline.add(Stage(
+            f"digest:{name}", digest_stage,
+            inputs=[f"ingest:{name}", "dedup"],
+            params={"retrieval_budget": retrieval_budget, "themes": themes, **chunking},
+            code=[digest_stage, corpus_chunks, apply_plan, summarization, retrieval,
+                  text_processing, corpus_store.MappedCorpus]
+        ))
+    for theme in themes:
+        slug = theme_slug(theme)
+        summary_stages = []
+        for name, _, _ in books:
+            pipeline.add(Stage(
+                f"summarize:{name}:{slug}", theme_summary_stage,
+                inputs=[f"digest:{name}"],
+                params={"theme": theme},
+                code=[theme_summary_stage, summarization]
+            ))
+            summary_stages.append(f"summarize:{name}:{slug}")
+        add_report_stages(pipeline, books, summary_stages, theme, f":{slug}",
+                          theme_output_path(output_path, theme), strict_citations)
+    return pipeline
+
+def add_report_stages(pipeline, books, summary_stages, theme, suffix, output_path, strict_citations):
+    """
+    Adds the comparative, thesis, report, citations and export stages of one theme's report,
+    reading the given summary stages. Their names end with suffix (e.g. ':identity', or '').
+    """
+    pipeline.add(Stage(
+        f"comparative{suffix}", comparative_stage,
+        inputs=summary_stages,
+        params={"theme": theme},
+        code=[comparative_stage, analyze_comparative]
+    ))
+    pipeline.add(Stage(
+        f"thesis{suffix}", thesis_stage,
+        inputs=summary_stages + [f"comparative{suffix}"],
+        params={"theme": theme},
+        code=[thesis_stage, generate_thesis]
+    ))
+    pipeline.add(Stage(
+        f"report{suffix}", report_stage,
+        inputs=summary_stages + [f"comparative{suffix}", f"thesis{suffix}"],
+        params={"theme": theme, "output_path": output_path},
+        code=[report_stage, report_generation, report_stream]
+    ))
+    pipeline.add(Stage(
+        f"citations{suffix}", citations_stage,
+        inputs=[f"ingest:{name}" for name, _, _ in books] + [f"report{suffix}"],
+        params={"names": [name for name, _, _ in books]},
+        code=[citations_stage, citations, corpus_store.MappedCorpus]
+    ))
+    pipeline.add(Stage(
+        f"export{suffix}", export_stage,
+        inputs=[f"report{suffix}", f"citations{suffix}"],
+        params={"output_path": output_path, "strict_citations": strict_citations},
+        cache=False
+    ))
+
+def print_plan(plan):
+    """Prints the result of Pipeline.explain as a table."""
+    width = max(len(name) for name, _, _ in plan)
+    for name, action, reasons in plan:
+        print(f"{name:<{width}}  {action:<8} {'; '.join(reasons)}")
+
+def plan_run(books=BOOKS, max_workers=4, retrieval_budget=None, use_batch=False,
+             dedup_threshold=dedup.SIMILARITY_THRESHOLD, chunk_tokens=text_processing.CHUNK_TOKENS,
+             chunk_overlap=text_processing.CHUNK_OVERLAP_TOKENS, themes=None):
+    """
+    Dry run for --plan: predicts the model calls, tokens, cost and time of a run without making any call.
+
+    The books are ingested into the corpus store (so the real run starts from there), chunked and
+    deduplicated exactly as the summarize stages would do it. Every request of the run is then
+    built and looked up in the response cache (see planner.plan_requests), and the time of the
+    requests to send is estimated from the scheduler's limits (OPENAI_RPM, OPENAI_TPM,
+    OPENAI_MAX_CONCURRENCY) and the number of stages running at once.
+
+    Parameters:
+      - books, max_workers, retrieval_budget, use_batch, dedup_threshold, chunk_tokens, chunk_overlap, themes:
+        As for build_pipeline.
+
+    Returns:
+      - dict: The totals of planner.print_estimate plus the estimated seconds.
+    """
+    themes = list(dict.fromkeys(themes or [DEFAULT_THEME]))
+    store = CorpusStore()
+    corpora = store.ingest_books([(file_path, file_type) for _, file_path, file_type in books])
+    try:
+        # corpus_chunks announces the chunks it is about to summarize; nothing is summarized here.
+        with contextlib.redirect_stdout(io.StringIO()):
+            books_chunks = [list(corpus_chunks(corpus, retrieval_budget, chunk_tokens, chunk_overlap, themes))
+                            for corpus in corpora]
+    finally:
+        for corpus in corpora:
+            corpus.close()
+    for (name, _, _), chunks in zip(books, books_chunks):
+        print(f"{name}: {len(chunks)} chunks, ~{sum(text_processing.count_tokens(chunk) for chunk in chunks):,} tokens")
+    if dedup_threshold is not None:
+        plans, stats = dedup_plans(books_chunks, dedup_threshold)
+        books_chunks = [list(apply_plan(chunks, plan)) for chunks, plan in zip(books_chunks, plans)]
+        print(f"Near-duplicate chunks: {stats['within_book']} dropped, {stats['across_books']} reused across books.")
+
+    scheduler = get_scheduler()
+    map_concurrency = min(max_workers, len(books)) * summarization.MAX_CONCURRENT_REQUESTS
+    plan = planner.plan_requests(books_chunks, get_cache(), map_concurrency, themes=themes)
+    batch_phases = [row["phase"] for row in plan.phases if row["phase"] == "map" or row["phase"].startswith("reduce")] if use_batch else []
+    seconds = planner.estimate_seconds(plan, scheduler.requests.capacity, scheduler.tokens.capacity,
+                                       scheduler.concurrency.maximum, skip_phases=batch_phases)
+    print()
+    totals = planner.print_estimate(plan, seconds, batch_phases)
+    print(f"\nChunks of {chunk_tokens} tokens (overlap {chunk_overlap}); limits: {scheduler.requests.capacity:.0f} RPM, "
+          f"{scheduler.tokens.capacity:.0f} TPM, {scheduler.concurrency.maximum} requests in flight.")
+    print(f"Estimated: {totals['sent']} requests to send, up to ${totals['cost']:.4f} "
+          f"(completions counted at their limit), ~{seconds['total'] / 60:.1f} minutes of model calls"
+          + (" after the batch completes (within its 24h window)." if use_batch else "."))
+    return dict(totals, seconds=seconds["total"])
+
+def main(argv=None):
+    """
+    Main function to execute the entire workflow:
+      1. Ingest the three novels into the corpus store (in parallel).
+      2. Summarize each book (in parallel), summarizing near-duplicate chunks only once.
+      3. Analyze the summaries comparatively.
+      4. Generate a thesis statement based on the summaries and comparative analysis.
+      5. Generate a complete book report (with citations) using the thesis, summaries, and analysis.
+         With several --theme options, one report per theme, sharing the ingestion, dedup and chunk digests.
+      6. Verify every quotation of the report against the books, flagging those not found.
+      7. Export the final report as a DOCX file.
+
+    The workflow runs as a pipeline of stages (see build_pipeline). Stage outputs are stored
+    under a hash of their inputs, so a re-run only recomputes the stages whose inputs changed.
+    With --explain, the stages that would be rebuilt are listed, with the reason, and nothing runs.
+    With --plan, the calls, tokens, cost and time of the run are estimated and no model call is made (see plan_run).
+    With --profile (or --trace-json / --trace-chrome), every stage, book, page or item, tokenizer
+    window, chunk and LLM call is recorded as a span (see profiling.py) and summarized at the end.
+
+    Every run gets a run directory (see checkpoint.Run) recording its options and a journal of
+    the stages it completed. `--resume <run-id>` runs it again with the same options after a
+    crash or Ctrl-C: finished stages, extracted pages and model responses are reloaded from
+    their stores, so only the unfinished work is done.
+    """
+    parser = argparse.ArgumentParser(description="Generate comparative book reports on social isolation (or the given themes).")
+    parser.add_argument("--explain", action="store_true", help="List the stages that would be rebuilt and why, then exit.")
+    parser.add_argument("--plan", action="store_true",
+                        help="Ingest and chunk the books, then estimate the calls, tokens, cost and time of the run without calling the model.")
+    parser.add_argument("--jobs", type=int, default=4, help="Maximum number of stages running at once.")
+    parser.add_argument("--retrieval-budget", type=int, default=None,
+                        help="Only summarize the passages most relevant to the theme, up to this many tokens per book.")
+    parser.add_argument("--strict-citations", action="store_true",
+                        help="Do not export the report if a quotation is not found in the books.")
+    parser.add_argument("--profile", action="store_true", help="Print a per-category timing and resource summary at the end.")
+    parser.add_argument("--trace-json", metavar="PATH", help="Write the recorded spans to PATH as JSON.")
+    parser.add_argument("--trace-chrome", metavar="PATH", help="Write the recorded spans to PATH in Chrome trace-event format.")
+    parser.add_argument("--book", dest="books", action="append", type=parse_book, metavar="NAME=PATH",
+                        help="A book to include, in report order (repeatable; defaults to the three novels in Readings).")
+    parser.add_argument("--output", default=OUTPUT_PATH, help="Where the DOCX report is written.")
+    parser.add_argument("--batch", action="store_true",
+                        help="Send the summarization requests through the OpenAI Batch API (resumable; for large jobs).")
+    parser.add_argument("--batch-poll-seconds", type=float, default=batch.DEFAULT_POLL_SECONDS,
+                        help="Seconds between two status checks of a running batch.")
+    parser.add_argument("--dedup-threshold", type=float, default=dedup.SIMILARITY_THRESHOLD,
+                        help="Estimated similarity above which chunks count as near-duplicates and are summarized once.")
+    parser.add_argument("--no-dedup", action="store_true", help="Summarize near-duplicate chunks separately.")
+    parser.add_argument("--chunk-tokens", type=int, default=text_processing.CHUNK_TOKENS,
+                        help="Token budget of each summarized chunk.")
+    parser.add_argument("--chunk-overlap", type=int, default=text_processing.CHUNK_OVERLAP_TOKENS,
+                        help="Tokens of trailing sentences repeated at the start of the next chunk.")
+    parser.add_argument("--theme", dest="themes", action="append", metavar="THEME",
+                        help="A theme to report on (repeatable, one report per theme; defaults to social isolation).")
+    parser.add_argument("--resume", metavar="RUN_ID",
+                        help="Continue an interrupted run with its original options, reusing all finished work.")
+    argv = list(sys.argv[1:] if argv is None else argv)
+    args = parser.parse_args(argv)
+    run = None
+    if args.resume:
+        if [arg for arg in argv if arg != args.resume and arg.split("=")[0] != "--resume"]:
+            parser.error("--resume reuses the options of the original run and takes no other option.")
+        try:
+            run = Run.load(args.resume)
+        except ValueError as e:
+            parser.error(str(e))
+        args = parser.parse_args(run.info["argv"])
+        completed = run.completed_stages()
+        print(f"Resuming run {run.id} ({run.info['status']}, {len(set(completed))} stages completed): "
+              f"{' '.join(run.info['argv']) or '(default options)'}")
+    if args.batch and args.themes and len(set(args.themes)) > 1:
+        parser.error("--batch only supports a single --theme.")
+
+    if args.profile or args.trace_json or args.trace_chrome:
+        profiling.enable()
+
+    if args.plan:
+        plan_run(args.books or BOOKS, args.jobs, args.retrieval_budget, args.batch,
+                 None if args.no_dedup else args.dedup_threshold, args.chunk_tokens, args.chunk_overlap, args.themes)
+        return
+
+    pipeline = build_pipeline(args.books or BOOKS, args.output, max_workers=args.jobs,
+                              retrieval_budget=args.retrieval_budget, strict_citations=args.strict_citations,
+                              use_batch=args.batch, batch_poll_seconds=args.batch_poll_seconds,
+                              dedup_threshold=None if args.no_dedup else args.dedup_threshold,
+                              chunk_tokens=args.chunk_tokens, chunk_overlap=args.chunk_overlap, themes=args.themes)
+    if args.explain:
+        print_plan(pipeline.explain())
+        return
+
+    if run is None:
+        run = Run.create(argv)
+        print(f"Run {run.id} (after an interruption, continue it with: python main.py --resume {run.id})")
+    pipeline.on_stage = run.stage_completed
+    with run:
+        outputs = pipeline.run()
+    for name in outputs:
+        if name.split(":")[0] == "export":
+            print(f"Book report generated and saved as {outputs[name]}")
+
+    # Report how many model calls were answered from the response cache.
+    stats = get_cache().stats()
+    print(f"LLM cache: {stats['hits']} hits, {stats['misses']} misses, {stats['entries']} entries stored.")
+    scheduler = get_scheduler().summary()
+    print(f"OpenAI requests: {scheduler['requests']} sent, {scheduler['throttled']} throttled, "
+          f"{scheduler['retries']} retried, {scheduler['failures']} failed.")
+
+    if args.profile:
+        profiling.print_summary()
+    if args.trace_json:
+        print(f"Trace written to {profiling.export_json(args.trace_json)}")
+    if args.trace_chrome:
+        print(f"Chrome trace written to {profiling.export_chrome_trace(args.trace_chrome)}")
+    return outputs
 
 if __name__ == "__main__":
     main()
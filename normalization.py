@@ -0,0 +1,272 @@
+import re
+from collections import deque
+from text_processing import WHITESPACE_PATTERN, estimate_tokens
+
+# Book types whose units are pages, which carry running headers and footers.
+PAGED_TYPES = ("pdf",)
+
+# Pages looked at on each side of a page when deciding whether one of its lines is a running header or footer.
+REPEAT_WINDOW = 8
+
+# A header or footer line must appear at the top or bottom of at least this many pages of the window.
+MIN_REPEATS = 3
+
+# Non-blank lines at the top and at the bottom of a page that can be headers or footers.
+EDGE_LINES = 2
+
+# Longer lines are never taken for headers or footers.
+MAX_EDGE_LINE_CHARS = 100
+
+# Units with more text than this (after line removal) are never taken for front/back matter or navigation.
+MATTER_MAX_CHARS = 3000
+
+# Lines holding nothing but a page number ('12', '- 12 -', 'Page 12 of 300') or a roman numeral.
+ARABIC_NUMBERING_PATTERN = re.compile(r"^[\s\-–—\[\(]*(?:page\s+|p\.\s*)?\d{1,4}(?:\s*(?:/|of)\s*\d{1,4})?[\s\-–—\]\)\.]*$", re.IGNORECASE)
+ROMAN_NUMBERING_PATTERN = re.compile(r"^\s*(?=[ivxlcdm])m*(?:c[md]|d?c{0,3})(?:x[cl]|l?x{0,3})(?:i[xv]|v?i{0,3})\s*$")
+
+# Words typical of title pages, copyright and license notices, acknowledgements and publisher pages.
+MATTER_PATTERN = re.compile(
+    r"\b(?:copyright|all rights reserved|isbn|public domain|licen[cs]ed?|e-?books?|published by|first published|"
+    r"translated (?:from|by)|acknowledge?ments?|about the (?:author|book)|also by|glossary|accessibility|"
+    r"download(?:ed)?|thanks for reading)\b",
+    re.IGNORECASE,
+)
+
+# Distinct MATTER_PATTERN phrases a unit must hold to be taken for front/back matter; a single
+# mention ('the ebook', 'licensed') also turns up in the text of a book.
+MATTER_MIN_KEYWORDS = 2
+
+# Headings of tables of contents (compared with spaces removed, as PDF extraction sometimes splits words).
+CONTENTS_HEADINGS = ("contents", "tableofcontents")
+
+# Archive names of EPUB navigation documents.
+NAVIGATION_NAME_PATTERN = re.compile(r"(?:^|/)(?:nav|toc)\.x?html?$", re.IGNORECASE)
+
+# Line ending a book's text; anything after it in the last unit is publisher matter.
+END_PATTERN = re.compile(r"^\W*(?:the end|finis)\W*$", re.IGNORECASE)
+
+# A word broken at the end of a line ('recog-'), and the lowercase continuation at the start of the next line.
+HYPHEN_END_PATTERN = re.compile(r"([^\W\d_]+)-$")
+CONTINUATION_PATTERN = re.compile(r"^([a-z][^\W\d_]*)")
+
+# Words of the book, used to decide whether a broken word is joined with or without its hyphen.
+WORD_PATTERN = re.compile(r"[^\W\d_]+")
+
+# Digits are replaced by this in header/footer keys, so 'Chapter 3 · 41' and 'Chapter 3 · 42' match.
+DIGITS_PATTERN = re.compile(r"\d+")
+
+def _collapsed_length(text):
+    """Length of a text once its whitespace is collapsed, i.e. what it adds to the cleaned book."""
+    return len(WHITESPACE_PATTERN.sub(" ", text).strip())
+
+def _line_key(line):
+    return DIGITS_PATTERN.sub("#", WHITESPACE_PATTERN.sub(" ", line).strip().lower())
+
+def is_numbering_line(line):
+    """True for a line that holds only a page number or a roman numeral."""
+    stripped = line.strip()
+    if not stripped:
+        return False
+    if ARABIC_NUMBERING_PATTERN.match(stripped):
+        return True
+    # Roman numerals are written in one case ('IV' or 'iv', not 'Iv').
+    return bool(ROMAN_NUMBERING_PATTERN.match(stripped.lower())) and (stripped.isupper() or stripped.islower())
+
+def is_navigation(lines):
+    """
+    True for a table of contents: a unit headed 'Contents' / 'Table of Contents', or made of at
+    least three lines that are nearly all short headings ('Part One', 'Chapter 2', 'IV').
+    """
+    content = [line.strip() for line in lines if line.strip()]
+    if not content:
+        return False
+    if content[0].replace(" ", "").lower() in CONTENTS_HEADINGS:
+        return True
+    short = sum(len(line.split()) <= 4 for line in content)
+    return len(content) >= 3 and short >= 0.8 * len(content)
+
+def new_stats():
+    """Returns an empty statistics dict for normalize_units."""
+    return {
+        "units": 0,
+        "units_removed": 0,
+        "matter_units": 0,
+        "numbering_lines": 0,
+        "repeated_lines": 0,
+        "hyphenations": 0,
+        "chars_in": 0,
+        "chars_out": 0,
+    }
+
+def removed_summary(stats):
+    """
+    Describes what normalization removed from a book, for the ingestion log.
+
+    Returns:
+      - str: Removed characters (in the cleaned text) and estimated tokens, with a breakdown.
+    """
+    removed = stats["chars_in"] - stats["chars_out"]
+    share = 100 * removed / stats["chars_in"] if stats["chars_in"] else 0
+    return (f"removed {removed:,} chars (~{estimate_tokens(' ' * removed):,} tokens, {share:.1f}%): "
+            f"{stats['matter_units']} front/back matter or navigation units, "
+            f"{stats['repeated_lines']} running header/footer lines, {stats['numbering_lines']} numbering lines; "
+            f"{stats['hyphenations']} line-break hyphenations joined")
+
+def normalize_units(units, file_type, stats=None):
+    """
+    Removes text that costs model tokens without carrying any of the book, in one streaming pass.
+
+    Parameters:
+      - units (iterable): (location, text) tuples, as yielded by ingestion.iter_book_units.
+      - file_type (str): The type of the book ('xml', 'pdf', or 'epub').
+      - stats (dict): Optional dict from new_stats(), updated with what was removed.
+
+    Yields:
+      - (location, text) tuples for the units that remain, in order.
+
+    Every line of a unit is looked at once, and in that pass:
+      - Lines holding only a page number or a roman numeral are dropped.
+      - On pages, lines at the top or bottom that (digits aside) also appear at the top or bottom of
+        MIN_REPEATS pages within REPEAT_WINDOW pages are running headers or footers and are dropped.
+      - A word broken with a hyphen at the end of a line (also across pages) is joined. On pages,
+        the hyphen is removed when the joined word occurs unbroken on a page read so far, i.e.
+        up to REPEAT_WINDOW pages ahead ('recog-nized'), and kept otherwise ('half-past'), so a
+        word first written whole later in the book keeps its hyphen; in other books it is always kept.
+    Then, units left short (MATTER_MAX_CHARS) that look like a title, copyright, license or
+    publisher page (at least MATTER_MIN_KEYWORDS distinct matter phrases) or like a table of
+    contents are dropped, but only in the leading and trailing runs of such units, for every
+    type of book: a unit between two units of text is part of the book (a short chapter, a poem,
+    an element of dialogue). In the last unit, anything after a 'THE END' line is dropped too.
+
+    Pages are held back REPEAT_WINDOW pages (to see the pages after them), so memory stays bounded.
+    """
+    stats = stats if stats is not None else new_stats()
+    paged = file_type in PAGED_TYPES
+    window = REPEAT_WINDOW if paged else 0
+    vocabulary = set()
+    ahead = deque()
+    behind = deque(maxlen=window)
+    state = {"body_seen": False, "pending": [], "held": None}
+
+    def entry(location, text):
+        text = text.replace("\u00ad", "")
+        lines = text.split("\n")
+        content = [i for i, line in enumerate(lines) if line.strip()]
+        edges = {}
+        if paged:
+            # Only typeset pages break words to fit the line; elsewhere a hyphen at a line end is kept.
+            vocabulary.update(WORD_PATTERN.findall(text.lower()))
+            for i in content[:EDGE_LINES] + content[-EDGE_LINES:]:
+                if len(lines[i].strip()) <= MAX_EDGE_LINE_CHARS:
+                    edges[i] = _line_key(lines[i])
+        return {"location": location, "lines": lines, "edges": edges, "edge_keys": set(edges.values())}
+
+    def join_broken(previous, line):
+        """Returns previous + line if previous ends with a broken word continued by line, else None."""
+        head = HYPHEN_END_PATTERN.search(previous.rstrip())
+        tail = CONTINUATION_PATTERN.match(line.lstrip())
+        if head is None or tail is None:
+            return None
+        stats["hyphenations"] += 1
+        previous = previous.rstrip()
+        if (head.group(1) + tail.group(1)).lower() in vocabulary:
+            previous = previous[:-1]
+        return previous + line.lstrip()
+
+    def filter_lines(current, context):
+        kept = []
+        for i, line in enumerate(current["lines"]):
+            if not line.strip():
+                kept.append(line)
+                continue
+            if is_numbering_line(line):
+                stats["numbering_lines"] += 1
+                continue
+            key = current["edges"].get(i)
+            if key is not None and 1 + sum(key in other["edge_keys"] for other in context) >= MIN_REPEATS:
+                stats["repeated_lines"] += 1
+                continue
+            joined = join_broken(kept[-1], line) if kept and kept[-1].strip() else None
+            if joined is not None:
+                kept[-1] = joined
+            else:
+                kept.append(line)
+        return kept
+
+    def is_matter(location, lines):
+        text = "\n".join(lines)
+        if _collapsed_length(text) > MATTER_MAX_CHARS:
+            return False
+        if NAVIGATION_NAME_PATTERN.search(location) or is_navigation(lines):
+            return True
+        keywords = {match.lower() for match in MATTER_PATTERN.findall(text)}
+        return len(keywords) >= MATTER_MIN_KEYWORDS
+
+    def drop():
+        stats["units_removed"] += 1
+        stats["matter_units"] += 1
+
+    def finalize(current, context):
+        """Filters a unit's lines and decides whether it stays; yields the units now ready to be emitted."""
+        lines = filter_lines(current, context)
+        location = current["location"]
+        if not "".join(lines).strip():
+            stats["units_removed"] += 1
+            return
+        if is_matter(location, lines):
+            if not state["body_seen"]:
+                drop()
+            else:
+                # Possibly back matter: kept only if more of the book follows.
+                state["pending"].append((location, lines))
+            return
+        state["body_seen"] = True
+        for pending in state["pending"]:
+            yield from hold(*pending)
+        state["pending"] = []
+        yield from hold(location, lines)
+
+    def hold(location, lines):
+        """Keeps one unit back, so a word broken across two pages can be joined."""
+        held = state["held"]
+        if held is not None and paged:
+            held_lines = held[1]
+            last = max((i for i, line in enumerate(held_lines) if line.strip()), default=None)
+            first = next((i for i, line in enumerate(lines) if line.strip()), None)
+            if last is not None and first is not None:
+                head, separator, rest = lines[first].lstrip().partition(" ")
+                joined = join_broken(held_lines[last], head)
+                if joined is not None:
+                    held_lines[last] = joined
+                    lines = lines[:first] + [rest] + lines[first + 1:] if separator else lines[:first] + lines[first + 1:]
+        if held is not None:
+            yield emit(*held)
+        state["held"] = (location, lines)
+
+    def emit(location, lines):
+        text = "\n".join(lines)
+        stats["chars_out"] += _collapsed_length(text)
+        return location, text
+
+    for location, text in units:
+        stats["units"] += 1
+        stats["chars_in"] += _collapsed_length(text)
+        ahead.append(entry(location, text))
+        if len(ahead) > window:
+            current = ahead.popleft()
+            yield from finalize(current, list(behind) + list(ahead))
+            behind.append(current)
+    while ahead:
+        current = ahead.popleft()
+        yield from finalize(current, list(behind) + list(ahead))
+        behind.append(current)
+    for _ in state["pending"]:
+        drop()
+    if state["held"] is not None:
+        location, lines = state["held"]
+        for i, line in enumerate(lines):
+            if END_PATTERN.match(line) and _collapsed_length("\n".join(lines[i + 1:])) <= MATTER_MAX_CHARS:
+                lines = lines[:i]
+                break
+        if "".join(lines).strip():
+            yield emit(location, lines)
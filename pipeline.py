@@ -0,0 +1,297 @@
+import os
+import json
+import inspect
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import profiling
+from corpus_store import file_digest
+from checkpoint import atomic_write_json, file_lock
+
+# Default location of stored stage outputs, relative to the project root.
+DEFAULT_CACHE_DIR = ".pipeline_cache"
+
+# File that records the inputs of the last successful run of a stage.
+MANIFEST_FILE = "manifest.json"
+
+# Lock file serializing the writes of a stage's output and manifest across processes.
+LOCK_FILE = ".lock"
+
+# Serializes code_version across the stage threads.
+_source_lock = threading.Lock()
+
+def _digest(value):
+    """Returns the SHA-256 digest of a JSON-serializable value."""
+    payload = json.dumps(value, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def code_version(objects):
+    """
+    Hashes the source code of the given functions, classes or modules.
+
+    Parameters:
+      - objects: Anything accepted by inspect.getsource.
+
+    Returns:
+      - str: A digest that changes whenever any of the sources change.
+    """
+    digest = hashlib.sha256()
+    # inspect.getsource parses files with ast, which is not safe to run from several threads at once.
+    with _source_lock:
+        for obj in objects:
+            digest.update(inspect.getsource(obj).encode("utf-8"))
+    return digest.hexdigest()
+
+class Stage:
+    """
+    One step of the pipeline.
+
+    Parameters:
+      - name (str): Unique name of the stage.
+      - func (callable): Called with the outputs of `inputs` (positionally, in order) and `params` (as keywords).
+        Its return value must be JSON-serializable so it can be stored.
+      - inputs (list): Names of the stages this stage depends on.
+      - params (dict): JSON-serializable keyword arguments; changing them triggers a rebuild.
+      - files (list): Source files whose contents are part of the stage's inputs.
+      - code (list): Functions or modules whose source is the stage's code version (defaults to func).
+      - cache (bool): If False the stage runs on every execution (e.g. exporting a file).
+      - validate (callable): Optional check of a stored output, validate(output) -> bool. An output
+        that fails it (e.g. a key into a store whose entry was deleted) is rebuilt.
+    """
+
+    def __init__(self, name, func, inputs=(), params=None, files=(), code=None, cache=True, validate=None):
+        self.name = name
+        self.func = func
+        self.inputs = list(inputs)
+        self.params = dict(params or {})
+        self.files = list(files)
+        self.code = list(code) if code is not None else [func]
+        self.cache = cache
+        self.validate = validate
+
+    def signature(self, input_digests):
+        """
+        Describes everything the stage's output depends on.
+
+        Parameters:
+          - input_digests (dict): Digest of the output of each upstream stage.
+
+        Returns:
+          - dict: code, params, file and input digests; its own digest is the stage's key.
+        """
+        return {
+            "code": code_version(self.code),
+            "params": _digest(self.params),
+            "files": {path: file_digest(path) for path in self.files},
+            "inputs": {name: input_digests[name] for name in self.inputs},
+        }
+
+class Pipeline:
+    """
+    Runs a DAG of stages, Make-style.
+
+    Every stage's output is stored under a key derived from its code version, parameters,
+    source files and the outputs of its upstream stages. On a re-run, a stage whose key is
+    already stored is loaded instead of executed, so only stages whose inputs changed are
+    recomputed. Stages whose inputs are ready run in parallel in a thread pool.
+
+    Outputs are written atomically and flushed to disk as soon as each stage finishes, so a run
+    that dies keeps every finished stage. If on_stage is set, on_stage(name, key, cached) is
+    called after each stage (e.g. checkpoint.Run.stage_completed); key is None for uncached stages.
+    """
+
+    def __init__(self, stages=(), cache_dir=DEFAULT_CACHE_DIR, max_workers=4, on_stage=None):
+        self.stages = {}
+        self.cache_dir = cache_dir
+        self.max_workers = max_workers
+        self.on_stage = on_stage
+        for stage in stages:
+            self.add(stage)
+
+    def add(self, stage):
+        if stage.name in self.stages:
+            raise ValueError(f"Duplicate stage name: {stage.name}")
+        self.stages[stage.name] = stage
+        return stage
+
+    def order(self):
+        """
+        Returns the stage names in a topological order (dependencies first).
+        """
+        ordered = []
+        state = {}
+
+        def visit(name, path):
+            if name not in self.stages:
+                raise ValueError(f"Unknown stage {name!r} required by {path[-1]!r}")
+            if state.get(name) == "done":
+                return
+            if state.get(name) == "visiting":
+                raise ValueError("Cycle in pipeline: " + " -> ".join(path + [name]))
+            state[name] = "visiting"
+            for dependency in self.stages[name].inputs:
+                visit(dependency, path + [name])
+            state[name] = "done"
+            ordered.append(name)
+
+        for name in self.stages:
+            visit(name, [])
+        return ordered
+
+    def _stage_dir(self, name):
+        return os.path.join(self.cache_dir, name)
+
+    def _output_path(self, name, key):
+        return os.path.join(self._stage_dir(name), f"{key}.json")
+
+    def _load(self, name, key):
+        """Returns the stored output of a stage, or raises KeyError if there is none or it fails the stage's validate."""
+        path = self._output_path(name, key)
+        if not os.path.exists(path):
+            raise KeyError(key)
+        with open(path, "r", encoding="utf-8") as f:
+            output = json.load(f)["output"]
+        validate = self.stages[name].validate
+        if validate is not None and not validate(output):
+            raise KeyError(key)
+        return output
+
+    def _save(self, name, key, signature, output):
+        """
+        Stores a stage output and then its manifest, each atomically and durably (see
+        checkpoint.atomic_write_json). A lock on the stage directory keeps processes running
+        the same stage from interleaving their output and manifest.
+        """
+        directory = self._stage_dir(name)
+        os.makedirs(directory, exist_ok=True)
+        with file_lock(os.path.join(directory, LOCK_FILE)):
+            atomic_write_json(self._output_path(name, key), {"output": output})
+            atomic_write_json(os.path.join(directory, MANIFEST_FILE), {"key": key, "signature": signature})
+
+    def _previous_signature(self, name):
+        path = os.path.join(self._stage_dir(name), MANIFEST_FILE)
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)["signature"]
+
+    def explain(self):
+        """
+        Works out which stages a run would rebuild, without executing anything.
+
+        Returns:
+          - list of (name, action, reasons) in topological order, where action is
+            'cached', 'rebuild' or 'always', and reasons is a list of strings.
+        """
+        plan = []
+        output_digests = {}
+        rebuilt = set()
+        for name in self.order():
+            stage = self.stages[name]
+            stale_inputs = [dependency for dependency in stage.inputs if dependency in rebuilt]
+            if not stage.cache:
+                plan.append((name, "always", ["stage is not cached"]))
+                rebuilt.add(name)
+                continue
+            if stale_inputs:
+                # An upstream stage will be recomputed, so its new output is unknown yet.
+                plan.append((name, "rebuild", [f"upstream stage {d!r} will be rebuilt" for d in stale_inputs]))
+                rebuilt.add(name)
+                continue
+            signature = stage.signature(output_digests)
+            key = _digest(signature)
+            try:
+                output_digests[name] = _digest(self._load(name, key))
+                plan.append((name, "cached", []))
+            except KeyError:
+                plan.append((name, "rebuild", self._reasons(name, signature)))
+                rebuilt.add(name)
+        return plan
+
+    def _reasons(self, name, signature):
+        """Compares a stage's signature with the one recorded by its last run."""
+        previous = self._previous_signature(name)
+        if previous is None:
+            return ["no stored output"]
+        reasons = []
+        if previous["code"] != signature["code"]:
+            reasons.append("code changed")
+        if previous["params"] != signature["params"]:
+            reasons.append("parameters changed")
+        for path, digest in signature["files"].items():
+            if previous["files"].get(path) != digest:
+                reasons.append(f"file changed: {path}")
+        for dependency, digest in signature["inputs"].items():
+            if previous["inputs"].get(dependency) != digest:
+                reasons.append(f"output of {dependency!r} changed")
+        return reasons or ["stored output missing or no longer valid"]
+
+    def _execute(self, name, inputs, output_digests):
+        """Loads a stage's output from the store, or runs the stage and stores its output."""
+        with profiling.span(name, "stage") as stage_span:
+            output, cached, key = self._execute_stage(name, inputs, output_digests)
+            stage_span.set(cached=cached)
+        if self.on_stage is not None:
+            self.on_stage(name, key, cached)
+        return output
+
+    def _execute_stage(self, name, inputs, output_digests):
+        """Returns (output, cached, key) for _execute."""
+        stage = self.stages[name]
+        if not stage.cache:
+            print(f"[pipeline] Running {name}...")
+            return stage.func(*inputs, **stage.params), False, None
+        signature = stage.signature(output_digests)
+        key = _digest(signature)
+        try:
+            output = self._load(name, key)
+            print(f"[pipeline] {name} is up to date.")
+            return output, True, key
+        except KeyError:
+            pass
+        print(f"[pipeline] Running {name} ({', '.join(self._reasons(name, signature))})...")
+        output = stage.func(*inputs, **stage.params)
+        self._save(name, key, signature, output)
+        return output, False, key
+
+    def run(self, targets=None):
+        """
+        Executes the pipeline, running independent stages in parallel.
+
+        Parameters:
+          - targets (list): Stage names to produce (defaults to every stage).
+
+        Returns:
+          - dict: The output of every stage that was needed, by stage name.
+        """
+        order = self.order()
+        needed = set(order)
+        if targets is not None:
+            needed = set()
+            pending = list(targets)
+            while pending:
+                name = pending.pop()
+                if name not in needed:
+                    needed.add(name)
+                    pending.extend(self.stages[name].inputs)
+        remaining = [name for name in order if name in needed]
+
+        outputs = {}
+        output_digests = {}
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while remaining or running:
+                # Start every stage whose inputs are all available.
+                for name in list(remaining):
+                    stage = self.stages[name]
+                    if all(dependency in outputs for dependency in stage.inputs):
+                        remaining.remove(name)
+                        inputs = [outputs[dependency] for dependency in stage.inputs]
+                        digests = {dependency: output_digests[dependency] for dependency in stage.inputs}
+                        running[executor.submit(self._execute, name, inputs, digests)] = name
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    outputs[name] = future.result()
+                    output_digests[name] = _digest(outputs[name])
+        return outputs
@@ -0,0 +1,232 @@
+from collections import namedtuple
+import summarization
+import report_generation
+from llm_cache import make_key
+from llm_client import DEFAULT_MODEL
+from text_processing import count_tokens
+from retrieval import DEFAULT_THEME
+
+# Price of the model in dollars per million tokens (gpt-4o-mini: prompt and completion).
+INPUT_PRICE_PER_MILLION = 0.15
+OUTPUT_PRICE_PER_MILLION = 0.60
+
+# The Batch API bills requests at this fraction of the interactive price.
+BATCH_PRICE_FACTOR = 0.5
+
+# Latency of one request: a fixed overhead plus its completion generated at this rate.
+REQUEST_OVERHEAD_SECONDS = 0.5
+OUTPUT_TOKENS_PER_SECOND = 60.0
+
+# Tokens framing each chat message, on top of its content.
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# Sampling temperature of every pipeline request (part of the cache key).
+TEMPERATURE = 0.7
+
+# The output of a planned request the cache does not answer: only its size is known, taken to be
+# the request's completion limit.
+Pending = namedtuple("Pending", ["tokens"])
+
+def prompt_tokens(messages):
+    """Counts the prompt tokens of a request with the local tokenizer (see text_processing.count_tokens)."""
+    return sum(count_tokens(message["content"]) + MESSAGE_OVERHEAD_TOKENS for message in messages)
+
+class RunPlan:
+    """
+    The model calls a run would make, grouped in phases that run one after the other, and
+    which of them the response cache would answer.
+
+    Requests are planned in the order the pipeline makes them. A request whose inputs are all
+    known (the book's chunks, or outputs found in the cache) is looked up in the cache by its
+    exact key; its output is then known as well, so a fully cached run is planned exactly.
+    A request depending on the output of a call that will be sent cannot be looked up: it is
+    counted as sent, with the unknown inputs at their completion limit.
+    """
+
+    def __init__(self, cache, model=DEFAULT_MODEL):
+        self.cache = cache
+        self.model = model
+        self.phases = []
+        self._rows = {}
+        self._keys = set()
+
+    def phase(self, name, concurrency, max_tokens):
+        """Declares a phase: its requests run concurrently (up to `concurrency`) after the previous phase."""
+        if name not in self._rows:
+            row = {"phase": name, "concurrency": concurrency, "max_tokens": max_tokens, "calls": 0, "cached": 0,
+                   "shared": 0, "sent": 0, "prompt_tokens": 0, "completion_tokens": 0}
+            self._rows[name] = row
+            self.phases.append(row)
+        return self._rows[name]
+
+    def call(self, phase, build, args, max_tokens):
+        """
+        Plans one request of a declared phase.
+
+        Parameters:
+          - phase (str): The phase name.
+          - build (callable): Builds the request's messages from args.
+          - args (tuple): Arguments of build; Pending values (also inside lists) are outputs not known in advance.
+          - max_tokens (int): The completion limit of the request.
+
+        Returns:
+          - The cached response, or Pending(max_tokens) if the request will be sent.
+        """
+        pending = []
+
+        def known(value):
+            if isinstance(value, Pending):
+                pending.append(value.tokens)
+                return ""
+            if isinstance(value, list):
+                return [known(item) for item in value]
+            return value
+
+        messages = build(*[known(arg) for arg in args])
+        row = self._rows[phase]
+        row["calls"] += 1
+        if not pending:
+            key = make_key(self.model, messages, TEMPERATURE, max_tokens)
+            cached = self.cache.peek(key)
+            if cached is not None:
+                row["cached"] += 1
+                return cached
+            if key in self._keys:
+                # Sent once: identical requests made meanwhile wait for its response (see llm_client).
+                row["shared"] += 1
+                return Pending(max_tokens)
+            self._keys.add(key)
+        row["sent"] += 1
+        row["prompt_tokens"] += prompt_tokens(messages) + sum(pending)
+        row["completion_tokens"] += max_tokens
+        return Pending(max_tokens)
+
+def plan_requests(books_chunks, cache, map_concurrency=summarization.MAX_CONCURRENT_REQUESTS,
+                  report_concurrency=report_generation.REPORT_CONCURRENCY, fanout=summarization.REDUCE_FANOUT,
+                  themes=None):
+    """
+    Plans every model call of a report, without making any.
+
+    Follows main.build_pipeline: the chunk summaries of every book (map), the reduce levels of
+    summarization.summarize_book, analyze_comparative, generate_thesis, then generate_title and
+    the generate_paragraph calls. With several themes, the map step is the theme-neutral
+    'digest' phase, made once, and each theme then plans its own reduce levels (at least one,
+    see summarization.summarize_digests), comparative analysis, thesis and report; the phases
+    of the themes run side by side, so their concurrency adds up.
+
+    Parameters:
+      - books_chunks (list): For each book, the chunks it is summarized from (after dedup).
+      - cache (LLMCache): The response cache consulted (read only).
+      - map_concurrency (int): Summary requests in flight at once, over all books.
+      - report_concurrency (int): Title and paragraph requests in flight at once.
+      - fanout (int): Number of summaries merged at each reduce step.
+      - themes (list): The themes reported on (defaults to social isolation only).
+
+    Returns:
+      - RunPlan: The planned calls by phase.
+    """
+    themes = list(dict.fromkeys(themes or [DEFAULT_THEME]))
+    parallel = len(themes)
+    plan = RunPlan(cache)
+    if parallel == 1:
+        plan.phase("map", map_concurrency, summarization.SUMMARY_MAX_TOKENS)
+        mapped = [[plan.call("map", summarization.summary_messages, (chunk, themes[0]), summarization.SUMMARY_MAX_TOKENS)
+                   for chunk in chunks] for chunks in books_chunks]
+    else:
+        plan.phase("digest", map_concurrency, summarization.DIGEST_MAX_TOKENS)
+        mapped = [[plan.call("digest", summarization.digest_messages, (chunk,), summarization.DIGEST_MAX_TOKENS)
+                   for chunk in chunks] for chunks in books_chunks]
+
+    books_summaries = {}
+    for theme in themes:
+        levels = mapped
+        depth = 1
+        while any(len(level) > 1 or (parallel > 1 and depth == 1 and level) for level in levels):
+            name = f"reduce {depth}"
+            plan.phase(name, map_concurrency * parallel, summarization.COMBINE_MAX_TOKENS)
+            levels = [[plan.call(name, summarization.combine_messages, (group, theme), summarization.COMBINE_MAX_TOKENS)
+                       for group in summarization.reduce_groups(level, fanout)]
+                      if len(level) > 1 or (parallel > 1 and depth == 1 and level) else level
+                      for level in levels]
+            depth += 1
+        books_summaries[theme] = [level[0] if level else "" for level in levels]
+
+    paragraphs = report_generation.paragraph_count(len(books_chunks))
+    plan.phase("comparative", parallel, summarization.COMPARATIVE_MAX_TOKENS)
+    plan.phase("thesis", parallel, report_generation.THESIS_MAX_TOKENS)
+    plan.phase("report", report_concurrency * parallel, report_generation.PARAGRAPH_MAX_TOKENS)
+    for theme, summaries in books_summaries.items():
+        comparative = plan.call("comparative", summarization.comparative_messages, (summaries, theme),
+                                summarization.COMPARATIVE_MAX_TOKENS)
+        thesis = plan.call("thesis", report_generation.thesis_messages, (summaries, comparative, theme),
+                           report_generation.THESIS_MAX_TOKENS)
+        plan.call("report", report_generation.title_messages, (thesis, theme), report_generation.TITLE_MAX_TOKENS)
+        for index in range(1, paragraphs + 1):
+            plan.call("report", report_generation.paragraph_messages, (index, thesis, summaries, comparative, theme),
+                      report_generation.PARAGRAPH_MAX_TOKENS)
+    return plan
+
+def request_seconds(max_tokens):
+    """Expected latency of one request that generates max_tokens tokens."""
+    return REQUEST_OVERHEAD_SECONDS + max_tokens / OUTPUT_TOKENS_PER_SECOND
+
+def estimate_seconds(plan, rpm, tpm, max_concurrency, skip_phases=()):
+    """
+    Estimates the wall-clock time of the requests the plan sends, phase after phase.
+
+    A phase takes as long as its requests need in waves of the phase's concurrency (capped by
+    max_concurrency), or as long as the RPM/TPM token buckets of llm_scheduler need to admit
+    them, whichever is longer. The buckets start full and carry over from phase to phase.
+
+    Parameters:
+      - plan (RunPlan): The planned calls.
+      - rpm, tpm (int): The account's requests and tokens per minute.
+      - max_concurrency (int): The scheduler's maximum number of requests in flight.
+      - skip_phases (iterable): Phases not sent interactively (e.g. through the Batch API).
+
+    Returns:
+      - dict: Seconds by phase name, plus "total".
+    """
+    requests_level, tokens_level = float(rpm), float(tpm)
+    seconds = {}
+    for row in plan.phases:
+        if row["phase"] in skip_phases or not row["sent"]:
+            seconds[row["phase"]] = 0.0
+            continue
+        tokens = row["prompt_tokens"] + row["completion_tokens"]
+        concurrency = max(1, min(row["concurrency"], max_concurrency))
+        waves = -(-row["sent"] // concurrency)
+        limited = max((row["sent"] - requests_level) / (rpm / 60.0), (tokens - tokens_level) / (tpm / 60.0), 0.0)
+        elapsed = max(waves * request_seconds(row["max_tokens"]), limited)
+        requests_level = min(float(rpm), requests_level - row["sent"] + elapsed * rpm / 60.0)
+        tokens_level = min(float(tpm), tokens_level - tokens + elapsed * tpm / 60.0)
+        seconds[row["phase"]] = elapsed
+    seconds["total"] = sum(seconds.values())
+    return seconds
+
+def phase_cost(row, batch=False):
+    """Upper bound of the cost of a phase's sent requests in dollars (completions at their limit)."""
+    cost = (row["prompt_tokens"] * INPUT_PRICE_PER_MILLION + row["completion_tokens"] * OUTPUT_PRICE_PER_MILLION) / 1e6
+    return cost * BATCH_PRICE_FACTOR if batch else cost
+
+def print_estimate(plan, seconds, batch_phases=()):
+    """
+    Prints the plan as a table: calls, cache hits, identical requests sent once, requests sent,
+    prompt and (maximum) completion tokens, cost and estimated seconds per phase, then the totals.
+    """
+    header = f"{'phase':<12} {'calls':>6} {'cached':>7} {'shared':>7} {'sent':>6} {'prompt tok':>11} {'compl. tok':>11} {'cost $':>9} {'seconds':>9}"
+    print(header)
+    print("-" * len(header))
+    totals = {"calls": 0, "cached": 0, "shared": 0, "sent": 0, "prompt_tokens": 0, "completion_tokens": 0, "cost": 0.0}
+    for row in plan.phases:
+        batched = row["phase"] in batch_phases
+        cost = phase_cost(row, batched)
+        timing = "batch" if batched and row["sent"] else f"{seconds[row['phase']]:.1f}"
+        print(f"{row['phase']:<12} {row['calls']:>6} {row['cached']:>7} {row['shared']:>7} {row['sent']:>6} "
+              f"{row['prompt_tokens']:>11,} {row['completion_tokens']:>11,} {cost:>9.4f} {timing:>9}")
+        for field in totals:
+            totals[field] += cost if field == "cost" else row[field]
+    print("-" * len(header))
+    print(f"{'total':<12} {totals['calls']:>6} {totals['cached']:>7} {totals['shared']:>7} {totals['sent']:>6} "
+          f"{totals['prompt_tokens']:>11,} {totals['completion_tokens']:>11,} {totals['cost']:>9.4f} {seconds['total']:>9.1f}")
+    return totals
@@ -0,0 +1,265 @@
+import os
+import json
+import time
+import resource
+import threading
+import contextvars
+from collections import defaultdict
+
+# Span attributes that are summed in the summary table (besides wall and CPU time).
+SUMMED_ATTRIBUTES = ("bytes_read", "chars", "prompt_tokens", "completion_tokens", "cache_hits", "retries")
+
+# The innermost open span of the current thread or asyncio task.
+_current = contextvars.ContextVar("current_span", default=None)
+
+def _read_bytes():
+    """Bytes read by this process so far (Linux /proc/self/io 'rchar'), or None where unavailable."""
+    try:
+        with open("/proc/self/io", "r") as f:
+            for line in f:
+                if line.startswith("rchar:"):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+    return None
+
+def _peak_rss_kb():
+    """Peak resident set size of this process so far, in kilobytes."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+class Span:
+    """
+    One timed region of the run (a stage, a book, a page or item, a tokenizer window, an LLM call...).
+
+    Records wall time, CPU time of the calling thread, bytes read by the process and the peak RSS
+    at its end, plus any attributes set with set() or add(). Bytes read and peak RSS are process-wide
+    figures, so spans running concurrently see each other's reads.
+    """
+
+    def __init__(self, tracer, name, category, attrs):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.attrs = dict(attrs)
+        self.parent = None
+        self.id = None
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def add(self, key, amount=1):
+        self.attrs[key] = self.attrs.get(key, 0) + amount
+
+    def __enter__(self):
+        parent = _current.get()
+        self.parent = parent.id if parent is not None else None
+        self.id = self.tracer.next_id()
+        self._token = _current.set(self)
+        self._read_start = _read_bytes()
+        self._cpu_start = time.thread_time()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        wall = time.perf_counter() - self._start
+        cpu = time.thread_time() - self._cpu_start
+        read_end = _read_bytes()
+        _current.reset(self._token)
+        if self._read_start is not None and read_end is not None:
+            self.attrs.setdefault("bytes_read", read_end - self._read_start)
+        if exc_type is not None:
+            self.attrs["error"] = exc_type.__name__
+        self.tracer.record({
+            "id": self.id,
+            "parent": self.parent,
+            "name": self.name,
+            "category": self.category,
+            "start": self._start - self.tracer.origin,
+            "wall": wall,
+            "cpu": cpu,
+            "peak_rss_kb": _peak_rss_kb(),
+            "pid": os.getpid(),
+            "tid": threading.get_ident(),
+            "attrs": self.attrs,
+        })
+        return False
+
+class _NullSpan:
+    """Stands in for a span while profiling is disabled, so instrumented code costs almost nothing."""
+
+    def set(self, **attrs):
+        pass
+
+    def add(self, key, amount=1):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+NULL_SPAN = _NullSpan()
+
+class Tracer:
+    """Collects the finished spans of a run. Disabled until enable() is called."""
+
+    def __init__(self):
+        self.enabled = False
+        self.origin = time.perf_counter()
+        self.spans = []
+        self._ids = 0
+        self._lock = threading.Lock()
+
+    def next_id(self):
+        with self._lock:
+            self._ids += 1
+            return f"{os.getpid()}-{self._ids}"
+
+    def record(self, span):
+        with self._lock:
+            self.spans.append(span)
+
+_tracer = Tracer()
+
+def enable(origin=None):
+    """
+    Starts recording spans in this process.
+
+    Parameters:
+      - origin (float): time.perf_counter() value span start times are measured from; worker
+        processes pass the parent's origin() so that all spans share one timeline.
+    """
+    _tracer.enabled = True
+    _tracer.origin = time.perf_counter() if origin is None else origin
+
+def enabled():
+    return _tracer.enabled
+
+def origin():
+    return _tracer.origin
+
+def span(name, category="", **attrs):
+    """
+    Returns a context manager timing the enclosed block as a span.
+
+    Parameters:
+      - name (str): What is being timed (e.g. the stage name or the page location).
+      - category (str): The kind of span ('stage', 'book', 'unit', 'tokenize', 'llm', ...).
+      - attrs: Initial attributes; more can be set on the span inside the block.
+
+    Spans opened inside another span (in the same thread or asyncio task) record it as their parent.
+    """
+    if not _tracer.enabled:
+        return NULL_SPAN
+    return Span(_tracer, name, category, attrs)
+
+def current_span():
+    """Returns the innermost open span, or a no-op span when there is none."""
+    return _current.get() or NULL_SPAN
+
+def traced_iter(iterable, category, describe=None):
+    """
+    Yields the items of an iterable, timing the production of each one as a span.
+
+    Parameters:
+      - iterable: The iterable to wrap (e.g. a generator of pages).
+      - category (str): The category of the spans.
+      - describe (callable): Returns (name, attrs) for an item (the name defaults to the item's position).
+    """
+    if not _tracer.enabled:
+        yield from iterable
+        return
+    iterator = iter(iterable)
+    position = 0
+    while True:
+        with span(str(position), category) as item_span:
+            try:
+                item = next(iterator)
+            except StopIteration:
+                item_span.set(end_of_stream=True)
+                return
+            if describe is not None:
+                item_span.name, attrs = describe(item)
+                item_span.set(**attrs)
+        position += 1
+        yield item
+
+def drain():
+    """Returns and forgets the spans recorded in this process (used to ship them out of worker processes)."""
+    with _tracer._lock:
+        spans, _tracer.spans = _tracer.spans, []
+    return spans
+
+def merge(spans):
+    """Adds spans recorded in a worker process to this process's trace."""
+    with _tracer._lock:
+        _tracer.spans.extend(spans)
+
+def spans():
+    """Returns a copy of the recorded spans, in the order they finished."""
+    with _tracer._lock:
+        return list(_tracer.spans)
+
+def export_json(path):
+    """
+    Writes the recorded spans and the summary table to a JSON file.
+
+    Times are in seconds; `start` is relative to the moment profiling was enabled.
+    """
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"spans": spans(), "summary": summary()}, f, indent=2, default=str)
+    return path
+
+def export_chrome_trace(path):
+    """
+    Writes the spans in Chrome trace-event format (complete 'X' events, microseconds), which
+    chrome://tracing and Perfetto can open.
+    """
+    events = []
+    for item in spans():
+        events.append({
+            "name": item["name"],
+            "cat": item["category"],
+            "ph": "X",
+            "ts": item["start"] * 1e6,
+            "dur": item["wall"] * 1e6,
+            "pid": item["pid"],
+            "tid": item["tid"],
+            "args": dict(item["attrs"], cpu_seconds=item["cpu"], peak_rss_kb=item["peak_rss_kb"]),
+        })
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f, default=str)
+    return path
+
+def summary():
+    """
+    Aggregates the spans by category.
+
+    Returns:
+      - list of dict: One row per category with the span count, total wall and CPU time, the
+        highest peak RSS and the totals of SUMMED_ATTRIBUTES, sorted by total wall time.
+    """
+    rows = defaultdict(lambda: dict({"count": 0, "wall": 0.0, "cpu": 0.0, "peak_rss_kb": 0},
+                                    **{key: 0 for key in SUMMED_ATTRIBUTES}))
+    for item in spans():
+        row = rows[item["category"]]
+        row["count"] += 1
+        row["wall"] += item["wall"]
+        row["cpu"] += item["cpu"]
+        row["peak_rss_kb"] = max(row["peak_rss_kb"], item["peak_rss_kb"])
+        for key in SUMMED_ATTRIBUTES:
+            value = item["attrs"].get(key)
+            if isinstance(value, (int, float)):
+                row[key] += value
+    return sorted(({"category": category, **row} for category, row in rows.items()),
+                  key=lambda row: -row["wall"])
+
+def print_summary():
+    """Prints summary() as a table. Wall times of nested or concurrent spans overlap, so they do not add up."""
+    print(f"{'category':<12} {'spans':>6} {'wall s':>9} {'cpu s':>8} {'MB read':>8} {'peak MB':>8} "
+          f"{'prompt tok':>10} {'compl tok':>9} {'cache hits':>10} {'retries':>7}")
+    for row in summary():
+        print(f"{row['category'] or '-':<12} {row['count']:>6} {row['wall']:>9.2f} {row['cpu']:>8.2f} "
+              f"{row['bytes_read'] / 1e6:>8.1f} {row['peak_rss_kb'] / 1024:>8.0f} "
+              f"{row['prompt_tokens']:>10} {row['completion_tokens']:>9} {row['cache_hits']:>10} {row['retries']:>7}")
@@ -1,43 +1,102 @@
-import os
-from dotenv import load_dotenv
-import openai
+import time
+import asyncio
+from llm_client import chat_completion, achat_completion, PRIORITY_REPORT
+from retrieval import DEFAULT_THEME
 
-# Load OpenAI API key from .env file
-load_dotenv()
-openai.api_key = os.getenv("OPENAI_API_KEY")
+# Maximum number of report requests (title and paragraphs) in flight at the same time.
+REPORT_CONCURRENCY = 6
 
-def generate_title(thesis):
+# Completion token limits of the thesis, the title and each paragraph.
+THESIS_MAX_TOKENS = 150
+TITLE_MAX_TOKENS = 20
+PARAGRAPH_MAX_TOKENS = 300
+
+# Words used in the prompts for the number of novels and for the position of a novel.
+NUMBER_WORDS = ("zero", "one", "two", "three", "four", "five", "six", "seven", "eight", "nine", "ten")
+ORDINAL_WORDS = ("first", "second", "third", "fourth", "fifth", "sixth", "seventh", "eighth", "ninth", "tenth")
+
+def _number(count):
+    return NUMBER_WORDS[count] if count < len(NUMBER_WORDS) else str(count)
+
+def _ordinal(position):
+    """Ordinal of a 1-based position ('first', ..., 'tenth', then '11th', '21st', ...)."""
+    if position <= len(ORDINAL_WORDS):
+        return ORDINAL_WORDS[position - 1]
+    suffix = "th" if 10 <= position % 100 <= 20 else {1: "st", 2: "nd", 3: "rd"}.get(position % 10, "th")
+    return f"{position}{suffix}"
+
+def paragraph_count(book_count):
+    """Number of paragraphs in a report on book_count books: an introduction, one per book and a conclusion."""
+    return book_count + 2
+
+def title_messages(thesis, theme=DEFAULT_THEME):
+    """
+    Builds the chat messages used to generate the report title.
+    """
+    prompt = (
+        f"Based on the following thesis statement, generate a short, interesting, and unique title in around 5 words for a book report on {theme}:\n\n"
+        + thesis + "\n\nTitle:"
+    )
+    return [
+        {"role": "system", "content": "You are a creative writer."},
+        {"role": "user", "content": prompt}
+    ]
+
+def generate_title(thesis, theme=DEFAULT_THEME):
     """
     Generates a short, interesting, and unique title based on the provided thesis statement.
     
     Parameters:
       - thesis (str): The thesis statement to base the title on.
+      - theme (str): The theme of the report.
     
     Returns:
       - str: A short and unique title.
     
     Process:
       - Constructs a prompt instructing GPT to generate a title based on the thesis.
-      - Calls the OpenAI API using the GPT-4o-mini model.
+      - Calls the OpenAI API using the GPT-4o-mini model (answered from the response cache when possible).
       - Returns the generated title.
     """
-    prompt = (
-        "Based on the following thesis statement, generate a short, interesting, and unique title in around 5 words for a book report on social isolation:\n\n"
-        + thesis + "\n\nTitle:"
+    title = chat_completion(
+         messages=title_messages(thesis, theme),
+         temperature=0.7,
+         max_tokens=TITLE_MAX_TOKENS,
+         priority=PRIORITY_REPORT
     )
-    response = openai.ChatCompletion.create(
-         model="gpt-4o-mini-2024-07-18",
-         messages=[
-             {"role": "system", "content": "You are a creative writer."},
-             {"role": "user", "content": prompt}
-         ],
+    return title
+
+async def generate_title_async(thesis, theme=DEFAULT_THEME, on_text=None):
+    """
+    Asynchronous counterpart of generate_title. With on_text the title is streamed (see llm_client.achat_completion).
+    """
+    title = await achat_completion(
+         messages=title_messages(thesis, theme),
          temperature=0.7,
-         max_tokens=20
+         max_tokens=TITLE_MAX_TOKENS,
+         priority=PRIORITY_REPORT,
+         on_text=on_text
     )
-    title = response.choices[0].message["content"].strip()
     return title
 
-def generate_thesis(book_summaries, comparative_analysis):
+def thesis_messages(book_summaries, comparative_analysis, theme=DEFAULT_THEME):
+    """
+    Builds the chat messages used to generate the thesis statement (see generate_thesis).
+    """
+    formatted_summaries = "\n\n".join(book_summaries)
+    prompt = (
+        "Based on the following book summaries and comparative analysis, generate a clear thesis statement that discusses "
+        f"how the novels address {theme}. Make sure to wrap the name of the book in quotation marks. \n\n"
+        "Book Summaries:\n" + formatted_summaries + "\n\n" +
+        "Comparative Analysis:\n" + comparative_analysis + "\n\n"
+        "Thesis Statement:"
+    )
+    return [
+        {"role": "system", "content": "You are an expert literary critic."},
+        {"role": "user", "content": prompt}
+    ]
+
+def generate_thesis(book_summaries, comparative_analysis, theme=DEFAULT_THEME):
     """
     Generates a thesis statement based on the provided book summaries and comparative analysis.
     Uses the OpenAI API (gpt-4o-mini-2024-07-18).
@@ -47,82 +106,42 @@ def generate_thesis(book_summaries, comparative_analysis):
     Parameters:
       - book_summaries: List of summaries for each book.
       - comparative_analysis: A comparative analysis of the summaries.
+      - theme: The theme the thesis is about.
     
     Returns:
       - A string containing the generated thesis statement.
     """
-    formatted_summaries = "\n\n".join(book_summaries)
-    prompt = (
-        "Based on the following book summaries and comparative analysis, generate a clear thesis statement that discusses "
-        "how the novels address social isolation. Make sure to wrap the name of the book in quotation marks. \n\n"
-        "Book Summaries:\n" + formatted_summaries + "\n\n" +
-        "Comparative Analysis:\n" + comparative_analysis + "\n\n"
-        "Thesis Statement:"
-    )
-    
-    response = openai.ChatCompletion.create(
-         model="gpt-4o-mini-2024-07-18",
-         messages=[
-             {"role": "system", "content": "You are an expert literary critic."},
-             {"role": "user", "content": prompt}
-         ],
+    thesis = chat_completion(
+         messages=thesis_messages(book_summaries, comparative_analysis, theme),
          temperature=0.7,
-         max_tokens=150
+         max_tokens=THESIS_MAX_TOKENS
     )
-    thesis = response.choices[0].message["content"].strip()
     return thesis
 
-def generate_paragraph(paragraph_index, thesis, book_summaries, comparative_analysis):
+def paragraph_messages(paragraph_index, thesis, book_summaries, comparative_analysis, theme=DEFAULT_THEME):
     """
-    Generates an individual paragraph based on the specified index, ensuring that the output is exactly 4-5 sentences long
-    and that publication titles are enclosed in double quotes.
-    
-    Structure:
-      - Paragraph 1: Introductory paragraph that presents the topic and ends with the thesis statement.
-      - Paragraph 2: Body paragraph discussing details from the first novel.
-      - Paragraph 3: Body paragraph discussing details from the second novel.
-      - Paragraph 4: Body paragraph discussing details from the third novel.
-      - Paragraph 5: Concluding paragraph that presents a rebuttal of a counterargument and summarizes the report.
-    
-    Parameters:
-      - paragraph_index (int): The paragraph number (1 to 5).
-      - thesis (str): The thesis statement.
-      - book_summaries (list): List of summaries for each book.
-      - comparative_analysis (str): The comparative analysis of the summaries.
-    
-    Returns:
-      - A string containing the generated paragraph.
+    Builds the chat messages used to generate the paragraph at paragraph_index (see generate_paragraph).
     """
     instruction = (
         "Ensure your response is exactly 4-5 sentences long. "
         "Also, use double quotes (\") around publication titles instead of asterisks (*)."
     )
+    count = len(book_summaries)
     
     if paragraph_index == 1:
+        novels = "one novel addresses" if count == 1 else f"{_number(count)} novels address"
         prompt = (
-            "Generate an introductory paragraph about how three novels address social isolation. "
+            f"Generate an introductory paragraph about how {novels} {theme}. "
             "Introduce the topic and end the paragraph with the following thesis statement: " + thesis + ". "
             + instruction
         )
-    elif paragraph_index == 2:
-        prompt = (
-            "Generate a body paragraph that discusses details from the first novel in support of the thesis. "
-            "Use the following summary for reference: " + book_summaries[0] + ". "
-            + instruction
-        )
-    elif paragraph_index == 3:
-        prompt = (
-            "Generate a body paragraph that discusses details from the second novel in support of the thesis. "
-            "Use the following summary for reference: " + book_summaries[1] + ". "
-            + instruction
-        )
-    elif paragraph_index == 4:
+    elif 2 <= paragraph_index <= count + 1:
         prompt = (
-            "Generate a body paragraph that discusses details from the third novel in support of the thesis. "
-            "Use the following summary for reference: " + book_summaries[2] + ". "
+            f"Generate a body paragraph that discusses details from the {_ordinal(paragraph_index - 1)} novel in support of the thesis. "
+            "Use the following summary for reference: " + book_summaries[paragraph_index - 2] + ". "
             + instruction
         )
-    elif paragraph_index == 5:
+    elif paragraph_index == count + 2:
         prompt = (
             "Generate a concluding paragraph that presents a rebuttal to a counterargument against the thesis and summarizes the overall analysis. "
             "Use the following comparative analysis as a reference: " + comparative_analysis + ". "
@@ -131,42 +150,141 @@ def generate_paragraph(paragraph_index, thesis, book_summaries, comparative_anal
     else:
         prompt = ""
     
-    response = openai.ChatCompletion.create(
-         model="gpt-4o-mini-2024-07-18",
-         messages=[
-             {"role": "system", "content": "You are a skilled writer who creates detailed book reports."},
-             {"role": "user", "content": prompt}
-         ],
+    return [
+        {"role": "system", "content": "You are a skilled writer who creates detailed book reports."},
+        {"role": "user", "content": prompt}
+    ]
+
+def generate_paragraph(paragraph_index, thesis, book_summaries, comparative_analysis, theme=DEFAULT_THEME):
+    """
+    Generates an individual paragraph based on the specified index, ensuring that the output is exactly 4-5 sentences long
+    and that publication titles are enclosed in double quotes.
+    
+    Structure (for N books):
+      - Paragraph 1: Introductory paragraph that presents the topic and ends with the thesis statement.
+      - Paragraphs 2 to N + 1: Body paragraphs discussing details from the first, second, ... novel.
+      - Paragraph N + 2: Concluding paragraph that presents a rebuttal of a counterargument and summarizes the report.
+    
+    Parameters:
+      - paragraph_index (int): The paragraph number (1 to N + 2, see paragraph_count).
+      - thesis (str): The thesis statement.
+      - book_summaries (list): List of summaries for each book.
+      - comparative_analysis (str): The comparative analysis of the summaries.
+      - theme (str): The theme of the report.
+    
+    Returns:
+      - A string containing the generated paragraph.
+    """
+    paragraph = chat_completion(
+         messages=paragraph_messages(paragraph_index, thesis, book_summaries, comparative_analysis, theme),
          temperature=0.7,
-         max_tokens=300
+         max_tokens=PARAGRAPH_MAX_TOKENS,
+         priority=PRIORITY_REPORT
     )
-    paragraph = response.choices[0].message["content"].strip()
     return paragraph
 
-def generate_report(thesis, book_summaries, comparative_analysis):
+async def generate_paragraph_async(paragraph_index, thesis, book_summaries, comparative_analysis, theme=DEFAULT_THEME,
+                                   on_text=None):
+    """
+    Asynchronous counterpart of generate_paragraph. With on_text the paragraph is streamed (see llm_client.achat_completion).
+    """
+    paragraph = await achat_completion(
+         messages=paragraph_messages(paragraph_index, thesis, book_summaries, comparative_analysis, theme),
+         temperature=0.7,
+         max_tokens=PARAGRAPH_MAX_TOKENS,
+         priority=PRIORITY_REPORT,
+         on_text=on_text
+    )
+    return paragraph
+
+async def generate_report_async(thesis, book_summaries, comparative_analysis, max_concurrency=REPORT_CONCURRENCY,
+                                theme=DEFAULT_THEME, on_progress=None):
+    """
+    Generates the title and the paragraphs of the report concurrently.
+    
+    None of these requests depend on each other (they only need the thesis, the summaries and
+    the comparative analysis), so they are all started at once, bounded by max_concurrency.
+    
+    Parameters:
+      - thesis (str): The thesis statement.
+      - book_summaries (list): List of book summaries.
+      - comparative_analysis (str): The comparative analysis.
+      - max_concurrency (int): Maximum number of requests in flight at once.
+      - theme (str): The theme of the report.
+      - on_progress (callable): Optional on_progress(event, **data), called on the event loop.
+        The requests are then streamed, and the events are:
+          - "report_started" (parts): the number of parts, the title being part 0;
+          - "part_delta" (index, text): the text of a part received so far;
+          - "part_completed" (index, text, seconds): a finished part, in completion order;
+          - "first_paragraph" (index, seconds): the first paragraph finished (time-to-first-paragraph).
+        Seconds are counted from the start of the report.
+    
+    Returns:
+      - A (title, paragraphs) tuple, with the paragraphs in report order.
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+    started = time.perf_counter()
+    # Seconds until the first paragraph (not the title) was complete.
+    first_paragraph = []
+    
+    def stream(index):
+        if on_progress is None:
+            return None
+        return lambda text: on_progress("part_delta", index=index, text=text)
+    
+    async def bounded(index, coroutine):
+        async with semaphore:
+            text = await coroutine
+        seconds = round(time.perf_counter() - started, 3)
+        if on_progress is not None:
+            on_progress("part_completed", index=index, text=text, seconds=seconds)
+        if index and not first_paragraph:
+            first_paragraph.append(seconds)
+            print(f"First paragraph (paragraph {index}) ready after {seconds:.2f}s.")
+            if on_progress is not None:
+                on_progress("first_paragraph", index=index, seconds=seconds)
+        return text
+    
+    count = paragraph_count(len(book_summaries))
+    print(f"Generating title and paragraphs 1-{count} concurrently...")
+    if on_progress is not None:
+        on_progress("report_started", parts=count + 1)
+    # gather returns results in submission order, whatever order the requests finish in.
+    title, *paragraphs = await asyncio.gather(
+        bounded(0, generate_title_async(thesis, theme, stream(0))),
+        *(bounded(i, generate_paragraph_async(i, thesis, book_summaries, comparative_analysis, theme, stream(i)))
+          for i in range(1, count + 1))
+    )
+    return title, paragraphs
+
+def generate_report(thesis, book_summaries, comparative_analysis, max_concurrency=REPORT_CONCURRENCY, theme=DEFAULT_THEME,
+                    on_progress=None):
     """
     Generates a complete book report by:
-      1. Generating each of the 5 paragraphs individually.
+      1. Generating the title and each paragraph (one per book, plus the introduction and conclusion)
+         concurrently (see generate_report_async).
       2. Combining them with two newlines between paragraphs.
-      3. Dynamically generating a title based on the thesis statement.
-      4. Prepending the title to the report.
-      5. Ensuring each paragraph starts with a four-space indent.
+      3. Prepending the title, dynamically generated from the thesis statement, to the report.
+      4. Ensuring each paragraph starts with a four-space indent.
     
     Parameters:
       - thesis (str): The thesis statement.
       - book_summaries (list): List of book summaries.
       - comparative_analysis (str): The comparative analysis.
+      - max_concurrency (int): Maximum number of report requests in flight at once.
+      - theme (str): The theme of the report.
+      - on_progress (callable): Receives the progress events of generate_report_async (for example
+        a report_stream.ReportSidecar), which then streams the requests.
     
     Returns:
       - A string containing the complete report with a dynamic title.
     """
-    # Generate a dynamic title based on the thesis.
-    title = generate_title(thesis)
+    title, generated = asyncio.run(
+        generate_report_async(thesis, book_summaries, comparative_analysis, max_concurrency, theme, on_progress)
+    )
     
     paragraphs = []
-    for i in range(1, 6):
-        print(f"Generating paragraph {i}...")
-        para = generate_paragraph(i, thesis, book_summaries, comparative_analysis)
+    for para in generated:
         # Add a four-space indent to the beginning of each paragraph.
         indented_para = "    " + para
         paragraphs.append(indented_para)
@@ -0,0 +1,99 @@
+import os
+import json
+import time
+
+# Extensions of the sidecar files written next to the report while it is generated.
+MARKDOWN_SIDECAR = ".partial.md"
+JSONL_SIDECAR = ".parts.jsonl"
+
+def sidecar_paths(output_path):
+    """Returns the (Markdown, JSONL) sidecar paths of a report written to output_path."""
+    base, _ = os.path.splitext(output_path)
+    return base + MARKDOWN_SIDECAR, base + JSONL_SIDECAR
+
+class ReportSidecar:
+    """
+    Writes a report to disk part by part while it is being generated, as an on_progress callback
+    of report_generation.generate_report.
+
+    - The JSONL file gets one line per finished part (title = part 0, then the paragraphs), in
+      the order they finish, with the seconds since the report started. A last "completed" line
+      holds the part count, the total time and the time-to-first-paragraph.
+    - The Markdown file holds the report in reading order (the title as a level-one heading, as
+      main.export_markdown writes it): a part is appended as soon as it and every part before it
+      are finished.
+    - Both files are flushed after every write, so a reader (or a crash) sees every finished part.
+    - Every event is also passed on to `forward`, e.g. to display the streamed text.
+
+    Use it as a context manager: the files are truncated on entry and closed on exit.
+    """
+
+    def __init__(self, output_path, forward=None):
+        self.markdown_path, self.jsonl_path = sidecar_paths(output_path)
+        self.forward = forward
+        self.parts = {}
+        self.first_paragraph_seconds = None
+        self._next = 0
+        self._started = None
+        self._markdown = None
+        self._jsonl = None
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        self._markdown = open(self.markdown_path, "w", encoding="utf-8")
+        self._jsonl = open(self.jsonl_path, "w", encoding="utf-8")
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is None:
+            self._write_line({"event": "completed", "parts": len(self.parts),
+                              "seconds": round(time.perf_counter() - self._started, 3),
+                              "first_paragraph_seconds": self.first_paragraph_seconds})
+        self._markdown.close()
+        self._jsonl.close()
+        return False
+
+    def __call__(self, event, **data):
+        if event == "part_completed":
+            self.parts[data["index"]] = data["text"]
+            self._write_line({"event": "part", "index": data["index"], "text": data["text"], "seconds": data["seconds"]})
+            self._write_markdown()
+        elif event == "first_paragraph":
+            self.first_paragraph_seconds = data["seconds"]
+        if self.forward is not None:
+            self.forward(event, **data)
+
+    def _write_line(self, record):
+        self._jsonl.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._jsonl.flush()
+
+    def _write_markdown(self):
+        """Appends the finished parts that directly follow the ones already written."""
+        while self._next in self.parts:
+            text = self.parts[self._next].strip()
+            self._markdown.write(f"# {text}\n\n" if self._next == 0 else text + "\n\n")
+            self._next += 1
+        self._markdown.flush()
+
+def read_sidecar(jsonl_path):
+    """
+    Reads a JSONL sidecar back.
+
+    Returns:
+      - (parts, summary): the finished parts by index, and the "completed" record (None if the
+        report was interrupted before it was finished).
+    """
+    parts = {}
+    summary = None
+    with open(jsonl_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # A line cut short by a crash ends the readable part of the file.
+                break
+            if record["event"] == "part":
+                parts[record["index"]] = record["text"]
+            elif record["event"] == "completed":
+                summary = record
+    return parts, summary
@@ -0,0 +1,253 @@
+import os
+import re
+import threading
+import numpy as np
+from text_processing import CHUNK_TOKENS, TOKEN_ENCODING, count_tokens, get_token_encoder
+
+# Theme the report is written about.
+DEFAULT_THEME = "social isolation"
+
+# Words added to a theme's query so that passages using related vocabulary are found too.
+THEME_EXPANSIONS = {
+    "social isolation": (
+        "isolation isolated alone lonely loneliness solitude alienation alienated estranged "
+        "withdrawn apart outsider stranger silence silent distant shut locked abandoned ignored"
+    ),
+}
+
+# Size of the passages the index is built over (model tokens, see MappedCorpus.token_chunk_spans).
+PASSAGE_TOKENS = 250
+
+# Joins selected passages in a chunk: they are usually not contiguous in the book.
+PASSAGE_SEPARATOR = " [...] "
+
+# BM25 parameters.
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# Matches words (letters, digits and inner apostrophes).
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:['’][a-z]+)?")
+
+# Very common words that carry no topical weight.
+STOPWORDS = frozenset(
+    "a an and are as at be but by for from had has have he her his i in is it its me my no not of on or "
+    "she so that the their them then there they this to was we were what when which who with would you".split()
+)
+
+def tokenize(text):
+    """
+    Splits text into lowercase index terms, dropping stopwords.
+
+    Parameters:
+      text (str): The input text.
+
+    Returns:
+      list of str: The terms, in order.
+    """
+    return [term for term in TOKEN_PATTERN.findall(text.lower()) if term not in STOPWORDS]
+
+def theme_query(theme=DEFAULT_THEME):
+    """Returns the search query for a theme, including its expansion words when known."""
+    return theme + " " + THEME_EXPANSIONS.get(theme, "")
+
+class PassageIndex:
+    """
+    Offline BM25 index over the passages of one book.
+
+    Postings are stored term-major in flat NumPy arrays (CSC layout): the postings of term t are
+    docs[term_ptr[t]:term_ptr[t + 1]] with frequencies freqs[...]. Scoring a query touches only
+    the postings of its terms and is fully vectorized.
+    """
+
+    def __init__(self, vocabulary, term_ptr, docs, freqs, doc_lengths, passage_tokens):
+        self.vocabulary = vocabulary
+        self.term_ptr = term_ptr
+        self.docs = docs
+        self.freqs = freqs
+        self.doc_lengths = doc_lengths
+        self.passage_tokens = passage_tokens
+
+    @classmethod
+    def build(cls, passages):
+        """
+        Builds the index.
+
+        Parameters:
+          passages (list of str): The passages, in reading order.
+
+        Returns:
+          PassageIndex
+        """
+        vocabulary = {}
+        entry_terms = []
+        entry_docs = []
+        doc_lengths = np.zeros(len(passages), dtype=np.int32)
+        for doc, passage in enumerate(passages):
+            terms = tokenize(passage)
+            doc_lengths[doc] = len(terms)
+            entry_terms.extend(vocabulary.setdefault(term, len(vocabulary)) for term in terms)
+            entry_docs.extend([doc] * len(terms))
+        entry_terms = np.asarray(entry_terms, dtype=np.int64)
+        entry_docs = np.asarray(entry_docs, dtype=np.int64)
+        # Count each (term, doc) pair once: encode the pair as one integer and take unique values.
+        pairs, freqs = np.unique(entry_terms * max(len(passages), 1) + entry_docs, return_counts=True)
+        terms = pairs // max(len(passages), 1)
+        docs = pairs % max(len(passages), 1)
+        term_ptr = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(terms, minlength=len(vocabulary)), out=term_ptr[1:])
+        passage_tokens = np.asarray([count_tokens(p) for p in passages], dtype=np.int32)
+        return cls(vocabulary, term_ptr, docs.astype(np.int32), freqs.astype(np.int32), doc_lengths, passage_tokens)
+
+    def __len__(self):
+        return len(self.doc_lengths)
+
+    def scores(self, query, k1=BM25_K1, b=BM25_B):
+        """
+        Scores every passage against a query with BM25.
+
+        Returns:
+          numpy.ndarray: One score per passage.
+        """
+        scores = np.zeros(len(self), dtype=np.float64)
+        if not len(self):
+            return scores
+        average_length = max(float(self.doc_lengths.mean()), 1.0)
+        term_ids = {self.vocabulary[term] for term in tokenize(query) if term in self.vocabulary}
+        for term_id in term_ids:
+            start, end = self.term_ptr[term_id], self.term_ptr[term_id + 1]
+            docs = self.docs[start:end]
+            tf = self.freqs[start:end].astype(np.float64)
+            df = end - start
+            idf = np.log(1.0 + (len(self) - df + 0.5) / (df + 0.5))
+            norm = k1 * (1.0 - b + b * self.doc_lengths[docs] / average_length)
+            scores[docs] += idf * tf * (k1 + 1.0) / (tf + norm)
+        return scores
+
+    def select(self, query, token_budget, top_k=None):
+        """
+        Picks the best passages for a query under a token budget.
+
+        Passages are taken in decreasing score order (skipping those with a zero score) while they
+        fit in token_budget, up to top_k passages.
+
+        Returns:
+          list of int: The selected passage indices, in reading order.
+        """
+        scores = self.scores(query)
+        selected = []
+        used = 0
+        for doc in np.argsort(-scores, kind="stable"):
+            if scores[doc] <= 0 or (top_k is not None and len(selected) >= top_k):
+                break
+            if used + self.passage_tokens[doc] > token_budget:
+                continue
+            selected.append(int(doc))
+            used += int(self.passage_tokens[doc])
+        return sorted(selected)
+
+    def save(self, path):
+        """Writes the index to a .npz file (written to a temporary file and renamed)."""
+        terms = np.empty(len(self.vocabulary), dtype=object)
+        for term, term_id in self.vocabulary.items():
+            terms[term_id] = term
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp.npz"
+        np.savez(
+            tmp_path,
+            terms=terms.astype(str),
+            term_ptr=self.term_ptr,
+            docs=self.docs,
+            freqs=self.freqs,
+            doc_lengths=self.doc_lengths,
+            passage_tokens=self.passage_tokens,
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """Reads an index written by save."""
+        with np.load(path) as data:
+            vocabulary = {str(term): term_id for term_id, term in enumerate(data["terms"])}
+            return cls(vocabulary, data["term_ptr"], data["docs"], data["freqs"], data["doc_lengths"], data["passage_tokens"])
+
+# Indexes already loaded in this process, by file path (they are read-only once built).
+_loaded_indexes = {}
+
+def corpus_index(corpus, passage_tokens=PASSAGE_TOKENS):
+    """
+    Returns the passage index of a stored book, building and persisting it next to the corpus on first use.
+    Loaded indexes are kept in memory, so a long-running process reads each one only once.
+
+    Parameters:
+      corpus (MappedCorpus): The book, opened from the corpus store.
+      passage_tokens (int): Size of the passages the index is built over, in model tokens.
+
+    Returns:
+      (PassageIndex, list of (start, end)): The index and the byte spans of its passages.
+    """
+    spans = corpus.token_chunk_spans(passage_tokens, 0)
+    # Passage boundaries depend on how tokens are counted, so estimated counts get their own index.
+    tokenizer = TOKEN_ENCODING if get_token_encoder() is not None else "estimate"
+    path = os.path.join(corpus.entry_dir, f"bm25-{tokenizer}-{passage_tokens}.npz")
+    if path in _loaded_indexes:
+        return _loaded_indexes[path], spans
+    if os.path.exists(path):
+        index = PassageIndex.load(path)
+    else:
+        index = PassageIndex.build([corpus.buffer[start:end].decode("utf-8") for start, end in spans])
+        index.save(path)
+    _loaded_indexes[path] = index
+    return index, spans
+
+def unload_indexes(corpus):
+    """Drops the loaded indexes of a book from memory (e.g. when a long-running process closes it)."""
+    for path in [path for path in _loaded_indexes if os.path.dirname(path) == corpus.entry_dir]:
+        del _loaded_indexes[path]
+
+def select_passages(corpus, token_budget, theme=DEFAULT_THEME, top_k=None, passage_tokens=PASSAGE_TOKENS):
+    """
+    Selects the passages of a book most relevant to a theme, within a token budget.
+
+    Parameters:
+      corpus (MappedCorpus): The book, opened from the corpus store.
+      token_budget (int): Maximum model tokens of the selected passages.
+      theme (str or list): The theme to search for. With several themes, each gets an equal share
+        of the budget (and of top_k) and the passages selected for any of them are kept, once.
+      top_k (int): Optional maximum number of passages.
+      passage_tokens (int): Size of the indexed passages, in model tokens.
+
+    Returns:
+      list of str: The selected passages, in reading order.
+    """
+    themes = [theme] if isinstance(theme, str) else list(theme)
+    index, spans = corpus_index(corpus, passage_tokens)
+    selected = set()
+    for query in themes:
+        selected.update(index.select(theme_query(query), token_budget // len(themes),
+                                     top_k and max(1, top_k // len(themes))))
+    return [corpus.buffer[spans[i][0]:spans[i][1]].decode("utf-8") for i in sorted(selected)]
+
+def group_passages(passages, max_tokens=CHUNK_TOKENS):
+    """
+    Packs selected passages into chunks of up to max_tokens model tokens for summarization
+    (measured with text_processing.count_tokens, like the chunks of a whole book).
+
+    Passages are joined with PASSAGE_SEPARATOR since they are usually not contiguous in the book,
+    so the model does not read them as continuous text. For the same reason no overlap is
+    repeated between chunks. A passage is never split, so one longer than max_tokens makes a
+    chunk of its own (select_passages with passage_tokens <= max_tokens avoids it).
+    """
+    separator_tokens = count_tokens(PASSAGE_SEPARATOR)
+    chunks = []
+    current = []
+    current_tokens = 0
+    for passage in passages:
+        tokens = count_tokens(passage)
+        if current and current_tokens + separator_tokens + tokens > max_tokens:
+            chunks.append(PASSAGE_SEPARATOR.join(current))
+            current = []
+            current_tokens = 0
+        current_tokens += tokens + (separator_tokens if current else 0)
+        current.append(passage)
+    if current:
+        chunks.append(PASSAGE_SEPARATOR.join(current))
+    return chunks
@@ -0,0 +1,525 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+import hashlib
+import argparse
+import functools
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+import main
+from corpus_store import CorpusStore, DEFAULT_STORE_DIR
+import retrieval
+import citations
+from retrieval import DEFAULT_THEME
+from summarization import analyze_comparative
+from report_generation import generate_thesis, generate_report
+from citations import extract_quotes, verify_quotes
+from text_processing import get_sentence_tokenizer
+from llm_client import get_cache
+
+# Where the service listens by default.
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+
+# Where reports are written when a job does not give an output path.
+DEFAULT_OUTPUT_DIR = "reports"
+
+# Supported output formats and their file extensions ('text' returns the report in the job result).
+OUTPUT_FORMATS = {"docx": ".docx", "markdown": ".md", "text": None}
+
+# Results of shared work kept for later jobs; the least recently used are dropped beyond this.
+MAX_SHARED_RESULTS = 512
+
+# Memory-mapped corpora (with their indexes) kept open; the least recently used ones that no
+# running job needs are closed beyond this.
+MAX_OPEN_CORPORA = 16
+
+# HTTP status lines used by the service.
+STATUS_LINES = {200: "OK", 202: "Accepted", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 500: "Internal Server Error"}
+
+def _digest(*values):
+    """Returns a SHA-256 digest of JSON-serializable values, used as a key for shared work."""
+    return hashlib.sha256(json.dumps(values, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+def parse_job(payload):
+    """
+    Validates a job request.
+
+    Parameters:
+      - payload (dict): {"books": [...], "theme": str, "format": str, "retrieval_budget": int, "output": str}.
+        Books are "NAME=PATH" strings or {"name": ..., "path": ...} objects, in report order
+        (defaults to the three novels); output is a file name (or relative path) inside the
+        service's output directory; every field is optional.
+
+    Returns:
+      - dict: The normalized job spec.
+
+    Raises:
+      - ValueError: If a field is invalid or a book file does not exist.
+    """
+    if not isinstance(payload, dict):
+        raise ValueError("The job request must be a JSON object.")
+    requested = payload.get("books") or [f"{name}={path}" for name, path, _ in main.BOOKS]
+    if not isinstance(requested, list):
+        raise ValueError("books must be a list.")
+    books = []
+    for book in requested:
+        if isinstance(book, dict):
+            book = f"{book.get('name')}={book.get('path')}"
+        elif not isinstance(book, str):
+            raise ValueError(f'Invalid book {book!r}: expected a NAME=PATH string or a {{"name": ..., "path": ...}} object.')
+        try:
+            name, file_path, file_type = main.parse_book(book)
+        except argparse.ArgumentTypeError as e:
+            raise ValueError(str(e))
+        if not os.path.exists(file_path):
+            raise ValueError(f"Book file not found: {file_path}")
+        books.append((name, file_path, file_type))
+    theme = payload.get("theme") or DEFAULT_THEME
+    if not isinstance(theme, str) or not theme.strip():
+        raise ValueError("theme must be a non-empty string.")
+    theme = theme.strip()
+    output_format = payload.get("format", "docx")
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"Unsupported format {output_format!r}; expected one of {sorted(OUTPUT_FORMATS)}.")
+    retrieval_budget = payload.get("retrieval_budget")
+    if retrieval_budget is not None and (not isinstance(retrieval_budget, int) or retrieval_budget <= 0):
+        raise ValueError("retrieval_budget must be a positive integer.")
+    output = payload.get("output")
+    if output is not None:
+        if not isinstance(output, str) or not output.strip():
+            raise ValueError("output must be a non-empty string.")
+        if os.path.isabs(output) or ".." in output.replace("\\", "/").split("/"):
+            raise ValueError("output must be a relative path inside the output directory, without '..'.")
+    return {"books": books, "theme": theme, "format": output_format,
+            "retrieval_budget": retrieval_budget, "output": output}
+
+class Job:
+    """
+    One report request: its spec, status, progress events and result.
+
+    Events are appended by the job's coroutine on the event loop; follow() replays them and
+    then waits for new ones, so any number of clients can stream a job's progress.
+    """
+
+    def __init__(self, spec):
+        self.id = uuid.uuid4().hex[:12]
+        self.spec = spec
+        self.status = "queued"
+        self.created = time.time()
+        self.finished = None
+        self.result = None
+        self.error = None
+        self.events = []
+        self._update = asyncio.Event()
+
+    @property
+    def done(self):
+        return self.status in ("completed", "failed")
+
+    def emit(self, event, **data):
+        """Records a progress event and wakes up the clients following the job."""
+        self.events.append({"job": self.id, "event": event, "elapsed": round(time.time() - self.created, 3), **data})
+        self._update.set()
+        self._update = asyncio.Event()
+
+    async def follow(self):
+        """Yields every event of the job, past and future, until the job is done."""
+        position = 0
+        while True:
+            update = self._update
+            while position < len(self.events):
+                yield self.events[position]
+                position += 1
+            if self.done:
+                return
+            await update.wait()
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "status": self.status,
+            "books": [{"name": name, "path": path} for name, path, _ in self.spec["books"]],
+            "theme": self.spec["theme"],
+            "format": self.spec["format"],
+            "created": self.created,
+            "finished": self.finished,
+            "error": self.error,
+            "result": self.result,
+        }
+
+class ReportService:
+    """
+    Runs report jobs in a long-lived process, keeping everything that can be reused warm:
+
+    - Loaded modules, the sentence tokenizer and the LLM response cache connection.
+    - Ingested books: a book is looked up by path, size and modification time, so an unchanged
+      file is neither hashed nor parsed again, and its memory-mapped corpus stays open.
+    - Retrieval and quote indexes (kept in memory by retrieval and citations).
+    - Results of shared work (ingestion, book summaries, comparative analysis, thesis, report,
+      citation checks):
+      concurrent jobs needing the same result wait for a single computation, and later jobs
+      reuse it, so a report on already-ingested books only costs the model calls it really needs.
+
+    Both are bounded: the least recently used results beyond MAX_SHARED_RESULTS are dropped, and
+    the least recently used corpora beyond MAX_OPEN_CORPORA that no running job holds are closed.
+
+    Parameters:
+      - store_root (str): Corpus store directory.
+      - output_dir (str): Where report files are written by default.
+      - max_workers (int): Threads running blocking work (parsing, model calls).
+      - max_jobs (int): Jobs running at the same time; others wait in the queue.
+    """
+
+    def __init__(self, store_root=DEFAULT_STORE_DIR, output_dir=DEFAULT_OUTPUT_DIR, max_workers=8, max_jobs=4):
+        self.store = CorpusStore(store_root)
+        self.output_dir = output_dir
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.max_jobs = max_jobs
+        self.jobs = {}
+        self.corpora = OrderedDict()
+        self._corpus_users = Counter()
+        self._results = OrderedDict()
+        self._in_flight = {}
+        self._report_followers = {}
+        self._report_events = {}
+        self._job_slots = None
+        self.stats = {"computed": 0, "joined": 0, "reused": 0}
+        os.makedirs(output_dir, exist_ok=True)
+
+    def warm_up(self):
+        """Loads the sentence tokenizer and opens the response cache before the first job arrives."""
+        get_sentence_tokenizer()
+        get_cache()
+
+    async def run_blocking(self, func, *args):
+        """Runs a blocking function in the worker threads."""
+        return await asyncio.get_running_loop().run_in_executor(self.executor, functools.partial(func, *args))
+
+    async def shared(self, key, func, *args):
+        """
+        Computes func(*args) once per key.
+
+        Callers arriving while the computation runs wait for the same result; later callers get
+        the stored result. Failures are not stored, so a later job tries again.
+        """
+        if key in self._results:
+            self.stats["reused"] += 1
+            self._results.move_to_end(key)
+            return self._results[key]
+        if key in self._in_flight:
+            self.stats["joined"] += 1
+            return await self._in_flight[key]
+        future = asyncio.ensure_future(self.run_blocking(func, *args))
+        self._in_flight[key] = future
+        try:
+            result = await future
+        finally:
+            del self._in_flight[key]
+        self.stats["computed"] += 1
+        self._results[key] = result
+        while len(self._results) > MAX_SHARED_RESULTS:
+            self._results.popitem(last=False)
+        return result
+
+    async def ingest(self, file_path, file_type, held=None):
+        """
+        Returns the store key of a book, ingesting it only if this file version was not seen yet,
+        and opens its corpus. With a `held` list, the corpus is held open (and its key appended)
+        until release_corpora(held).
+        """
+        info = os.stat(file_path)
+        key = ("ingest", os.path.abspath(file_path), info.st_size, info.st_mtime_ns)
+        store_key = await self.shared(key, self.store.ingest, file_path, file_type, True)
+        if store_key not in self.corpora:
+            self.corpora[store_key] = self.store.open(store_key)
+        self.corpora.move_to_end(store_key)
+        if held is not None:
+            self._corpus_users[store_key] += 1
+            held.append(store_key)
+        self._close_unused_corpora()
+        return store_key
+
+    def release_corpora(self, held):
+        """Lets go of the corpora held by a job, closing the ones beyond MAX_OPEN_CORPORA."""
+        for store_key in held:
+            self._corpus_users[store_key] -= 1
+            if not self._corpus_users[store_key]:
+                del self._corpus_users[store_key]
+        self._close_unused_corpora()
+
+    def _close_unused_corpora(self):
+        while len(self.corpora) > MAX_OPEN_CORPORA:
+            store_key = next((key for key in self.corpora if key not in self._corpus_users), None)
+            if store_key is None:
+                return
+            corpus = self.corpora.pop(store_key)
+            retrieval.unload_indexes(corpus)
+            citations.unload_indexes(corpus)
+            corpus.close()
+
+    async def summarize(self, store_key, retrieval_budget, theme=DEFAULT_THEME):
+        """Returns the summary of a stored book focused on a theme (see main.summarize_corpus)."""
+        corpus = self.corpora[store_key]
+        return await self.shared(("summary", store_key, retrieval_budget, theme),
+                                 functools.partial(main.summarize_corpus, theme=theme), corpus, retrieval_budget)
+
+    def submit(self, spec):
+        """Queues a job and returns it."""
+        job = Job(spec)
+        self.jobs[job.id] = job
+        job.emit("queued")
+        asyncio.ensure_future(self.run(job))
+        return job
+
+    async def _stage(self, job, name, awaitable):
+        """Awaits one step of a job, reporting its start and duration as events."""
+        job.emit("stage_started", stage=name)
+        started = time.perf_counter()
+        result = await awaitable
+        job.emit("stage_finished", stage=name, seconds=round(time.perf_counter() - started, 3))
+        return result
+
+    async def run(self, job):
+        """Runs a job: ingest -> summarize -> comparative -> thesis -> report -> citations -> export."""
+        if self._job_slots is None:
+            self._job_slots = asyncio.Semaphore(self.max_jobs)
+        async with self._job_slots:
+            job.status = "running"
+            job.emit("started")
+            started = time.perf_counter()
+            held = []
+            try:
+                job.result = await self._run(job, held)
+                job.result["seconds"] = round(time.perf_counter() - started, 3)
+                job.status = "completed"
+            except Exception as e:
+                job.error = f"{type(e).__name__}: {e}"
+                job.status = "failed"
+            finally:
+                self.release_corpora(held)
+            job.finished = time.time()
+            job.emit(job.status, error=job.error)
+
+    async def _run(self, job, held):
+        spec = job.spec
+        books = spec["books"]
+        budget = spec["retrieval_budget"]
+        theme = spec["theme"]
+        keys = await asyncio.gather(*(
+            self._stage(job, f"ingest:{name}", self.ingest(file_path, file_type, held)) for name, file_path, file_type in books
+        ))
+        summaries = list(await asyncio.gather(*(
+            self._stage(job, f"summarize:{name}", self.summarize(key, budget, theme)) for (name, _, _), key in zip(books, keys)
+        )))
+        comparative = await self._stage(job, "comparative", self.shared(
+            ("comparative", _digest(summaries, theme)), analyze_comparative, summaries, theme))
+        thesis = await self._stage(job, "thesis", self.shared(
+            ("thesis", _digest(summaries, comparative, theme)), generate_thesis, summaries, comparative, theme))
+        report_key = ("report", _digest(summaries, comparative, thesis, theme))
+        self.follow_report(report_key, job)
+        try:
+            report = await self._stage(job, "report", self.shared(
+                report_key, functools.partial(generate_report, theme=theme, on_progress=self.report_progress(report_key)),
+                thesis, summaries, comparative))
+        finally:
+            self.unfollow_report(report_key, job)
+        corpora = {name: self.corpora[key] for (name, _, _), key in zip(books, keys)}
+        checks = await self._stage(job, "citations", self.shared(
+            ("citations", _digest(list(corpora), keys, report)), verify_quotes, extract_quotes(report), corpora))
+        output = await self._stage(job, "export", self.run_blocking(self.export, job, report))
+        result = {
+            "title": report.split("\n\n")[0].strip(),
+            "output": output,
+            "citations": [check._asdict() for check in checks],
+        }
+        if spec["format"] == "text":
+            result["report"] = report
+        return result
+
+    def follow_report(self, key, job):
+        """
+        Makes a job receive the progress events of the shared report computed under key, whichever
+        job started it. A job joining a report already being written first gets the events so far.
+        """
+        self._report_followers.setdefault(key, []).append(job)
+        for event, data in self._report_events.get(key, []):
+            job.emit(event, **data)
+
+    def unfollow_report(self, key, job):
+        followers = self._report_followers[key]
+        followers.remove(job)
+        if not followers:
+            del self._report_followers[key]
+            self._report_events.pop(key, None)
+
+    def report_progress(self, key):
+        """
+        Returns the on_progress callback of a shared report (see report_generation.generate_report).
+        Finished parts and the time-to-first-paragraph become events ('report_part',
+        'first_paragraph') of every job following the report, so their clients read it while it is
+        written. The report runs in a worker thread; the events are recorded on the event loop.
+        """
+        loop = asyncio.get_running_loop()
+        names = {"part_completed": "report_part", "first_paragraph": "first_paragraph"}
+
+        def record(event, data):
+            if key not in self._report_followers:
+                return
+            self._report_events.setdefault(key, []).append((event, data))
+            for job in self._report_followers.get(key, []):
+                job.emit(event, **data)
+
+        def progress(event, **data):
+            if event in names:
+                loop.call_soon_threadsafe(record, names[event], data)
+        return progress
+
+    def output_path(self, name):
+        """
+        Resolves a report file name under the output directory, creating its subdirectories.
+
+        Raises:
+          - ValueError: If the path leads outside the output directory (e.g. through a symlink).
+        """
+        root = os.path.realpath(self.output_dir)
+        path = os.path.realpath(os.path.join(root, name))
+        if os.path.commonpath([root, path]) != root or path == root:
+            raise ValueError(f"Output path {name!r} is outside the output directory.")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
+    def export(self, job, report):
+        """Writes the report in the job's format and returns the path (None for 'text')."""
+        extension = OUTPUT_FORMATS[job.spec["format"]]
+        if extension is None:
+            return None
+        path = self.output_path(job.spec["output"] or f"{job.id}{extension}")
+        if job.spec["format"] == "markdown":
+            return main.export_markdown(report, path)
+        return main.export_docx(report, path)
+
+    def health(self):
+        return {
+            "status": "ok",
+            "jobs": {status: sum(job.status == status for job in self.jobs.values())
+                     for status in ("queued", "running", "completed", "failed")},
+            "corpora": len(self.corpora),
+            "shared_work": dict(self.stats, stored=len(self._results)),
+            "llm_cache": get_cache().stats(),
+        }
+
+    async def handle(self, reader, writer):
+        """Serves one HTTP/1.1 request (the connection is closed afterwards)."""
+        try:
+            request_line = await reader.readline()
+            if not request_line:
+                return
+            method, target, _ = request_line.decode("latin-1").split(" ", 2)
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get("content-length", 0)))
+            await self.route(method, urlsplit(target).path.rstrip("/"), body, writer)
+        except (ValueError, json.JSONDecodeError) as e:
+            await self.respond(writer, 400, {"error": str(e)})
+        except ConnectionError:
+            pass
+        except Exception as e:
+            # A bug must not leave the client waiting for a response that never comes.
+            print(f"Error serving a request: {type(e).__name__}: {e}")
+            try:
+                await self.respond(writer, 500, {"error": f"{type(e).__name__}: {e}"})
+            except ConnectionError:
+                pass
+        finally:
+            writer.close()
+
+    async def route(self, method, path, body, writer):
+        parts = [part for part in path.split("/") if part]
+        if parts == ["health"] and method == "GET":
+            await self.respond(writer, 200, self.health())
+        elif parts == ["jobs"] and method == "POST":
+            job = self.submit(parse_job(json.loads(body or b"{}")))
+            await self.respond(writer, 202, job.to_dict())
+        elif parts == ["jobs"] and method == "GET":
+            await self.respond(writer, 200, [job.to_dict() for job in self.jobs.values()])
+        elif len(parts) >= 2 and parts[0] == "jobs" and parts[1] not in self.jobs:
+            await self.respond(writer, 404, {"error": f"Unknown job {parts[1]!r}."})
+        elif len(parts) == 2 and parts[0] == "jobs" and method == "GET":
+            await self.respond(writer, 200, self.jobs[parts[1]].to_dict())
+        elif len(parts) == 3 and parts[0] == "jobs" and parts[2] == "events" and method == "GET":
+            await self.stream_events(writer, self.jobs[parts[1]])
+        elif parts in (["health"], ["jobs"]) or (parts and parts[0] == "jobs"):
+            await self.respond(writer, 405, {"error": f"{method} is not allowed on {path}."})
+        else:
+            await self.respond(writer, 404, {"error": f"Not found: {path}"})
+
+    async def respond(self, writer, status, payload):
+        body = json.dumps(payload, default=str).encode("utf-8")
+        writer.write(
+            f"HTTP/1.1 {status} {STATUS_LINES[status]}\r\nContent-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("latin-1") + body
+        )
+        await writer.drain()
+
+    async def stream_events(self, writer, job):
+        """Streams a job's events as newline-delimited JSON until the job is done."""
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/x-ndjson\r\nConnection: close\r\n\r\n")
+        async for event in job.follow():
+            writer.write(json.dumps(event, default=str).encode("utf-8") + b"\n")
+            await writer.drain()
+
+async def serve(service, host=DEFAULT_HOST, port=DEFAULT_PORT, unix_path=None, preload=()):
+    """Warms the service up, ingests the preloaded books and serves requests forever."""
+    await service.run_blocking(service.warm_up)
+    for name, file_path, file_type in preload:
+        print(f"Preloading {name} ({file_path})...")
+        await service.ingest(file_path, file_type)
+    if unix_path:
+        server = await asyncio.start_unix_server(service.handle, path=unix_path)
+        print(f"Report service listening on unix:{unix_path}")
+    else:
+        server = await asyncio.start_server(service.handle, host, port)
+        print(f"Report service listening on http://{host}:{port}")
+    async with server:
+        await server.serve_forever()
+
+def run_service(argv=None):
+    """
+    Command-line entry point:
+
+        python service.py [--host H] [--port P | --unix PATH] [--workers N] [--max-jobs N]
+                          [--output-dir DIR] [--preload NAME=PATH ...]
+
+    Endpoints:
+      - POST /jobs: queue a report job (see parse_job); returns the job with its id.
+      - GET /jobs, GET /jobs/<id>: job status and result.
+      - GET /jobs/<id>/events: progress events as newline-delimited JSON, streamed until the job ends.
+      - GET /health: job counts, warm corpora, shared-work and LLM cache statistics.
+    """
+    parser = argparse.ArgumentParser(description="Serve report jobs from a long-running process with warm caches.")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--unix", metavar="PATH", help="Listen on a Unix socket instead of TCP.")
+    parser.add_argument("--workers", type=int, default=8, help="Threads running parsing and model calls.")
+    parser.add_argument("--max-jobs", type=int, default=4, help="Jobs running at the same time.")
+    parser.add_argument("--output-dir", default=DEFAULT_OUTPUT_DIR, help="Where reports are written.")
+    parser.add_argument("--preload", action="append", type=main.parse_book, default=[], metavar="NAME=PATH",
+                        help="A book to ingest at startup (repeatable).")
+    args = parser.parse_args(argv)
+    service = ReportService(output_dir=args.output_dir, max_workers=args.workers, max_jobs=args.max_jobs)
+    try:
+        asyncio.run(serve(service, args.host, args.port, args.unix, args.preload))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    run_service()
@@ -1,66 +1,291 @@
-import os
-import hashlib
-from dotenv import load_dotenv
-import openai
+import asyncio
+import profiling
+from llm_client import chat_completion, achat_completion, PRIORITY_BULK
+from retrieval import DEFAULT_THEME
 
-# Load OpenAI API key from .env file
-load_dotenv()
-openai.api_key = os.getenv("OPENAI_API_KEY")
+# Maximum number of summarization requests allowed in flight at the same time.
+MAX_CONCURRENT_REQUESTS = 8
 
-# Simple cache to avoid duplicate summarization calls
-cache = {}
+# Number of consecutive summaries that are merged together at each reduce step.
+REDUCE_FANOUT = 8
 
-def summarize_text(text):
+# Completion token limits of chunk summaries and of combined (section/book) summaries.
+SUMMARY_MAX_TOKENS = 150
+COMBINE_MAX_TOKENS = 300
+
+# Completion token limit of a theme-neutral chunk digest (it has to serve every theme, so it keeps more).
+DIGEST_MAX_TOKENS = 250
+
+# Completion token limit of the comparative analysis.
+COMPARATIVE_MAX_TOKENS = 300
+
+SUMMARY_SYSTEM_PROMPT = "You are a helpful assistant that summarizes text with emphasis on {theme} and includes citations from the text."
+
+DIGEST_SYSTEM_PROMPT = "You are a helpful assistant that writes faithful, theme-neutral digests of text and includes citations from the text."
+
+def _summary_prompt(text, theme=DEFAULT_THEME):
     """
-    Summarizes the given text with emphasis on the theme of social isolation.
-    Uses the OpenAI API (gpt-4o-mini-2024-07-18).
-    In the summary, include at least one direct citation (an exact quote) from the text that supports your analysis.
-    The citation should be enclosed in double quotes and reference the relevant section if possible.
+    Builds the user prompt used to summarize a piece of text.
     """
-    key = hashlib.sha256(text.encode("utf-8")).hexdigest()
-    if key in cache:
-        return cache[key]
-    
-    prompt = (
-        "Focus on the theme of social isolation. Summarize the following text. "
-        "In your summary, include at least one direct citation from the text (an exact quote) that supports your analysis of social isolation. "
+    return (
+        f"Focus on the theme of {theme}. Summarize the following text. "
+        f"In your summary, include at least one direct citation from the text (an exact quote) that supports your analysis of {theme}. "
         "Ensure that the citation is enclosed in double quotes and, if possible, indicate the section of the text.\n\n"
         f"{text}\n\n"
     )
-    response = openai.ChatCompletion.create(
-         model="gpt-4o-mini-2024-07-18",
-         messages=[
-             {"role": "system", "content": "You are a helpful assistant that summarizes text with emphasis on social isolation and includes citations from the text."},
-             {"role": "user", "content": prompt}
-         ],
+
+def _digest_prompt(text):
+    """
+    Builds the user prompt used to digest a piece of text without favouring any theme.
+    """
+    return (
+        "Write a neutral digest of the following text: what happens, the characters with what they say, think and feel, "
+        "the setting and the main ideas, without favouring any theme. "
+        "Include several direct citations from the text (exact quotes) that an analysis could rely on, enclosed in double quotes.\n\n"
+        f"{text}\n\n"
+    )
+
+def _combine_prompt(summaries, theme=DEFAULT_THEME):
+    """
+    Builds the user prompt used to merge the summaries of consecutive sections into one summary.
+    """
+    formatted_summaries = "\n\n".join(summaries)
+    return (
+        "The following are summaries of consecutive sections of the same book, in reading order. "
+        f"Combine them into a single coherent summary that focuses on the theme of {theme}. "
+        "Keep the most important direct citations (exact quotes) from the summaries, enclosed in double quotes.\n\n"
+        "Section Summaries:\n" + formatted_summaries + "\n\n"
+        "Combined Summary:"
+    )
+
+def summary_messages(text, theme=DEFAULT_THEME):
+    """Returns the chat messages that ask for the summary of one chunk, focused on a theme."""
+    return [
+        {"role": "system", "content": SUMMARY_SYSTEM_PROMPT.format(theme=theme)},
+        {"role": "user", "content": _summary_prompt(text, theme)}
+    ]
+
+def digest_messages(text):
+    """Returns the chat messages that ask for the theme-neutral digest of one chunk."""
+    return [
+        {"role": "system", "content": DIGEST_SYSTEM_PROMPT},
+        {"role": "user", "content": _digest_prompt(text)}
+    ]
+
+def combine_messages(summaries, theme=DEFAULT_THEME):
+    """Returns the chat messages that ask to merge the summaries (or digests) of consecutive sections."""
+    return [
+        {"role": "system", "content": SUMMARY_SYSTEM_PROMPT.format(theme=theme)},
+        {"role": "user", "content": _combine_prompt(summaries, theme)}
+    ]
+
+def reduce_groups(summaries, fanout=REDUCE_FANOUT):
+    """Splits a level of summaries into the groups of consecutive summaries merged by one reduce step."""
+    return [summaries[i:i + fanout] for i in range(0, len(summaries), fanout)]
+
+def summarize_text(text, theme=DEFAULT_THEME):
+    """
+    Summarizes the given text with emphasis on a theme (social isolation by default).
+    Uses the OpenAI API (gpt-4o-mini-2024-07-18).
+    In the summary, include at least one direct citation (an exact quote) from the text that supports your analysis.
+    The citation should be enclosed in double quotes and reference the relevant section if possible.
+    Responses are served from the persistent cache in llm_client when possible.
+    """
+    summary = chat_completion(
+         messages=summary_messages(text, theme),
          temperature=0.7,
-         max_tokens=150
+         max_tokens=SUMMARY_MAX_TOKENS,
+         priority=PRIORITY_BULK
     )
-    summary = response.choices[0].message["content"].strip()
-    cache[key] = summary
     return summary
 
-def analyze_comparative(summaries):
+async def summarize_text_async(text, semaphore, theme=DEFAULT_THEME):
     """
-    Compares the summaries from three books and returns a comparative analysis.
-    Uses the OpenAI API (gpt-4o-mini-2024-07-18).
+    Asynchronous counterpart of summarize_text used for the map step of summarize_book.
+    
+    Parameters:
+      - text (str): The chunk of text to summarize.
+      - semaphore (asyncio.Semaphore): Limits how many requests are in flight at once.
+      - theme (str): The theme the summary focuses on.
+    
+    Returns:
+      - str: A summary of the chunk focused on the theme.
+    """
+    async with semaphore:
+        with profiling.span("summarize_chunk", "chunk", chars=len(text)):
+            summary = await achat_completion(
+                 messages=summary_messages(text, theme),
+                 temperature=0.7,
+                 max_tokens=SUMMARY_MAX_TOKENS,
+                 priority=PRIORITY_BULK
+            )
+    return summary
+
+async def digest_text_async(text, semaphore):
+    """
+    Writes the theme-neutral digest of one chunk, the map step of digest_book.
+    
+    Parameters:
+      - text (str): The chunk of text to digest.
+      - semaphore (asyncio.Semaphore): Limits how many requests are in flight at once.
+    
+    Returns:
+      - str: A digest of the chunk, with citations, that any theme can be summarized from.
     """
+    async with semaphore:
+        with profiling.span("digest_chunk", "chunk", chars=len(text)):
+            digest = await achat_completion(
+                 messages=digest_messages(text),
+                 temperature=0.7,
+                 max_tokens=DIGEST_MAX_TOKENS,
+                 priority=PRIORITY_BULK
+            )
+    return digest
+
+async def combine_summaries_async(summaries, semaphore, theme=DEFAULT_THEME):
+    """
+    Merges the summaries of consecutive sections of a book into a single summary.
+    
+    Parameters:
+      - summaries (list): Summaries of consecutive sections, in reading order.
+      - semaphore (asyncio.Semaphore): Limits how many requests are in flight at once.
+      - theme (str): The theme the combined summary focuses on.
+    
+    Returns:
+      - str: The combined summary.
+    """
+    async with semaphore:
+        combined = await achat_completion(
+             messages=combine_messages(summaries, theme),
+             temperature=0.7,
+             max_tokens=COMBINE_MAX_TOKENS,
+             priority=PRIORITY_BULK
+        )
+    return combined
+
+async def _map_chunks(chunks, complete, semaphore, max_concurrency):
+    """
+    Runs complete(chunk, semaphore) on every chunk concurrently, admitting a new chunk only when a
+    request slot frees up, so a streamed book is never fully in memory. Returns the results in order.
+    """
+    admission = asyncio.Semaphore(max_concurrency)
+    tasks = []
+    for chunk in chunks:
+        await admission.acquire()
+        task = asyncio.ensure_future(complete(chunk, semaphore))
+        task.add_done_callback(lambda _: admission.release())
+        tasks.append(task)
+    return list(await asyncio.gather(*tasks))
+
+async def _reduce(summaries, semaphore, fanout, theme, at_least_once=False):
+    """
+    Merges neighbouring summaries level by level until one is left. With at_least_once=True a
+    single summary is still passed through one combine step (to focus a neutral digest on the theme).
+    """
+    level = 1
+    while len(summaries) > 1 or (at_least_once and level == 1 and summaries):
+        groups = reduce_groups(summaries, fanout)
+        print(f"Reducing {len(summaries)} summaries into {len(groups)} (level {level})...")
+        summaries = await asyncio.gather(*(combine_summaries_async(group, semaphore, theme) for group in groups))
+        level += 1
+    return summaries[0] if summaries else ""
+
+async def summarize_book_async(chunks, max_concurrency=MAX_CONCURRENT_REQUESTS, fanout=REDUCE_FANOUT, theme=DEFAULT_THEME):
+    """
+    Summarizes a whole book with a map-reduce strategy.
+    
+    Parameters:
+      - chunks (iterable): The book split into chunks (see text_processing.chunk_spans). A generator
+        such as text_processing.iter_token_chunks is consumed lazily.
+      - max_concurrency (int): Maximum number of requests in flight at once.
+      - fanout (int): Number of summaries merged together at each reduce step.
+      - theme (str): The theme the summaries focus on.
+    
+    Returns:
+      - str: A summary of the whole book focused on the theme.
+    
+    Process:
+      - Map: every chunk is summarized concurrently, bounded by max_concurrency. A chunk is only
+        pulled from `chunks` when a request slot frees up, so a streamed book is never fully in memory.
+      - Reduce: consecutive summaries are merged in groups of `fanout` (chunk -> section -> book)
+        until a single summary remains. Groups on the same level are merged concurrently.
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+    summaries = await _map_chunks(
+        chunks, lambda chunk, slots: summarize_text_async(chunk, slots, theme), semaphore, max_concurrency)
+    return await _reduce(summaries, semaphore, fanout, theme)
+
+def summarize_book(chunks, max_concurrency=MAX_CONCURRENT_REQUESTS, fanout=REDUCE_FANOUT, theme=DEFAULT_THEME):
+    """
+    Synchronous entry point for summarize_book_async.
+    
+    Parameters:
+      - chunks (iterable): The book split into chunks (see text_processing.chunk_spans or iter_token_chunks).
+      - max_concurrency (int): Maximum number of requests in flight at once.
+      - fanout (int): Number of summaries merged together at each reduce step.
+      - theme (str): The theme the summaries focus on.
+    
+    Returns:
+      - str: A summary of the whole book focused on the theme.
+    """
+    return asyncio.run(summarize_book_async(chunks, max_concurrency, fanout, theme))
+
+def digest_book(chunks, max_concurrency=MAX_CONCURRENT_REQUESTS):
+    """
+    Map step shared by every theme: writes the theme-neutral digest of each chunk of a book.
+    
+    Parameters:
+      - chunks (iterable): The book split into chunks, consumed lazily.
+      - max_concurrency (int): Maximum number of requests in flight at once.
+    
+    Returns:
+      - list of str: One digest per chunk, in reading order (see summarize_digests).
+    """
+    async def run():
+        return await _map_chunks(chunks, digest_text_async, asyncio.Semaphore(max_concurrency), max_concurrency)
+    return asyncio.run(run())
+
+def summarize_digests(digests, theme=DEFAULT_THEME, max_concurrency=MAX_CONCURRENT_REQUESTS, fanout=REDUCE_FANOUT):
+    """
+    Theme-specific reduce step: merges the neutral digests of a book (see digest_book) into one
+    summary focused on a theme, with the same fan-in as summarize_book. A book with a single
+    digest still goes through one combine step so that its summary is about the theme.
+    
+    Parameters:
+      - digests (list): The book's chunk digests, in reading order.
+      - theme (str): The theme the summary focuses on.
+      - max_concurrency (int): Maximum number of requests in flight at once.
+      - fanout (int): Number of summaries merged together at each reduce step.
+    
+    Returns:
+      - str: A summary of the whole book focused on the theme ("" for a book without digests).
+    """
+    async def run():
+        return await _reduce(list(digests), asyncio.Semaphore(max_concurrency), fanout, theme, at_least_once=True)
+    return asyncio.run(run())
+
+def comparative_messages(summaries, theme=DEFAULT_THEME):
+    """Returns the chat messages that ask for the comparative analysis of the book summaries."""
     formatted_summaries = "\n\n".join(summaries)
     
     prompt = (
-        "Compare these book summaries in terms of how they address social isolation. Make sure to include any direct citations (exact quotes) from the texts if present.\n"
+        f"Compare these book summaries in terms of how they address {theme}. Make sure to include any direct citations (exact quotes) from the texts if present.\n"
         "Summaries:\n" + formatted_summaries + "\n\n"
         "Comparison:"
     )
-    
-    response = openai.ChatCompletion.create(
-         model="gpt-4o-mini-2024-07-18",
-         messages=[
-             {"role": "system", "content": "You are a helpful assistant that compares summaries with emphasis on social isolation and includes citations where applicable."},
-             {"role": "user", "content": prompt}
-         ],
+    return [
+        {"role": "system", "content": f"You are a helpful assistant that compares summaries with emphasis on {theme} and includes citations where applicable."},
+        {"role": "user", "content": prompt}
+    ]
+
+def analyze_comparative(summaries, theme=DEFAULT_THEME):
+    """
+    Compares the summaries of the books and returns a comparative analysis of how they address a theme.
+    Uses the OpenAI API (gpt-4o-mini-2024-07-18).
+    """
+    analysis = chat_completion(
+         messages=comparative_messages(summaries, theme),
          temperature=0.7,
-         max_tokens=300
+         max_tokens=COMPARATIVE_MAX_TOKENS
     )
-    analysis = response.choices[0].message["content"].strip()
     return analysis
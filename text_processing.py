@@ -1,5 +1,64 @@
 import re
+import functools
+from collections import namedtuple
 import nltk
+import tiktoken
+import profiling
+
+# Matches any run of whitespace characters.
+WHITESPACE_PATTERN = re.compile(r'\s+')
+
+# Number of characters buffered by iter_sentences before the buffer is segmented.
+SENTENCE_WINDOW = 20000
+
+# A sentence found by iter_sentences, with its character and UTF-8 byte offsets in the stream.
+SentenceSpan = namedtuple("SentenceSpan", ["text", "start", "end", "byte_start", "byte_end"])
+
+# tiktoken encoding used to count model tokens (that of the gpt-4o family). If it cannot be
+# loaded (it is downloaded on first use), token counts fall back to estimate_tokens.
+TOKEN_ENCODING = "o200k_base"
+
+# Default token budget of a summarization chunk (about the 4000 characters chunks used to have).
+CHUNK_TOKENS = 1000
+
+# Default number of tokens of trailing sentences repeated at the start of the next chunk.
+CHUNK_OVERLAP_TOKENS = 0
+
+# A word with the whitespace that follows it, the unit oversized sentences are cut at.
+WORD_SPAN_PATTERN = re.compile(r'\S+\s*')
+
+@functools.lru_cache(maxsize=None)
+def get_sentence_tokenizer(language="english"):
+    """
+    Loads NLTK's Punkt sentence tokenizer once and reuses it for every later call.
+    
+    Parameters:
+      language (str): The Punkt model to load. Default is English.
+    
+    Returns:
+      The loaded tokenizer, which provides tokenize() and span_tokenize().
+    """
+    try:
+        # NLTK 3.8.2+ ships the model as plain tables ("punkt_tab").
+        from nltk.tokenize import PunktTokenizer
+        return PunktTokenizer(language)
+    except ImportError:
+        return nltk.data.load(f"tokenizers/punkt/{language}.pickle")
+
+def sentence_spans(text):
+    """
+    Returns the (start, end) character offsets of every sentence in the text.
+    
+    The offsets match the sentences produced by nltk.tokenize.sent_tokenize, so
+    text[start:end] is one sentence, without copying the sentences themselves.
+    
+    Parameters:
+      text (str): The input text.
+    
+    Returns:
+      list of tuple: (start, end) pairs in reading order.
+    """
+    return list(get_sentence_tokenizer().span_tokenize(text))
 
 def clean_text(text):
     """
@@ -18,6 +77,310 @@ def clean_text(text):
     # Replace one or more whitespace characters with a single space and remove surrounding spaces.
     return re.sub(r'\s+', ' ', text).strip()
 
+def estimate_tokens(text):
+    """
+    Roughly estimates the number of model tokens in a text (about four characters per token for English).
+    
+    Parameters:
+      text (str): The input text.
+    
+    Returns:
+      int: The estimated token count.
+    """
+    return (len(text) + 3) // 4
+
+@functools.lru_cache(maxsize=None)
+def get_token_encoder(encoding=TOKEN_ENCODING):
+    """
+    Loads a tiktoken encoding once and reuses it for every later call.
+    
+    Parameters:
+      encoding (str): The name of the encoding.
+    
+    Returns:
+      The encoding, or None when it cannot be loaded, e.g. offline before its first download
+      (count_tokens then estimates from the length of the text, and says so once).
+    """
+    try:
+        return tiktoken.get_encoding(encoding)
+    except Exception as e:
+        print(f"Could not load the {encoding} tokenizer ({e}); estimating tokens from text length.")
+        return None
+
+def count_tokens(text):
+    """
+    Counts the model tokens in a text with the local tokenizer (see get_token_encoder),
+    or estimates them with estimate_tokens when it is not available.
+    
+    Parameters:
+      text (str): The input text.
+    
+    Returns:
+      int: The token count.
+    """
+    encoder = get_token_encoder()
+    if encoder is None:
+        return estimate_tokens(text)
+    return len(encoder.encode_ordinary(text))
+
+def split_oversized(text, max_tokens):
+    """
+    Cuts a sentence longer than the token budget into pieces that fit it.
+    
+    Pieces are measured exactly as token_pieces measures them (count_tokens(" " + piece)), and
+    each is the longest run of whole words that fits, found by bisection. A single word longer
+    than the budget (a URL, a run of symbols) is cut at the longest prefix that fits, so no
+    piece is ever over max_tokens.
+    
+    Parameters:
+      text (str): The sentence.
+      max_tokens (int): The maximum number of tokens per piece.
+    
+    Returns:
+      list of tuple: (start, end) character offsets of the pieces in the sentence, in order.
+    """
+    words = [(match.start(), match.start() + len(match.group().rstrip())) for match in WORD_SPAN_PATTERN.finditer(text)]
+    sizes = [count_tokens(" " + text[word_start:word_end]) for word_start, word_end in words]
+
+    def longest(start, ends):
+        """The last of the (increasing) candidate ends whose piece from start fits, or None."""
+        low, high = -1, len(ends)
+        while high - low > 1:
+            middle = (low + high) // 2
+            if count_tokens(" " + text[start:ends[middle]]) <= max_tokens:
+                low = middle
+            else:
+                high = middle
+        return ends[low] if low >= 0 else None
+
+    pieces = []
+    i = 0
+    start = words[0][0] if words else None
+    while i < len(words):
+        # Candidate ends: the next words while their separately counted tokens stay within twice the budget.
+        j = i
+        total = 0
+        while j < len(words) and total <= 2 * max_tokens:
+            total += sizes[j]
+            j += 1
+        end = longest(start, [word_end for _, word_end in words[i:j]])
+        if end is None:
+            end = longest(start, range(start + 1, words[i][1] + 1)) or start + 1
+        pieces.append((start, end))
+        while i < len(words) and words[i][1] <= end:
+            i += 1
+        if i < len(words):
+            start = max(end, words[i][0])
+    return pieces
+
+def token_pieces(sentences, max_tokens, byte_offsets=False):
+    """
+    Measures sentences in tokens, cutting the ones longer than the budget (see split_oversized).
+    
+    Parameters:
+      sentences (iterable): (text, start) pairs: each sentence and its offset in the source.
+      max_tokens (int): The maximum number of tokens per piece.
+      byte_offsets (bool): Offsets are UTF-8 byte offsets instead of character offsets.
+    
+    Yields:
+      tuple: (start, end, tokens, text) for every sentence or piece of a sentence, in order.
+    """
+    def length(text):
+        return len(text.encode("utf-8")) if byte_offsets else len(text)
+    
+    def measure(text):
+        # Counted with the space that joins it to the previous piece, so the pieces of a
+        # chunk add up to (at least) the tokens of the chunk.
+        return count_tokens(" " + text)
+    
+    for text, start in sentences:
+        tokens = measure(text)
+        if tokens <= max_tokens:
+            yield start, start + length(text), tokens, text
+            continue
+        for piece_start, piece_end in split_oversized(text, max_tokens):
+            offset = start + length(text[:piece_start])
+            piece = text[piece_start:piece_end]
+            yield offset, offset + length(piece), measure(piece), piece
+
+def iter_packed(pieces, max_tokens, overlap_tokens=0):
+    """
+    Groups consecutive sentences (or pieces of sentences) into chunks within a token budget.
+    
+    A chunk is closed when the next piece would take it over max_tokens. The next chunk then
+    starts with the trailing pieces of the closed one that add up to at most overlap_tokens,
+    so context carries over between chunks; the overlap is counted in the budget.
+    
+    Parameters:
+      pieces (iterable): (start, end, tokens, ...) tuples in order, none over max_tokens (see token_pieces).
+      max_tokens (int): The maximum number of tokens per chunk.
+      overlap_tokens (int): The maximum number of tokens repeated from the previous chunk.
+    
+    Yields:
+      list of tuple: The pieces of each chunk, as soon as it is closed, without empty chunks.
+    """
+    current = []
+    total = 0
+    for piece in pieces:
+        tokens = piece[2]
+        if current and total + tokens > max_tokens:
+            yield current
+            carried = []
+            carried_tokens = 0
+            # The carried pieces always leave room for the new one, so every chunk makes progress.
+            for previous in reversed(current[1:]):
+                if carried_tokens + previous[2] > min(overlap_tokens, max_tokens - tokens):
+                    break
+                carried.insert(0, previous)
+                carried_tokens += previous[2]
+            current, total = carried, carried_tokens
+        current.append(piece)
+        total += tokens
+    if current:
+        yield current
+
+def pack_spans(pieces, max_tokens, overlap_tokens=0):
+    """
+    Groups pieces into chunks with iter_packed.
+    
+    Returns:
+      list of tuple: (start, end) offsets of every chunk in the source, without empty chunks.
+    """
+    return [(chunk[0][0], chunk[-1][1]) for chunk in iter_packed(pieces, max_tokens, overlap_tokens)]
+
+def chunk_spans(text, max_tokens=CHUNK_TOKENS, overlap_tokens=CHUNK_OVERLAP_TOKENS):
+    """
+    Splits text into sentence-aligned chunks of up to max_tokens model tokens.
+    
+    Token-budgeted replacement for chunk_text: sentences come from the cached Punkt tokenizer
+    (see sentence_spans), are measured with the local tokenizer (see count_tokens), and
+    sentences longer than the budget are cut at word boundaries instead of making an
+    oversized chunk. The chunks are returned as offsets, so text[start:end] is a chunk and
+    nothing is copied until it is needed.
+    
+    Parameters:
+      text (str): The input text to be divided into chunks.
+      max_tokens (int): The maximum number of tokens per chunk. Default is CHUNK_TOKENS.
+      overlap_tokens (int): The maximum number of tokens of trailing sentences repeated at the
+        start of the next chunk. Default is CHUNK_OVERLAP_TOKENS.
+    
+    Returns:
+      list of tuple: (start, end) character offsets of every chunk in text.
+    """
+    sentences = ((text[start:end], start) for start, end in sentence_spans(text))
+    return pack_spans(token_pieces(sentences, max_tokens), max_tokens, overlap_tokens)
+
+def iter_clean(pieces):
+    """
+    Streaming counterpart of clean_text.
+    
+    Collapses whitespace across a stream of text pieces, without joining them, so that
+    "".join(iter_clean(pieces)) == clean_text("".join(pieces)).
+    
+    Parameters:
+      pieces (iterable of str): The raw text, in order (e.g. from ingestion.iter_book).
+    
+    Yields:
+      str: Cleaned pieces of text.
+    """
+    pending_space = False
+    started = False
+    for piece in pieces:
+        piece = WHITESPACE_PATTERN.sub(" ", piece)
+        if not piece:
+            continue
+        body = piece.strip(" ")
+        if not body:
+            # Whitespace only: remember it so the next word is separated from the previous one.
+            pending_space = True
+            continue
+        if started and (pending_space or piece.startswith(" ")):
+            yield " "
+        yield body
+        started = True
+        pending_space = piece.endswith(" ")
+
+def iter_sentences(pieces, window=SENTENCE_WINDOW):
+    """
+    Segments a stream of cleaned text into sentences incrementally.
+    
+    Text is buffered until it holds at least `window` characters; the buffer is then segmented
+    and every sentence except the last one (which may continue in the next piece) is yielded.
+    Memory is bounded by the window and the size of the largest piece, not by the book.
+    
+    Parameters:
+      pieces (iterable of str): Cleaned text, in order (e.g. from iter_clean).
+      window (int): Minimum number of buffered characters before segmenting.
+    
+    Yields:
+      SentenceSpan: Each sentence with its offsets in the concatenated stream.
+    """
+    tokenizer = get_sentence_tokenizer()
+    buffer = ""
+    offset = 0
+    byte_offset = 0
+    
+    def segment():
+        # Runs the sentence tokenizer over the buffer, timed as a 'tokenize' span when profiling.
+        with profiling.span("span_tokenize", "tokenize", chars=len(buffer)):
+            return list(tokenizer.span_tokenize(buffer))
+    
+    def emit(spans):
+        # Converts buffer-relative spans into SentenceSpan tuples with stream offsets.
+        position = 0
+        byte_position = byte_offset
+        for start, end in spans:
+            byte_position += len(buffer[position:start].encode("utf-8"))
+            sentence = buffer[start:end]
+            byte_end = byte_position + len(sentence.encode("utf-8"))
+            yield SentenceSpan(sentence, offset + start, offset + end, byte_position, byte_end)
+            byte_position = byte_end
+            position = end
+    
+    for piece in pieces:
+        buffer += piece
+        if len(buffer) < window:
+            continue
+        spans = segment()
+        if len(spans) > 1:
+            # The last sentence may continue in the next piece; keep it buffered.
+            complete, cut = spans[:-1], spans[-1][0]
+        elif len(buffer) >= 4 * window:
+            # A single run-on "sentence" this long is flushed as is to keep memory bounded.
+            complete, cut = spans, len(buffer)
+        else:
+            continue
+        yield from emit(complete)
+        byte_offset += len(buffer[:cut].encode("utf-8"))
+        offset += cut
+        buffer = buffer[cut:]
+    yield from emit(segment())
+
+def iter_token_chunks(pieces, max_tokens=CHUNK_TOKENS, overlap_tokens=CHUNK_OVERLAP_TOKENS):
+    """
+    Streaming counterpart of chunk_spans.
+    
+    Groups the sentences found by iter_sentences into chunks of up to max_tokens model tokens
+    with the same rules (token_pieces, then iter_packed), yielding each chunk as soon as it is
+    complete. Only the current chunk and the sentence window are held in memory.
+    
+    Parameters:
+      pieces (iterable of str): Cleaned text, in order (e.g. from iter_clean).
+      max_tokens (int): The maximum number of tokens per chunk. Default is CHUNK_TOKENS.
+      overlap_tokens (int): The maximum number of tokens of trailing sentences repeated at the
+        start of the next chunk. Default is CHUNK_OVERLAP_TOKENS.
+    
+    Yields:
+      str: Text chunks, without empty chunks.
+    """
+    sentences = ((sentence.text, sentence.start) for sentence in iter_sentences(pieces))
+    for chunk in iter_packed(token_pieces(sentences, max_tokens), max_tokens, overlap_tokens):
+        # Pieces are joined by the (collapsed) whitespace between them in the stream, if any.
+        parts = [chunk[0][3]]
+        for previous, piece in zip(chunk, chunk[1:]):
+            parts.append(piece[3] if piece[0] == previous[1] else " " + piece[3])
+        yield "".join(parts)
+
 def chunk_text(text, max_chars=4000):
     """
     Splits text into chunks, each having up to max_chars characters.
@@ -31,7 +394,8 @@ def chunk_text(text, max_chars=4000):
       max_chars (int): The maximum number of characters allowed per chunk. Default is 4000.
     
     Returns:
-      list of str: A list where each element is a text chunk with a length up to max_chars.
+      list of str: A list where each element is a text chunk with a length up to max_chars
+      (a single sentence longer than max_chars makes a longer chunk; see chunk_spans).
     """
     # List to store the resulting chunks.
     chunks = []
@@ -43,8 +407,9 @@ def chunk_text(text, max_chars=4000):
     
     # Iterate over each sentence.
     for sentence in sentences:
-        # Check if adding the current sentence would exceed the maximum allowed characters.
-        if len(current_chunk) + len(sentence) <= max_chars:
+        # Check if adding the current sentence would exceed the maximum allowed characters
+        # (the first sentence always starts the first chunk, so no chunk is empty).
+        if not current_chunk or len(current_chunk) + len(sentence) <= max_chars:
             # If not, append the sentence to the current chunk (with a preceding space).
             current_chunk += " " + sentence
         else: